@@ -0,0 +1,360 @@
+import os
+import sys
+import json
+import random
+import shutil
+import logging
+import argparse
+import fnmatch
+import tempfile
+import subprocess
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+###################################### NOTES
+""" Benchmarks for the car/uav/network hot paths, run against the local Vissim stand-in.
+
+Every case runs in its own python process so that module level state and peak memory
+do not leak between cases. Latencies are reported per simulation step (or per call for the
+saveResults exporters, per fresh interpreter for the import_* cases).
+
+    python benchmarks/bench_hotpaths.py                          # run all cases
+    python benchmarks/bench_hotpaths.py "car_*" "sched_*"        # run matching cases
+    python benchmarks/bench_hotpaths.py --save-baseline base.json
+    python benchmarks/bench_hotpaths.py --baseline base.json     # exit code 1 on regressions
+"""
+
+logger = logging.getLogger(__name__)
+
+TRACKED_VEH_TYPES = [111, 112]
+CASES = OrderedDict() # name -> (function, default number of steps)
+
+
+def case(name, steps, *args):
+    def register(func):
+        CASES[name] = (func, steps, args)
+        return func
+    return register
+
+
+class _Handler:
+    """Minimal message handler, messages are accepted and ignored."""
+    msg_types = {'loc': 0}
+
+    @staticmethod
+    def send(agent, recipient_id=-1, msg_type='loc', payload='null'):
+        return {'recipient_id': recipient_id, 'msg_type': msg_type, 'payload': payload}
+
+    @staticmethod
+    def receive(agent, sender_id, msg_type, payload):
+        return None
+
+
+def _traffic(num_vehicles, results_dir):
+    from ptv_sim.standin import StandinVissim
+    from ptv_veh import car as vcar
+    Vissim = StandinVissim(num_vehicles=num_vehicles, veh_types=TRACKED_VEH_TYPES)
+    vcar.setup(Vissim, os.path.join(results_dir, "cars.csv"), TRACKED_VEH_TYPES)
+    vcar.update() # creates all car objects, not timed
+    return Vissim, vcar
+
+
+def _step(Vissim, vcar):
+    Vissim.Simulation.RunSingleStep()
+    vcar.update()
+
+
+######################
+# Cases
+######################
+def car_update(steps, results_dir, num_vehicles):
+    Vissim, vcar = _traffic(num_vehicles, results_dir)
+    samples = []
+    for i in range(steps):
+        Vissim.Simulation.RunSingleStep()
+        start = timer()
+        vcar.update()
+        samples.append(timer() - start)
+    return samples
+
+for _n in (100, 1000, 10000):
+    case('car_update_%d' % _n, 20 if _n < 10000 else 3, _n)(car_update)
+
+
+def car_retrieval(steps, results_dir, update_type):
+    Vissim, vcar = _traffic(1000, results_dir)
+    samples = []
+    for i in range(steps):
+        _step(Vissim, vcar)
+        cars = vcar.getCars()['active']
+        start = timer()
+        for car in cars:
+            car.update(update_type)
+        samples.append(timer() - start)
+    return samples
+
+case('car_retrieval_master', 20, 'master')(car_retrieval)
+case('car_retrieval_self', 20, 'self')(car_retrieval)
+
+
+def net_broadcast(steps, results_dir, num_broadcasts):
+    from ptv_comm import network as vnet
+    Vissim, vcar = _traffic(500, results_dir)
+    vnet.setup(Vissim, os.path.join(results_dir, "comms.csv"))
+    net = vnet.Net('dsrc', [vcar.Car.all_cars])
+    rng = random.Random(0)
+    samples = []
+    for i in range(steps):
+        _step(Vissim, vcar)
+        cars = vcar.getCars()['active']
+        for car in cars:
+            car.setComms(net)
+            car.setMsgHandler(_Handler)
+        senders = [rng.choice(cars) for j in range(num_broadcasts)]
+        start = timer()
+        for sender in senders:
+            net.broadcast(sender.position(), sender.comm_range, 'loc', 'null', -1, sender.id)
+        vnet.update()
+        samples.append(timer() - start)
+    return samples
+
+for _n in (1, 10, 100):
+    case('net_broadcast_%d' % _n, 10, _n)(net_broadcast)
+
+
+def sched(steps, results_dir, num_pending):
+    # keeps about num_pending events in the queue, events are due within 5 simulation seconds
+    from ptv_sim.standin import StandinVissim
+    from ptv_comm.network import Sched
+    Vissim = StandinVissim(num_vehicles=0)
+    s = Sched(lambda: float(Vissim.Simulation.AttValue('SimSec')))
+    rng = random.Random(0)
+    horizon = 5.0
+    per_step = max(1, int(num_pending / (horizon * Vissim.Simulation.AttValue('SimRes'))))
+    fired = []
+    for i in range(num_pending):
+        s.enter(rng.uniform(0, horizon), 1, fired.append, (i,))
+    samples = []
+    for i in range(steps):
+        Vissim.Simulation.RunSingleStep()
+        start = timer()
+        for j in range(per_step):
+            s.enter(rng.uniform(0, horizon), 1, fired.append, (j,))
+        s.update()
+        samples.append(timer() - start)
+    return samples
+
+for _n in (100, 1000, 10000):
+    case('sched_%d' % _n, 20, _n)(sched)
+
+
+def uav_update(steps, results_dir, num_uavs):
+    from ptv_veh import uav
+    Vissim, vcar = _traffic(1000, results_dir)
+    uav.setup(Vissim, results_dir + os.sep, uav_default={'camera_flag': True, 'model_flag': True})
+    for i in range(num_uavs):
+        uav.Model("uav.fbx")
+        uav.Camera()
+    cars = vcar.getCars()['active']
+    for i in range(num_uavs):
+        uav.UAV().setCar(cars[i % len(cars)])
+    samples = []
+    for i in range(steps):
+        _step(Vissim, vcar)
+        start = timer()
+        uav.update()
+        samples.append(timer() - start)
+    return samples
+
+for _n in (10, 100):
+    case('uav_update_%d' % _n, 20, _n)(uav_update)
+
+
+def save_results(steps, results_dir, module_name):
+    # steps is the number of saveResults() calls, the history is 100 steps of 1000 vehicles
+    from ptv_veh import uav
+    from ptv_comm import network as vnet
+    Vissim, vcar = _traffic(1000, results_dir)
+    uav.setup(Vissim, results_dir + os.sep, uav_default={'camera_flag': False, 'model_flag': False})
+    vnet.setup(Vissim, os.path.join(results_dir, "comms.csv"))
+    net = vnet.Net('dsrc', [vcar.Car.all_cars])
+    cars = vcar.getCars()['active']
+    for car in cars:
+        car.setComms(net)
+        car.setMsgHandler(_Handler)
+    for i in range(50):
+        uav.UAV().setCar(cars[i])
+    for i in range(100):
+        _step(Vissim, vcar)
+        uav.update()
+        for car in vcar.getCars()['new']:
+            car.setComms(net)
+            car.setMsgHandler(_Handler)
+        sender = cars[i]
+        net.broadcast(sender.position(), sender.comm_range, 'loc', {'location': sender.position()}, -1, sender.id)
+
+    module = {'car': vcar, 'uav': uav, 'network': vnet}[module_name]
+    filepath = os.path.join(results_dir, module_name + ".csv")
+    samples = []
+    for i in range(steps):
+        start = timer()
+        module.saveResults(filepath)
+        samples.append(timer() - start)
+    return samples
+
+for _name in ('car', 'uav', 'network'):
+    case('save_results_%s' % _name, 3, _name)(save_results)
+
+
+def import_time(steps, results_dir, module_name):
+    # every sample imports the module in a fresh interpreter, like Vissim does at every simulation start
+    code = ("import sys; from timeit import default_timer as timer; start = timer(); import " + module_name +
+            "; sys.stdout.write(repr(timer() - start))")
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.abspath(os.path.join(os.path.dirname(__file__), '..')), env.get('PYTHONPATH', '')])
+    samples = []
+    for i in range(steps):
+        output = subprocess.check_output([sys.executable, '-c', code], env=env)
+        samples.append(float(output.decode('utf-8').strip()))
+    return samples
+
+for _name in ('ptv_veh.car', 'ptv_veh.uav', 'ptv_comm.network'):
+    case('import_%s' % _name.split('.')[-1], 10, _name)(import_time)
+
+
+######################
+# Runner
+######################
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    idx = int(round(pct / 100.0 * (len(ordered) - 1)))
+    return ordered[idx]
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process, None if it cannot be determined."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024.0 / 1024.0 if sys.platform == 'darwin' else peak / 1024.0
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1024.0 / 1024.0
+    except (ImportError, AttributeError):
+        return None
+
+
+def run_case(name, steps):
+    func, default_steps, args = CASES[name]
+    results_dir = tempfile.mkdtemp()
+    try:
+        samples = func(steps or default_steps, results_dir, *args)
+    finally:
+        shutil.rmtree(results_dir, ignore_errors=True)
+    return {
+        'name': name,
+        'steps': len(samples),
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p90_ms': percentile(samples, 90) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'max_ms': max(samples) * 1000,
+        'peak_mb': peak_memory_mb(),
+    }
+
+
+def run_isolated(name, steps):
+    cmd = [sys.executable, os.path.abspath(__file__), '--run-case', name]
+    if steps:
+        cmd += ['--steps', str(steps)]
+    try:
+        output = subprocess.check_output(cmd)
+    except subprocess.CalledProcessError:
+        return None
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def compare(results, baseline, tolerance, min_delta_ms=0.5):
+    regressions = []
+    for result in results:
+        base = baseline.get(result['name'])
+        if not base:
+            continue
+        for key in ('p50_ms', 'p90_ms', 'peak_mb'):
+            if result[key] is None or not base.get(key):
+                continue
+            if key.endswith('_ms') and result[key] - base[key] < min_delta_ms:
+                continue # too small to tell apart from timer noise
+            if result[key] > base[key] * (1 + tolerance):
+                regressions.append("%s %s: %.3f -> %.3f (+%.0f%%)" % (
+                    result['name'], key, base[key], result[key], (result[key] / base[key] - 1) * 100))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the car/uav/network hot paths against the Vissim stand-in")
+    parser.add_argument('cases', nargs='*', help="case names or patterns, e.g. 'car_*' (default: all)")
+    parser.add_argument('--steps', type=int, default=None, help="override the number of timed steps per case")
+    parser.add_argument('--list', action='store_true', help="list the available cases")
+    parser.add_argument('--save-baseline', metavar='FILE', help="write the results to a baseline file")
+    parser.add_argument('--baseline', metavar='FILE', help="compare the results against a baseline file")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed relative slowdown before a regression is flagged")
+    parser.add_argument('--min-delta-ms', type=float, default=0.5, help="latency increases smaller than this are never flagged")
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.steps)))
+        return 0
+
+    if args.list:
+        for name in CASES:
+            print(name)
+        return 0
+
+    patterns = args.cases or ['*']
+    names = [name for name in CASES if any(fnmatch.fnmatch(name, pattern) for pattern in patterns)]
+
+    print("%-24s %6s %10s %10s %10s %10s %9s" % ('case', 'steps', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'peak MB'))
+    results = []
+    failed = False
+    for name in names:
+        result = run_isolated(name, args.steps)
+        if result is None:
+            print("%-24s FAILED" % name)
+            failed = True
+            continue
+        results.append(result)
+        peak = "%9.1f" % result['peak_mb'] if result['peak_mb'] is not None else "%9s" % 'n/a'
+        print("%-24s %6d %10.3f %10.3f %10.3f %10.3f %s" % (
+            name, result['steps'], result['p50_ms'], result['p90_ms'], result['p99_ms'], result['max_ms'], peak))
+        sys.stdout.flush()
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(dict((result['name'], result) for result in results), f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            return 1
+        print("No regressions against " + args.baseline)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
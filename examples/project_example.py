@@ -88,9 +88,29 @@ def Initialization():
     # Create a comm network to use. Can create multiple isolated networks for C-V2X, Bluetooth, etc
     vnet.Net('dsrc',[vcar.Car.all_cars])
 
+    # Comms, skills, and message logic need to be set for new vehicles
+    # The hooks are called from within vcar.update(), no need to scan cars['new'] and cars['null'] every step
+    vcar.addHook('on_car_created', setupNewCars, batch=True)
+    vcar.addHook('on_car_deactivated', handleExitedCars, batch=True)
+
     random.seed(Vissim.Simulation.AttValue('RandSeed')) # set random seed from PTV Vissim in order to be able to replicate the results.
 
 
+# Handle new vehicles that just entered the network
+def setupNewCars(new_cars):
+    logger.debug("There are "+str(len(new_cars))+" new cars")
+    for car in new_cars:
+        car.setComms(vnet.id(0))
+        car.setSkill(0) # might be useful to have this set via a distribution
+        car.setMsgLogic(dsrc)
+
+
+# Handle cars that have been deactivated
+def handleExitedCars(null_cars):
+    logger.debug("There are "+str(len(null_cars))+" recently deactivated cars")
+    for car in null_cars:
+        link = car.link # get Vissim link where vehicle exited simulation
+
 
 # the container function that will be called by VISSIM every step
 def runSingleStep():
@@ -98,24 +118,9 @@ def runSingleStep():
     ctime = Vissim.Simulation.AttValue('SimSec') # get current simulation second
 
     # Deactivate out of scope cars and get new info from Vissim for all active cars
-    vcar.update() # Do this every loop at the beginning
+    vcar.update() # Do this every loop at the beginning, calls the hooks for new and deactivated cars
     cars = vcar.getCars() # returns dict of lists of car objects [all_cars, active_cars, new_cars, null_cars]
 
-    # Handle cars that have been deactivted
-    null_cars = cars['null']
-    logger.debug("There are "+str(len(null_cars))+" recently deactivated cars")
-    for car in null_cars:
-        link = car.link # get Vissim link where vehicle exited simulation
-
-    # Handle new vehicles that just entered the network
-    # Comms, skills, and message logic need to be set for new vehicles
-    new_cars = cars['new']
-    logger.debug("There are "+str(len(new_cars))+" new cars")
-    for car in new_cars:
-        car.setComms(vnet.id(0))
-        car.setSkill(0) # might be useful to have this set via a distribution
-        car.setMsgLogic(dsrc)
-
     # Handle cars that are currently active in simulation
     active_cars = cars['active']
     logger.debug("There are "+str(len(active_cars))+" active cars")
@@ -2,7 +2,9 @@ import os
 import logging
 from collections import namedtuple
 import random
-import pandas as pd
+from ptv_sim import instrument
+from ptv_sim import hooks
+from ptv_sim import projection
 
 __author__ = "Garrett Dowd"
 __copyright__ = "Copyright (C) 2019 Garrett Dowd"
@@ -17,8 +19,12 @@ Usually, the methods in this module will not be used directly, instead wrapper m
 """
 
 logger = logging.getLogger(__name__)
+TIME = None # SimSec of the current step if set with setTime(), otherwise SimSec is read from Vissim
 Message = namedtuple('Message', 'timestamp, sender_id, sender_loc, recipient_id, recipient_loc, msg_type, payload, delay, dropped')
 Event = namedtuple('Event', 'time, priority, action, argument')
+HOOKS = {
+    'on_message_delivered': [], # function(net, message, agent) after agent.receiveMsg(), see addHook()
+}
 
 def setup(_Vissim, _RESULTS_DIR):
     """Call before beginning of simulation to initialize module.
@@ -39,13 +45,49 @@ def setup(_Vissim, _RESULTS_DIR):
     SIM_RES = Vissim.Simulation.AttValue('SimRes')
     
 
+def setTime(sim_time):
+    """Set the SimSec of the current step.
+
+    Messages are time stamped and scheduled with this time instead of reading SimSec from Vissim
+    for every message. Call at the beginning of every step (ptv_sim.driver does this), or never.
+
+    Args:
+        sim_time:(float) the current SimSec, None to read SimSec from Vissim again
+    """
+    global TIME
+    TIME = float(sim_time) if sim_time != None else None
+
+
+def addHook(event, function):
+    """Register a hook.
+
+    Args:
+        event:(string) 'on_message_delivered'
+        function:(function) called as function(net, message, agent) every time a message was delivered to an agent
+
+    A function that is already registered for the event is replaced, see ptv_sim.hooks.same().
+    """
+    if event not in HOOKS:
+        raise ValueError("Unknown hook '" + str(event) + "', options are " + str(sorted(HOOKS)))
+    # registered again (e.g. by the project script at the next simulation start): replace, do not call twice
+    HOOKS[event][:] = [hook for hook in HOOKS[event] if not hooks.same(hook, function)]
+    HOOKS[event].append(function)
+
+
+def removeHook(event, function):
+    """Unregister a hook that was registered with addHook()."""
+    HOOKS[event][:] = [hook for hook in HOOKS[event] if hook != function]
+
+
 def update():
     """Call every time step to update messages.
 
     This makes sure that every network is updated and messages are sent.
     """
+    started = instrument.start()
     for net in Net.all_nets:
         net.update()
+    instrument.stop('network.update', started, len(Net.all_nets))
 
 
 class Net:
@@ -128,10 +170,18 @@ class Net:
             sender_id: (integer) -1 means that the message is being sent anonymously
 
         Recipient_id must be unique among all agents - this is a reason to implement IP networking
+        Every agent of a plain list gets a message, dropped if it is out of range. Agent lists with a near()
+        method (e.g. ptv_comm.rsu.RSU.all_rsus) only give the agents that may be in range, the agents they
+        leave out get no dropped message in all_messages.
         """
+        started = instrument.start()
+        num_messages = len(self.all_messages)
 
         if recipient_id == -1: # broadcast to all agents NOT including self (unless sent anonymously)
             for agent_list in self.agents:
+                # spatially indexed agent lists (e.g. ptv_comm.rsu.RSU.all_rsus) only give the agents that may be in range
+                if hasattr(agent_list, 'near'):
+                    agent_list = agent_list.near(broadcast_location, comm_range)
                 for agent in agent_list:
                     if agent.id != sender_id:
                         msg = self._createMsg(sender_id, agent.id, msg_type, payload, broadcast_location, agent.position(), comm_range)
@@ -146,12 +196,37 @@ class Net:
                     logger.error("When broadcasting a message, given recipient_id #"+str(recipient_id)+" does not exist")
                     # Vissim.Simulation.Stop()
 
+        instrument.stop('net.broadcast', started, len(self.all_messages) - num_messages)
+
+    def broadcastTo(self, agents, broadcast_location, comm_range, msg_type, payload, sender_id = -1, in_range = ()):
+        """ Sends a message to candidate agents only, e.g. the cars an RSU found in its coverage (see ptv_comm.rsu).
+
+        Args:
+            agents:(list) the candidate recipients, agents that are not in range are dropped as usual
+            broadcast_location:(list) [X,Y] or [X,Y,Z]
+            comm_range:(float) rated distance at which the transmitter can send a message
+            msg_type:(*) externally defined message type
+            payload:(*) parsing of payload is left to receiving agents
+            sender_id: (integer) -1 means that the message is being sent anonymously
+            in_range:(list) candidates that are known to be in range
+
+        Unlike broadcast(), agents that are not candidates get no (dropped) message. Every candidate, also
+        the ones in in_range, goes through the drop model with its distance.
+        """
+        started = instrument.start()
+        num_messages = len(self.all_messages)
+        for agent in list(in_range) + list(agents):
+            if agent.id != sender_id:
+                msg = self._createMsg(sender_id, agent.id, msg_type, payload, broadcast_location, agent.position(), comm_range)
+                self._scheduleMsg(msg, agent)
+        instrument.stop('net.broadcast', started, len(self.all_messages) - num_messages)
+
     def _createMsg(self, sender_id, recipient_id, msg_type, payload, sender_loc, recipient_loc, comm_range):
         """Sub- function to create a message and calculate metadata.
 
         This function creates a Message with delay and drop metadata
         """
-        time = Vissim.Simulation.AttValue('SimSec')
+        time = self._timefunc()
         delay = self._delay()
         dist = self._dist(sender_loc,recipient_loc)
         dropped = self._drop(dist, comm_range)
@@ -159,33 +234,39 @@ class Net:
         self.all_messages.append(msg)
         return msg
 
-    def _scheduleMsg(self, message):
+    def _scheduleMsg(self, message, agent=None):
         """Schedule the message for future.
 
         Args:
             message:(Message)
+            agent:(object) the recipient if it is already known
 
         If the delay is less than the simulation time step resolution then it sends it immediately.
         Otherwise it schedules the message to be sent in the future.
         """
         if message.dropped == 0:
             if message.delay < SIM_RES:
-                self._sendMsg(message)
+                self._sendMsg(message, agent)
             else:
-                self.s.enter(message.delay,1,self._sendMsg,(message))
+                self.s.enter(message.delay,1,self._sendMsg,(message, agent))
 
-    def _sendMsg(self, message):
+    def _sendMsg(self, message, recipient=None):
         """This delivers a message to a recipient.
 
         Args:
             message:(Message)
+            recipient:(object) the recipient if it is already known
 
         Find the correct agent and call that agents receive message function.
         """
-        for agent_list in self.agents:
+        for agent_list in ([[recipient]] if recipient != None else self.agents):
             agent = next((agent for agent in agent_list if agent.id==message.recipient_id), None)
             if agent != None:
+                started = instrument.start()
                 agent.receiveMsg(message.sender_id, message.msg_type, message.payload)
+                instrument.stop('net.handlers', started, 1)
+                for function in HOOKS['on_message_delivered']:
+                    function(self, message, agent)
 
     
     def _delay(self):
@@ -240,7 +321,9 @@ class Net:
             return 1 # message is dropped
 
     def _timefunc(self):
-        """Returns Vissim SimSec."""
+        """Returns Vissim SimSec, or the time given to setTime()."""
+        if TIME != None:
+            return TIME
         return float(Vissim.Simulation.AttValue('SimSec'))
 
 
@@ -253,6 +336,7 @@ def saveResults(filepath=None):
 
     If a file path is not given then the default will be used
     """
+    import pandas as pd
     # make sure that the necessary folder structure exists
     if filepath == None:
         filepath = RESULTS_DIR
@@ -282,6 +366,9 @@ def saveResults(filepath=None):
 
     df = pd.DataFrame(df)
     df = df.reindex(columns=column_comms)  # ensure columns are in correct order
+    if projection.PROJECTION != None: # global coordinates of the message locations
+        for loc in ('sender', 'recipient'):
+            projection.PROJECTION.addColumns(df, [xy[0] for xy in df[loc + '_loc']], [xy[1] for xy in df[loc + '_loc']], loc + '_')
     # df = df.iloc[::-1] # reverse order of rows
     df.to_csv(filepath, encoding='utf-8', index=False)
 
@@ -314,7 +401,7 @@ class Sched:
         """
         event = Event(time, priority, action, argument)
         self._queue.append(event)
-        self._queue.sort(key=lambda x: x[1][0]) # sort by time
+        self._queue.sort(key=lambda x: x[0]) # sort by time
         return event # The ID
 
     def enter(self, delay, priority, action, argument):
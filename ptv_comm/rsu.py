@@ -0,0 +1,290 @@
+import math
+import logging
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""Stationary roadside units (RSU) as agents of ptv_comm.network.
+
+RSUs never move, so what they cover is computed once when they are created: every grid cell of
+    CELL_SIZE that lies completely in range (full) or partly in range (boundary) of the RSU. Every
+    step the active cars are indexed by grid cell and by link (carIndex()). A broadcast of an RSU
+    then only looks at the cars of its full cells (in range) and boundary cells (maybe in range)
+    instead of every agent of the network. Their messages go through the drop model of the network
+    with their distance as usual.
+    An RSU with links only sends to the cars on these links (e.g. its approaches).
+Receptions work the other way around: RSU.all_rsus is indexed by grid cell, and Net.broadcast() of
+    a car only looks at the RSUs in the cells within the sender's range.
+Only the candidates get a message: cars out of range of an RSU get no dropped message in the log,
+    and only cars that use the network of the RSU (car.comms) receive its messages.
+
+Cars are assumed at Z=0, an RSU is at its height Z (position [X,Y,Z]).
+RSU ids start at ID_OFFSET so that they do not collide with the Vissim numbers of the cars, the
+    recipient ids of ptv_comm.network must be unique among all agents.
+
+Example:
+    rsu.setup(Vissim, RESULTS_DIR)
+    net = vnet.Net('dsrc', [vcar.Car.all_cars, rsu.RSU.all_rsus])
+    unit = rsu.RSU([120.0, 455.0, 6.0], comm_range=300, comms=net, msg_handler=message_handler_example)
+    unit.sendMsg(msg_type='RSA')
+"""
+
+logger = logging.getLogger(__name__)
+
+CELL_SIZE = 50.0 # [m] of the grid cells of the coverage and the car index
+ID_OFFSET = 1000000
+RSU_DEFAULT = {
+    'comm_range': 300,
+    'comms': None,
+    'msg_handler': None,
+    'links': None, # only send to cars on these links, None for all links
+    'controller': None, # signal controller of the RSU, for SPaT broadcasts (see ptv_comm.spat)
+}
+_INDEX = None # CarIndex of the current step, see carIndex()
+
+
+def setup(_Vissim, _RESULTS_DIR, cell_size=None):
+    """Call before beginning of simulation to initialize module.
+
+    Args:
+        _Vissim:(COM) the Vissim COM object associated with your simulation, commonly "Vissim"
+        _RESULTS_DIR:(string) an absolute directory
+        cell_size:(float) size of the grid cells, set before any RSU is created
+    """
+    global Vissim       #follows naming convention of standard Vissim COM interface
+    global RESULTS_DIR
+    global CELL_SIZE
+
+    Vissim = _Vissim
+    RESULTS_DIR = _RESULTS_DIR
+    if cell_size != None:
+        if RSU.all_rsus:
+            logger.error("Cell size can only be changed before RSUs are created")
+        else:
+            CELL_SIZE = float(cell_size)
+
+
+def getRSUs():
+    rsus = dict()
+    rsus['all'] = RSU.all_rsus
+    return rsus
+
+
+def carIndex():
+    """Returns the CarIndex of the active cars, built once per car.update()."""
+    global _INDEX
+    from ptv_veh.car import Car
+    if _INDEX == None or _INDEX.source is not Car.all_vissim_cars:
+        _INDEX = CarIndex(Car.active_cars, Car.all_vissim_cars)
+    return _INDEX
+
+
+class CarIndex:
+    """The active cars of one step by grid cell and by link.
+
+    Attributes:
+        cells:(dict) (i, j) -> list of cars
+        links:(dict) link number -> list of cars
+        source:(list) the car snapshot the index was built for (Car.all_vissim_cars)
+    """
+
+    def __init__(self, cars, source=None):
+        self.source = source
+        self.cells = dict()
+        self.links = dict()
+        for car in cars:
+            cell = (int(math.floor(car.x[-1] / CELL_SIZE)), int(math.floor(car.y[-1] / CELL_SIZE)))
+            self.cells.setdefault(cell, []).append(car)
+            self.links.setdefault(car.link, []).append(car)
+
+
+class Roadside(list):
+    """The list of all RSUs, indexed by grid cell for Net.broadcast()."""
+
+    def __init__(self, *args):
+        list.__init__(self, *args)
+        self.cells = dict() # (i, j) -> RSUs located in the cell
+        for unit in self:
+            self.cells.setdefault(unit.cell, []).append(unit)
+
+    def append(self, unit):
+        list.append(self, unit)
+        self.cells.setdefault(unit.cell, []).append(unit)
+
+    def near(self, location, comm_range):
+        """Returns the RSUs that may be within comm_range of location."""
+        reach = int(math.ceil(comm_range / CELL_SIZE))
+        if len(self) <= (2 * reach + 1) ** 2: # fewer RSUs than cells to look at
+            return self
+        i0 = int(math.floor(location[0] / CELL_SIZE))
+        j0 = int(math.floor(location[1] / CELL_SIZE))
+        near = []
+        for i in range(i0 - reach, i0 + reach + 1):
+            for j in range(j0 - reach, j0 + reach + 1):
+                near.extend(self.cells.get((i, j), ()))
+        return near
+
+
+class RSU:
+    """A stationary roadside unit.
+
+    Attributes:
+        id:(int) unique id, from ID_OFFSET
+        pos:(list) [X,Y,Z] location
+        cell:(tuple) grid cell of the location
+        comm_range:(float) range of the transmitter
+        comms:(Net) the network of the RSU
+        m:(module) the message handler, see examples/message_handler_example.py
+        links:(list) only send to cars on these links, None for all links
+        controller:(int) number of the signal controller of the RSU, None if it has none
+        full_cells:(set) grid cells that are completely in range (of cars at Z=0)
+        boundary_cells:(set) grid cells that are partly in range
+        all_rsus:(list) list of all RSUs
+    """
+
+    all_rsus = Roadside()
+
+    def __eq__(self, other):
+        if other:
+            return self.id == other.id
+        else:
+            return False
+
+    def __init__(self, position, comm_range=None, comms=None, msg_handler=None, links=None, controller=None, parameters=None):
+        """Create an RSU and compute its coverage.
+
+        Args:
+            position:(list) [X,Y] or [X,Y,Z] location
+            comm_range:(float) range of the transmitter, defaults to RSU_DEFAULT
+            comms:(Net) the network of the RSU
+            msg_handler:(module) the message handler
+            links:(list) only send to cars on these links
+            controller:(int) number of the signal controller the RSU broadcasts the SPaT of
+            parameters:(dict) overrides of RSU_DEFAULT
+        """
+        rsu_default = dict(RSU_DEFAULT)
+        if parameters != None:
+            rsu_default.update(parameters)
+        if len(position) not in (2, 3):
+            logger.critical("RSU instantiation, invalid position: "+ str(position))
+            Vissim.Simulation.Stop()
+        if not self.all_rsus:
+            self.id = ID_OFFSET
+        else:
+            self.id = max([unit.id for unit in self.all_rsus]) + 1
+        self.pos = [float(position[0]), float(position[1]), float(position[2]) if len(position) == 3 else 0.0]
+        self.cell = (int(math.floor(self.pos[0] / CELL_SIZE)), int(math.floor(self.pos[1] / CELL_SIZE)))
+        self.comm_range = comm_range if comm_range != None else rsu_default['comm_range']
+        self.comms = comms if comms != None else rsu_default['comms']
+        self.m = msg_handler if msg_handler != None else rsu_default['msg_handler']
+        self.links = links if links != None else rsu_default['links']
+        self.controller = controller if controller != None else rsu_default['controller']
+        self.active = True
+        self._cover()
+        logger.info("Creating RSU # "+str(self.id)+" at "+str(self.pos)+" covering "+str(len(self.full_cells))
+                    +" cells and "+str(len(self.boundary_cells))+" boundary cells")
+        RSU.all_rsus.append(self)
+
+    def position(self):
+        return list(self.pos)
+
+    def candidates(self, links=None):
+        """Returns (cars in range, cars that may be in range) from the car index of this step.
+
+        Args:
+            links:(list) only cars on these links, defaults to the links of the RSU (None for all)
+        """
+        index = carIndex()
+        links = links if links != None else self.links
+        in_range = []
+        maybe = []
+        if links != None:
+            for link in links:
+                for car in index.links.get(link, ()):
+                    cell = (int(math.floor(car.x[-1] / CELL_SIZE)), int(math.floor(car.y[-1] / CELL_SIZE)))
+                    if cell in self.full_cells:
+                        in_range.append(car)
+                    elif cell in self.boundary_cells:
+                        maybe.append(car)
+        else:
+            for cell in self.full_cells:
+                in_range.extend(index.cells.get(cell, ()))
+            for cell in self.boundary_cells:
+                maybe.extend(index.cells.get(cell, ()))
+        return ([car for car in in_range if car.comms == self.comms],
+                [car for car in maybe if car.comms == self.comms])
+
+    #######################################################
+    """ Communication functions go here
+
+    """
+    def sendMsg(self, recipient_id=-1, msg_type='loc', payload='null', links=None):
+        if self.comms == None:
+            logger.error("Comms was not set up for RSU with ID "+str(self.id)+" cannot sendMsg()")
+            return 0
+        if self.m == None:
+            logger.error("Message logic was not set up for RSU with ID "+str(self.id)+" cannot sendMsg()")
+            return 0
+        if msg_type not in self.m.msg_types:
+            logger.error("Message type" + str(msg_type )+ "is not a valid type for RSU with ID "+str(self.id)+", cannot sendMsg()")
+            return 0
+
+        result = self.m.send(self, recipient_id, msg_type, payload)
+
+        recipient_id = result['recipient_id']
+        msg_type = result['msg_type']
+        payload = result['payload']
+
+        logger.debug("RSU # " + str(self.id) + " sending payload "+str(payload) +" to " + str(recipient_id))
+        if recipient_id == -1:
+            in_range, maybe = self.candidates(links)
+            self.comms.broadcastTo(maybe, self.position(), self.comm_range, msg_type, payload, self.id, in_range)
+        else:
+            self.comms.broadcast(self.position(), self.comm_range, msg_type, payload, recipient_id, self.id)
+        return 1
+
+    def receiveMsg(self, sender_id, msg_type, payload):
+        if self.comms == None:
+            logger.error("Comms was not set up for RSU with ID "+str(self.id)+" cannot receiveMsg()")
+            return 0
+        if self.m == None:
+            logger.error("Message logic was not set up for RSU with ID "+str(self.id)+" cannot receiveMsg()")
+            return 0
+        if msg_type not in self.m.msg_types:
+            logger.error("Message type" + str(msg_type )+ "is not a valid type for RSU with ID "+str(self.id)+", cannot receiveMsg()")
+            return 0
+
+        self.m.receive(self, sender_id, msg_type, payload)
+        return 1
+
+    def setComms(self, comms):
+        logger.info("Setting comms for RSU # "+str(self.id))
+        self.comms = comms
+
+    def setMsgHandler(self, message_handler):
+        logger.info("Setting message handler for RSU # "+str(self.id))
+        self.m = message_handler
+
+    def _cover(self):
+        # grid cells completely (farthest corner) or partly (nearest point) within range of cars at Z=0
+        self.full_cells = set()
+        self.boundary_cells = set()
+        if self.comm_range <= abs(self.pos[2]):
+            return
+        radius = math.sqrt(self.comm_range ** 2 - self.pos[2] ** 2)
+        x, y = self.pos[0], self.pos[1]
+        reach = int(math.ceil(radius / CELL_SIZE))
+        for i in range(self.cell[0] - reach, self.cell[0] + reach + 1):
+            x0, x1 = i * CELL_SIZE, (i + 1) * CELL_SIZE
+            near_x = max(x0 - x, 0.0, x - x1)
+            far_x = max(abs(x - x0), abs(x - x1))
+            for j in range(self.cell[1] - reach, self.cell[1] + reach + 1):
+                y0, y1 = j * CELL_SIZE, (j + 1) * CELL_SIZE
+                near_y = max(y0 - y, 0.0, y - y1)
+                far_y = max(abs(y - y0), abs(y - y1))
+                if far_x ** 2 + far_y ** 2 <= radius ** 2:
+                    self.full_cells.add((i, j))
+                elif near_x ** 2 + near_y ** 2 <= radius ** 2:
+                    self.boundary_cells.add((i, j))
@@ -0,0 +1,179 @@
+import logging
+from collections import namedtuple
+from ptv_sim import instrument
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""Signal phase and timing (SPaT) of the signal controllers, for SPAT broadcasts of RSUs.
+
+setup() reads the topology once: the signal heads with their controller, signal group and link.
+    The links of the heads of a controller are its approaches.
+update() takes a snapshot of the state and the time in state of every signal group with one
+    GetMultipleAttributes() call on the signal heads per step, instead of AttValue() calls per
+    controller and group.
+The time to change is estimated from the observed durations: once a group went through a state,
+    time_to_change = duration of the state - time in state (exact for fixed time controllers).
+    It is None until then. The start of a state is taken from its time in state, so snapshots do not
+    have to fall on the step of a change. A state shorter than the time between snapshots (e.g. amber
+    with spat.step at a low rate) can be missed, it is then counted into the state before it.
+broadcast() sends the SPaT of its controller from every RSU with a controller (ptv_comm.rsu) to
+    the cars on the approaches of the controller, found through the car index of the RSUs.
+step() does both and can be added as a callback of the step driver.
+
+The attribute names are in SIGNAL_ATTRIBUTES, change them to the names of your Vissim version if needed.
+
+Example:
+    spat.setup(Vissim, RESULTS_DIR)
+    rsu.RSU([980.0, 40.0, 6.0], comms=net, msg_handler=message_handler_example, controller=1)
+    driver.addCallback(spat.step)
+"""
+
+logger = logging.getLogger(__name__)
+
+SIGNAL_ATTRIBUTES = {
+    'head': 'No',
+    'controller': 'SG\\SigCtrl\\No',
+    'group': 'SG\\No',
+    'link': 'Lane\\Link\\No',
+    'state': 'SG\\SigState',
+    'time_in_state': 'SG\\tSigState',
+}
+SignalGroup = namedtuple('SignalGroup', 'controller, group, state, time_in_state, time_to_change, links')
+TIME = None # SimSec of the snapshot
+TOPOLOGY = dict() # controller -> {'groups': [group numbers], 'links': [approach links], 'heads': [head numbers], 'group_links': {group: [links]}}
+SNAPSHOT = dict() # (controller, group) -> SignalGroup
+_HEADS = dict() # head number -> (controller, group) of the head
+_DURATIONS = dict() # (controller, group, state) -> observed duration of the state
+_STARTED = dict() # (controller, group) -> (state, SimSec the state started)
+
+
+def setup(_Vissim, _RESULTS_DIR):
+    """Call before beginning of simulation to initialize module, reads the signal topology and clears
+    the snapshot and the observed durations.
+
+    Args:
+        _Vissim:(COM) the Vissim COM object associated with your simulation, commonly "Vissim"
+        _RESULTS_DIR:(string) an absolute directory
+    """
+    global Vissim       #follows naming convention of standard Vissim COM interface
+    global RESULTS_DIR
+    global TIME
+    global TOPOLOGY
+    global SNAPSHOT
+    global _HEADS
+    global _DURATIONS
+    global _STARTED
+
+    Vissim = _Vissim
+    RESULTS_DIR = _RESULTS_DIR
+    names = [SIGNAL_ATTRIBUTES[key] for key in ('head', 'controller', 'group', 'link')]
+    # a new run, nothing observed in a previous run (durations of another network or timing) is kept
+    TIME = None
+    TOPOLOGY = dict()
+    SNAPSHOT = dict()
+    _HEADS = dict()
+    _DURATIONS = dict()
+    _STARTED = dict()
+    for head, controller, group, link in Vissim.Net.SignalHeads.GetMultipleAttributes(names):
+        controller, group = int(controller), int(group)
+        _HEADS[head] = (controller, group)
+        topology = TOPOLOGY.setdefault(controller, {'groups': [], 'links': [], 'heads': [], 'group_links': dict()})
+        topology['heads'].append(head)
+        if group not in topology['groups']:
+            topology['groups'].append(group)
+        if link != None and int(link) not in topology['links']:
+            topology['links'].append(int(link))
+        group_links = topology['group_links'].setdefault(group, [])
+        if link != None and int(link) not in group_links:
+            group_links.append(int(link))
+    logger.info("Found "+str(len(TOPOLOGY))+" signal controllers with "+str(len(set(_HEADS.values())))
+                +" signal groups and "+str(len(_HEADS))+" signal heads")
+
+
+def update(sim_time=None):
+    """Take the snapshot of all signal groups, call every step.
+
+    Args:
+        sim_time:(float) the current SimSec if it was already read this step, saves a COM call
+    """
+    global TIME
+    started = instrument.start()
+    if sim_time == None:
+        sim_time = Vissim.Simulation.AttValue('SimSec')
+    TIME = float(sim_time)
+    names = [SIGNAL_ATTRIBUTES[key] for key in ('head', 'state', 'time_in_state')]
+    rows = Vissim.Net.SignalHeads.GetMultipleAttributes(names)
+    instrument.stop('spat.fetch', started, len(rows))
+
+    seen = set()
+    for head, state, time_in_state in rows:
+        key = _HEADS.get(head)
+        if key == None:
+            logger.error("Signal head "+str(head)+" was not found by spat.setup(), call setup() again after changing signals")
+            continue
+        if key in seen: # the first head of a signal group stands for the group
+            continue
+        seen.add(key)
+        time_in_state = float(time_in_state) if time_in_state != None else None
+        previous = _STARTED.get(key)
+        if previous == None or previous[0] != state:
+            state_started = TIME - time_in_state if time_in_state != None else None
+            if previous != None and previous[1] != None:
+                # a complete state was observed, it ended when the new state started (not at this snapshot)
+                ended = state_started if state_started != None else TIME
+                _DURATIONS[key + (previous[0],)] = ended - previous[1]
+            _STARTED[key] = (state, state_started)
+        duration = _DURATIONS.get(key + (state,))
+        time_to_change = max(duration - time_in_state, 0.0) if duration != None and time_in_state != None else None
+        SNAPSHOT[key] = SignalGroup(key[0], key[1], state, time_in_state, time_to_change,
+                                    TOPOLOGY[key[0]]['group_links'].get(key[1], []))
+
+
+def getSpat(controller):
+    """Returns the SPaT payload of a signal controller.
+
+    The payload is a dict with the controller number, the SimSec of the snapshot and a list of
+    groups, each a dict of group, state, time_in_state, time_to_change and links.
+    """
+    groups = []
+    for group in TOPOLOGY.get(controller, {'groups': []})['groups']:
+        signal_group = SNAPSHOT.get((controller, group))
+        if signal_group != None:
+            groups.append(dict(signal_group._asdict()))
+    return {'controller': controller, 'time': TIME, 'groups': groups}
+
+
+def broadcast(rsus=None):
+    """Send the SPaT of its controller from every RSU with a controller to the cars on its approaches.
+
+    Args:
+        rsus:(list) the RSUs, defaults to all RSUs
+
+    Returns the number of RSUs that sent.
+    """
+    from ptv_comm import rsu
+    started = instrument.start()
+    sent = 0
+    for unit in (rsus if rsus != None else rsu.RSU.all_rsus):
+        if unit.controller == None:
+            continue
+        if unit.controller not in TOPOLOGY:
+            logger.error("RSU # "+str(unit.id)+" has signal controller "+str(unit.controller)+" which has no signal heads")
+            continue
+        sent += unit.sendMsg(msg_type='SPAT', payload=getSpat(unit.controller), links=TOPOLOGY[unit.controller]['links'])
+    instrument.stop('spat.broadcast', started, sent)
+    return sent
+
+
+def step(sim_time=None, cars=None, uavs=None):
+    """update() and broadcast(), with the signature of a step driver callback (see ptv_sim.driver)."""
+    update(sim_time)
+    return broadcast()
+
+
+def getGroups():
+    """Returns the snapshot of all signal groups, (controller, group) -> SignalGroup."""
+    return SNAPSHOT
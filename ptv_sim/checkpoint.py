@@ -0,0 +1,182 @@
+import io
+import os
+import zlib
+import types
+import random
+import logging
+import importlib
+
+from ptv_sim import lazy
+
+try:
+    import cPickle as pickle
+except ImportError: # python 3
+    import pickle
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""Checkpoint the library state of a simulation and resume from it, e.g. after the warm-up.
+
+save() serializes the whole state of a SimulationContext at the current SimSec: all cars, UAVs
+    (including the dynamics state in UAV.sim), models, cameras, networks with their pending Sched
+    events and message logs, skills, defaults, hooks, the step driver's counters and the state of
+    random. The state is pickled and compressed with zlib. Next to it Vissim saves a snapshot of the
+    simulation with Simulation.SaveSnapshot().
+restore() loads the Vissim snapshot (or moves a Replay to the same SimSec) and then the library state
+    into a context. Experiment branches can fork from the warm state: restore the same checkpoint into
+    several contexts or runs and change their parameters afterwards.
+COM handles are not saved. Car, Model and Camera get theirs from Vissim again with ItemByKey when they
+    are restored. Modules (e.g. a message handler module) and bound methods are saved by reference.
+    Hooks, message handlers and callbacks have to be module level functions or classes, lambdas
+    cannot be saved.
+
+Example:
+    ctx = context.SimulationContext(Vissim)
+    ...                                            # warm-up
+    checkpoint.save(ctx, RESULTS_DIR + "warm.ckpt")
+
+    branch = context.SimulationContext(Vissim)     # later, or in another run
+    checkpoint.restore(branch, RESULTS_DIR + "warm.ckpt")
+    branch.run(600)
+"""
+
+logger = logging.getLogger(__name__)
+
+VERSION = 1
+SNAPSHOT_EXT = ".snp" # the Vissim snapshot is saved as <checkpoint file>.snp
+_SKIP = ('Vissim',) # bound to the Vissim of the restoring context instead
+
+
+def save(ctx, filepath, vissim_snapshot=True, level=6):
+    """Save a checkpoint of a context.
+
+    Args:
+        ctx:(SimulationContext) the context to save, bound or not
+        filepath:(string) file to write, the directory is created if it does not exist
+        vissim_snapshot:(bool) also save a Vissim snapshot to filepath + SNAPSHOT_EXT
+        level:(int) zlib compression level
+
+    Returns the SimSec of the checkpoint.
+    """
+    file_dir = os.path.dirname(filepath)
+    if file_dir and not os.path.exists(file_dir):
+        logger.info("Creating directory "+file_dir)
+        os.makedirs(file_dir)
+
+    with ctx:
+        sim_time = ctx.driver.sim_time
+        if sim_time == None:
+            sim_time = float(ctx.Vissim.Simulation.AttValue('SimSec'))
+        # globals of modules that were not set up (e.g. ptv_comm.rsu) stay unset after restore()
+        state = dict((_label(owner, name), getattr(owner, name)) for owner, name in ctx.state
+                     if name not in _SKIP and hasattr(owner, name))
+        checkpoint = {
+            'version': VERSION,
+            'sim_time': sim_time,
+            'modules': ctx.modules,
+            'state': state,
+            'driver': {'steps': ctx.driver.steps, 'sim_time': ctx.driver.sim_time},
+            'random': random.getstate(),
+        }
+        data = zlib.compress(_dumps(checkpoint), level)
+        if vissim_snapshot:
+            ctx.Vissim.Simulation.SaveSnapshot(filepath + SNAPSHOT_EXT)
+    with open(filepath, 'wb') as f:
+        f.write(data)
+    logger.info("Saved checkpoint at "+str(sim_time)+" s to "+filepath+" ("+str(len(data) // 1024)+" kB)")
+    return sim_time
+
+
+def restore(ctx, filepath, replay=None):
+    """Restore a checkpoint into a context, replacing its state.
+
+    The Vissim side is restored first: a Replay is moved to the SimSec of the checkpoint, otherwise
+    the Vissim snapshot is loaded if it exists. The callbacks and writers of the context's driver are kept.
+
+    Args:
+        ctx:(SimulationContext) the context to restore into, it has to drive the same modules
+        filepath:(string) a file written by save()
+        replay:(Replay) the ptv_sim.replay.Replay behind ctx.Vissim, if any
+
+    Returns the SimSec of the checkpoint.
+    """
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    header = _loads(zlib.decompress(data), header_only=True)
+    if header['version'] != VERSION:
+        raise ValueError("Checkpoint "+filepath+" has version "+str(header['version'])+", expected "+str(VERSION))
+    if sorted(header['modules']) != sorted(ctx.modules):
+        raise ValueError("Checkpoint "+filepath+" holds the modules "+str(header['modules'])+", the context drives "+str(ctx.modules))
+
+    sim_time = header['sim_time']
+    if replay != None:
+        if not replay.seek(sim_time):
+            logger.error("Replay trace ends before the checkpoint at "+str(sim_time)+" s")
+    elif os.path.exists(filepath + SNAPSHOT_EXT):
+        ctx.Vissim.Simulation.LoadSnapshot(filepath + SNAPSHOT_EXT)
+    else:
+        logger.warning("No Vissim snapshot for checkpoint "+filepath+", only the library state is restored")
+
+    with ctx:
+        driver = ctx.driver
+        ctx.reset()
+        ctx.driver = driver
+        for owner, name in ctx.state:
+            if name in _SKIP:
+                setattr(owner, name, ctx.Vissim) # objects get their COM handles from it while they are unpickled
+        checkpoint = _loads(zlib.decompress(data))
+        labels = dict((_label(owner, name), (owner, name)) for owner, name in ctx.state)
+        for label, value in checkpoint['state'].items():
+            owner, name = labels[label]
+            setattr(owner, name, value)
+        ctx.driver.steps = checkpoint['driver']['steps']
+        ctx.driver.sim_time = checkpoint['driver']['sim_time']
+        random.setstate(checkpoint['random'])
+    logger.info("Restored checkpoint at "+str(sim_time)+" s from "+filepath)
+    return sim_time
+
+
+def _label(owner, name):
+    # picklable name of a module global or class attribute, e.g. 'ptv_veh.car.Car.all_cars'
+    if isinstance(owner, types.ModuleType):
+        return owner.__name__ + "." + name
+    return owner.__module__ + "." + owner.__name__ + "." + name
+
+
+def _persistentId(obj):
+    # modules and bound methods are saved by reference
+    if isinstance(obj, types.ModuleType):
+        return ('module', obj.__name__)
+    if isinstance(obj, lazy.LazyModule):
+        return ('module', obj.name)
+    if isinstance(obj, types.MethodType) and getattr(obj, '__self__', None) is not None:
+        return ('method', obj.__self__, obj.__func__.__name__)
+    return None
+
+
+def _persistentLoad(pid):
+    if pid[0] == 'module':
+        return importlib.import_module(pid[1])
+    return getattr(pid[1], pid[2])
+
+
+def _dumps(checkpoint):
+    # the header is pickled separately, so that restore() can check it before unpickling any objects
+    buf = io.BytesIO()
+    pickler = pickle.Pickler(buf, pickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = _persistentId
+    pickler.dump(dict((key, checkpoint[key]) for key in ('version', 'sim_time', 'modules')))
+    pickler.dump(checkpoint)
+    return buf.getvalue()
+
+
+def _loads(data, header_only=False):
+    unpickler = pickle.Unpickler(io.BytesIO(data))
+    unpickler.persistent_load = _persistentLoad
+    header = unpickler.load()
+    if header_only:
+        return header
+    return unpickler.load()
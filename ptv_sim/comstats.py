@@ -0,0 +1,187 @@
+import math
+import logging
+from collections import deque
+from timeit import default_timer as timer
+
+from ptv_sim import instrument
+from ptv_sim.proxy import ComProxy
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""Count and time every COM call the library makes.
+
+ComStats wraps the Vissim COM object that is given to the setup() functions. Every call is tallied
+    by object, method and attribute name (e.g. Net.Vehicles.ItemByKey / AttValue / DesSpeed)
+    together with a latency histogram.
+Calls are also counted per simulation step (steps are delimited by reads of SimSec). A step that makes
+    far more calls than the recent steps is flagged as a regression and logged with the calls that grew.
+Counted calls are forwarded to ptv_sim.instrument, so phase COM counts work with this wrapper too.
+
+Example:
+    stats = comstats.ComStats(Vissim)
+    vcar.setup(stats.Vissim, ...)   # use stats.Vissim everywhere instead of Vissim
+    ...
+    print(stats.report())
+"""
+
+logger = logging.getLogger(__name__)
+
+# latency histogram buckets are powers of two in microseconds, bucket i holds [2^(i-1), 2^i) us
+NUM_BUCKETS = 24
+
+
+class ComStats:
+    """Counting and timing proxy around the Vissim COM object.
+
+    Attributes:
+        Vissim:(ComProxy) the counting Vissim object to hand to the modules
+        calls:(dict) (object, method, attribute) -> number of calls
+        seconds:(dict) (object, method, attribute) -> total time spent in the calls [s]
+        histograms:(dict) (object, method, attribute) -> list of call counts per latency bucket
+        steps:(deque) (SimSec, number of calls, calls per key) of the most recent steps
+        regressions:(list) (SimSec, number of calls, expected number of calls, keys that grew) of flagged steps
+    """
+
+    def __init__(self, _Vissim, regression_factor=2.0, min_excess=10, window=50):
+        """Start counting.
+
+        Args:
+            _Vissim:(COM) the Vissim COM object associated with your simulation
+            regression_factor:(float) a step is flagged if it makes more than this many times the usual number of calls
+            min_excess:(int) ... and at least this many calls more than usual
+            window:(int) number of recent steps the usual number of calls is taken from
+        """
+        self.Vissim = ComProxy(_Vissim, self._observe)
+        self.regression_factor = regression_factor
+        self.min_excess = min_excess
+        self.calls = dict()
+        self.seconds = dict()
+        self.histograms = dict()
+        self.steps = deque(maxlen=window)
+        self.regressions = []
+        self._sim_sec = None
+        self._step_calls = dict()
+
+    def reset(self):
+        """Forget all counts."""
+        self.calls.clear()
+        self.seconds.clear()
+        self.histograms.clear()
+        self.steps.clear()
+        del self.regressions[:]
+        self._sim_sec = None
+        self._step_calls.clear()
+
+    def total(self):
+        """Returns the total number of COM calls."""
+        return sum(self.calls.values())
+
+    def summary(self):
+        """Returns a list of dicts, one per (object, method, attribute), most expensive first.
+
+        Every dict holds the number of calls, total time [ms], mean latency [us] and the
+        p50/p99 latency [us] (upper edges of the histogram buckets).
+        """
+        rows = []
+        for key, count in self.calls.items():
+            histogram = self.histograms[key]
+            rows.append({
+                'object': key[0],
+                'method': key[1],
+                'attribute': key[2],
+                'calls': count,
+                'total_ms': self.seconds[key] * 1000,
+                'mean_us': self.seconds[key] * 1e6 / count,
+                'p50_us': _percentile(histogram, count, 0.50),
+                'p99_us': _percentile(histogram, count, 0.99),
+            })
+        rows.sort(key=lambda row: -row['total_ms'])
+        return rows
+
+    def report(self, top=20):
+        """Returns the most expensive calls as a printable table."""
+        lines = ["%-32s %-22s %-24s %9s %10s %9s %9s %9s" % ('object', 'method', 'attribute', 'calls', 'total ms', 'mean us', 'p50 us', 'p99 us')]
+        for row in self.summary()[:top]:
+            lines.append("%-32s %-22s %-24s %9d %10.1f %9.1f %9d %9d" % (
+                row['object'][-32:], row['method'], row['attribute'][:24], row['calls'], row['total_ms'], row['mean_us'], row['p50_us'], row['p99_us']))
+        if self.regressions:
+            lines.append(str(len(self.regressions)) + " step(s) flagged for call count regressions, last at SimSec " + str(self.regressions[-1][0]))
+        return "\n".join(lines)
+
+    def _observe(self, path, name, args, func):
+        started = timer()
+        result = func(*args)
+        elapsed = timer() - started
+
+        key = (_object_key(path), name, _attribute_key(name, args))
+        if key in self.calls:
+            self.calls[key] += 1
+            self.seconds[key] += elapsed
+        else:
+            self.calls[key] = 1
+            self.seconds[key] = elapsed
+            self.histograms[key] = [0] * NUM_BUCKETS
+        bucket = min(max(math.frexp(elapsed * 1e6)[1], 0), NUM_BUCKETS - 1)
+        self.histograms[key][bucket] += 1
+        instrument.count_com()
+
+        # the read of a new SimSec opens the step, it is counted in the new step and not the previous one
+        if name == 'AttValue' and path == ('Simulation',) and args and args[0] == 'SimSec':
+            sim_sec = float(result)
+            if sim_sec != self._sim_sec:
+                self._end_step()
+                self._sim_sec = sim_sec
+        self._step_calls[key] = self._step_calls.get(key, 0) + 1
+        return result
+
+    def _end_step(self):
+        if self._sim_sec is None:
+            self._step_calls.clear()
+            return
+        count = sum(self._step_calls.values())
+        if len(self.steps) >= 10:
+            usual = sorted([calls for sim_sec, calls, per_key in self.steps])[len(self.steps) // 2]
+            if count > usual * self.regression_factor and count - usual >= self.min_excess:
+                grown = self._grown_keys(self._step_calls)
+                self.regressions.append((self._sim_sec, count, usual, grown))
+                logger.warning("COM call regression at SimSec " + str(self._sim_sec) + ": " + str(count) +
+                               " calls, usually " + str(usual) + ". Grown: " + str(grown))
+        self.steps.append((self._sim_sec, count, self._step_calls))
+        self._step_calls = dict()
+
+    def _grown_keys(self, step_calls, top=3):
+        # compare every key against its mean over the recent steps
+        grown = []
+        for key, count in step_calls.items():
+            mean = sum([per_key.get(key, 0) for sim_sec, calls, per_key in self.steps]) / float(len(self.steps))
+            grown.append((count - mean, key))
+        grown.sort(reverse=True)
+        return [".".join(key[:2]) + "(" + key[2] + ")" for excess, key in grown[:top] if excess > 0]
+
+
+def _object_key(path):
+    # Net.Vehicles.ItemByKey(12) -> Net.Vehicles.ItemByKey so that all vehicles share a key
+    return ".".join([name.split("(")[0] for name in path])
+
+
+def _attribute_key(name, args):
+    if not args:
+        return ""
+    if name in ('GetMultipleAttributes', 'SetMultipleAttributes'):
+        return ",".join([str(attribute) for attribute in args[0]])
+    if isinstance(args[0], str) or type(args[0]).__name__ == 'unicode':
+        return args[0]
+    return ""
+
+
+def _percentile(histogram, count, pct):
+    target = pct * count
+    seen = 0
+    for bucket, calls in enumerate(histogram):
+        seen += calls
+        if seen >= target:
+            return 2 ** bucket
+    return 2 ** (len(histogram) - 1)
@@ -0,0 +1,243 @@
+import copy
+import logging
+import importlib
+import threading
+from collections import deque
+
+from ptv_sim import instrument
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""Simulation contexts, so that several simulations can live in one interpreter.
+
+The car, uav and network modules keep their state in module globals (Vissim, RESULTS_DIR, TIME,
+    SKILLS, the defaults, the hooks, ...) and in class level registries (Car.all_cars, UAV.active_uavs,
+    Net.all_nets, the Model and Camera pools, ...). A SimulationContext owns its own copy of all of
+    this state, and of the ptv_sim.instrument recording (enable() inside the with block). Inside a
+    with block the state of the context is bound to the modules, so the modules work as usual, and on
+    leaving the block it is put back into the context. Binding costs a few dozen attribute
+    assignments, so contexts can be switched every step.
+A new context starts with empty registries, unset handles (Vissim, RESULTS_DIR, ...) and a copy of the
+    module defaults as they were when the modules were imported (snapshot taken when this module is
+    imported, import it before calling any setup()). reset() returns a context to that state, e.g.
+    between runs in the same interpreter, without restarting Vissim.
+Contexts isolate simulations that run one after another or interleaved in one thread. They do not
+    make simulations run in parallel: the modules still read module globals, so only one context is
+    bound at a time. Entering a context takes a module wide lock, threads that each drive their own
+    context are serialized (each with block runs alone). For parallel runs use separate processes,
+    see ptv_sim.runner.
+
+Example:
+    ctx = context.SimulationContext(Vissim)
+    with ctx:
+        vcar.setup(ctx.Vissim, RESULTS_DIR, [111])
+        vnet.setup(ctx.Vissim, RESULTS_DIR)
+    ctx.driver.addCallback(handle_cars)
+    for i in range(600):
+        Vissim.Simulation.RunSingleStep()
+        ctx.step() # binds the context and runs one driver step
+    with ctx:
+        vcar.saveResults()
+    ctx.reset() # ready for the next run
+"""
+
+logger = logging.getLogger(__name__)
+
+_UNSET = object() # the module has no such global (e.g. Vissim before setup())
+_LOCK = threading.RLock()
+_DEFAULT_NAMES = {
+    'ptv_veh.car': ('CAR_DEFAULT', 'ATTRIBUTES', 'SKILLS'),
+    'ptv_veh.uav': ('SKILLS', 'UAV_DEFAULT', 'CAMERA_DEFAULT', 'VECTORIZE', 'FLEET_MIN_SIZE', 'POSE_SYNC'),
+    'ptv_comm.rsu': ('CELL_SIZE', 'RSU_DEFAULT'),
+    'ptv_comm.spat': ('SIGNAL_ATTRIBUTES',),
+}
+_DEFAULTS = dict() # (module, name) -> copy of the module default, taken when this module is imported
+
+
+class SimulationContext:
+    """The COM handle, clock, registries, skills, defaults, hooks and step driver of one simulation.
+
+    Attributes:
+        Vissim:(COM) the Vissim COM object of this simulation
+        modules:(list) names of the bound modules, from 'car', 'uav' and 'network'
+        state:(dict) (module or class, name) -> value of all bound globals and registries while unbound
+        driver:(StepDriver) the step driver of this simulation, see step()
+        active:(bool) whether the context is bound right now
+    """
+
+    def __init__(self, _Vissim=None, modules=('car', 'uav', 'network'), rates=None):
+        """Create a context with fresh state.
+
+        Args:
+            _Vissim:(COM) the Vissim COM object associated with this simulation
+            modules:(list) names of the modules to bind, from 'car', 'uav' and 'network'
+            rates:(dict) rates of the step driver, see ptv_sim.driver.RATES
+        """
+        self.Vissim = _Vissim
+        self.modules = list(modules)
+        self.rates = rates
+        self.active = False
+        self._depth = 0
+        self._outer = None
+        self.state = _freshState(self.modules)
+        self.driver = self._newDriver()
+
+    def __enter__(self):
+        self.activate()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.deactivate()
+        return False
+
+    def activate(self):
+        """Bind the state of this context to the modules. Prefer the with statement."""
+        _LOCK.acquire()
+        self._depth += 1
+        if self._depth > 1:
+            return
+        self._outer = dict((key, getattr(key[0], key[1], _UNSET)) for key in self.state)
+        _bind(self.state)
+        self.active = True
+
+    def deactivate(self):
+        """Put the state of the modules back into this context and restore what was bound before."""
+        try:
+            self._depth -= 1
+            if self._depth > 0:
+                return
+            for key in self.state:
+                self.state[key] = getattr(key[0], key[1], _UNSET)
+            _bind(self._outer)
+            self._outer = None
+            self.active = False
+        finally:
+            _LOCK.release()
+
+    def reset(self):
+        """Drop all agents, networks, hooks and settings of this context and start over."""
+        logger.info("Resetting simulation context")
+        self.state = _freshState(self.modules)
+        if self.active:
+            _bind(self.state)
+        self.driver = self._newDriver()
+
+    def step(self):
+        """Bind the context and run one step of its driver, returns the SimSec of the step."""
+        with self:
+            return self.driver.step()
+
+    def run(self, num_steps):
+        """Run Vissim.Simulation.RunSingleStep() and step() num_steps times."""
+        for i in range(num_steps):
+            self.Vissim.Simulation.RunSingleStep()
+            self.step()
+
+    def get(self, owner, name):
+        """Returns the value of a global or registry of this context, e.g. get(vcar.Car, 'active_cars')."""
+        if self.active:
+            return getattr(owner, name)
+        return self.state[(owner, name)]
+
+    def _newDriver(self):
+        from ptv_sim.driver import StepDriver
+        return StepDriver(self.Vissim, self.modules, self.rates)
+
+
+def _bind(state):
+    for (owner, name), value in state.items():
+        if value is _UNSET:
+            if hasattr(owner, name):
+                delattr(owner, name)
+        else:
+            setattr(owner, name, value)
+
+
+def _snapshotDefaults():
+    # the module defaults before any setup() changed them (setup() updates SKILLS and the defaults in place)
+    for module_name in sorted(_DEFAULT_NAMES):
+        module = importlib.import_module(module_name)
+        if hasattr(module, 'Vissim'):
+            logger.warning(module_name+".setup() was called before ptv_sim.context was imported, "
+                           "new contexts start with the defaults as changed by it")
+        for name in _DEFAULT_NAMES[module_name]:
+            _DEFAULTS[(module, name)] = copy.deepcopy(getattr(module, name))
+
+
+def _default(owner, name):
+    # fresh copy of a module default (skills, default parameters, ...)
+    return copy.deepcopy(_DEFAULTS[(owner, name)])
+
+
+def _hooks(module):
+    return dict((event, []) for event in module.HOOKS)
+
+
+def _freshState(modules):
+    from ptv_sim import history, projection
+    state = {(projection, 'PROJECTION'): None}
+    state[(instrument, 'ENABLED')] = False
+    state[(instrument, 'COM_CALLS')] = 0
+    state[(instrument, '_frames')] = deque(maxlen=1000)
+    state[(instrument, '_frame')] = None
+    if 'car' in modules:
+        from ptv_veh import car
+        for name in ('Vissim', 'RESULTS_DIR', 'TRACKED_VEH_TYPES'):
+            state[(car, name)] = _UNSET
+        for name in ('CAR_DEFAULT', 'ATTRIBUTES', 'SKILLS'):
+            state[(car, name)] = _default(car, name)
+        state[(car, 'TIME')] = _UNSET
+        state[(car, 'HOOKS')] = _hooks(car)
+        for name in ('all_cars', 'active_cars', 'new_cars', 'null_cars', 'all_vissim_cars'):
+            state[(car.Car, name)] = []
+        state[(car.Car, 'vissim_index')] = dict()
+        state[(history, 'POOL')] = None
+
+    if 'uav' in modules:
+        from ptv_veh import uav
+        for name in ('Vissim', 'RESULTS_DIR', 'TIME'):
+            state[(uav, name)] = _UNSET
+        for name in ('SKILLS', 'UAV_DEFAULT', 'CAMERA_DEFAULT', 'VECTORIZE', 'FLEET_MIN_SIZE', 'POSE_SYNC'):
+            state[(uav, name)] = _default(uav, name)
+        state[(uav, 'SEPARATION_MONITOR')] = None
+        state[(uav, 'HOOKS')] = _hooks(uav)
+        state[(uav, '_SYNC_STEP')] = 0
+        state[(uav, '_RINGS')] = dict()
+        state[(history, 'POOL')] = None
+        state[(uav, 'FLEET')] = uav.Fleet()
+        for name in ('all_uavs', 'active_uavs', 'null_uavs'):
+            state[(uav.UAV, name)] = []
+        for cls, prefix in ((uav.Model, 'models'), (uav.Camera, 'cameras')):
+            active = []
+            state[(cls, 'all_' + prefix)] = []
+            state[(cls, 'active_' + prefix)] = active
+            state[(cls, 'pool')] = uav._Pool(active)
+
+    if 'network' in modules:
+        from ptv_comm import network
+        for name in ('Vissim', 'RESULTS_DIR', 'SIM_RES'):
+            state[(network, name)] = _UNSET
+        state[(network, 'TIME')] = None
+        state[(network, 'HOOKS')] = _hooks(network)
+        state[(network.Net, 'all_nets')] = []
+        from ptv_comm import rsu
+        for name in ('Vissim', 'RESULTS_DIR'):
+            state[(rsu, name)] = _UNSET
+        for name in ('CELL_SIZE', 'RSU_DEFAULT'):
+            state[(rsu, name)] = _default(rsu, name)
+        state[(rsu, '_INDEX')] = None
+        state[(rsu.RSU, 'all_rsus')] = rsu.Roadside()
+        from ptv_comm import spat
+        for name in ('Vissim', 'RESULTS_DIR'):
+            state[(spat, name)] = _UNSET
+        state[(spat, 'SIGNAL_ATTRIBUTES')] = _default(spat, 'SIGNAL_ATTRIBUTES')
+        state[(spat, 'TIME')] = None
+        for name in ('TOPOLOGY', 'SNAPSHOT', '_HEADS', '_DURATIONS', '_STARTED'):
+            state[(spat, name)] = dict()
+    return state
+
+
+_snapshotDefaults()
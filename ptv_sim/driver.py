@@ -0,0 +1,195 @@
+import logging
+from timeit import default_timer as timer
+
+from ptv_sim import instrument
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""Runs the per step lifecycle of the car, uav and network modules.
+
+Instead of calling vcar.update(), uav.update() and vnet.update() by hand in runSingleStep(), hand
+    the work to a StepDriver. Every step it runs these phases in order:
+    clock     - read SimSec from Vissim once and hand it to every module
+    snapshot  - car.update(), one GetMultipleAttributes call for all vehicles
+    uav       - UAV missions and dynamics (and the separation monitor)
+    callbacks - user callbacks fn(sim_time, cars, uavs) with the cars/uavs dicts of getCars()/getUAVs()
+    flush     - batched COM writes, the 3D model and camera poses
+    network   - deliver the network messages that are due
+    writers   - writer.update(sim_time) of every registered writer
+Every phase is timed (phase_times, and as 'step.<phase>' in ptv_sim.instrument when it is enabled).
+Every subsystem runs at its own rate: a rate of n runs it every n-th step. The rates of models and
+    cameras are handed to uav.syncPoses(), which staggers the objects over the steps.
+The modules still have to be set up with their setup() functions before the first step.
+
+Example:
+    vcar.setup(Vissim, RESULTS_DIR, [111])
+    uav.setup(Vissim, RESULTS_DIR)
+    vnet.setup(Vissim, RESULTS_DIR)
+    driver = StepDriver(Vissim, rates={'models': 2, 'cameras': 5})
+    driver.addCallback(handle_cars)
+
+    def runSingleStep(): # called by Vissim every step
+        driver.step()
+"""
+
+logger = logging.getLogger(__name__)
+
+PHASES = ('clock', 'snapshot', 'uav', 'callbacks', 'flush', 'network', 'writers')
+
+"""Rates of the subsystems, a rate of n runs the subsystem every n-th step.
+
+"""
+RATES = {
+    'car': 1,
+    'uav': 1,
+    'models': 1,
+    'cameras': 1,
+    'callbacks': 1,
+    'network': 1,
+    'writers': 1,
+}
+
+
+class StepDriver:
+    """Owns the per step lifecycle of the modules.
+
+    Attributes:
+        Vissim:(COM) the Vissim COM object
+        modules:(list) names of the driven modules, from 'car', 'uav' and 'network'
+        rates:(dict) subsystem -> rate, see RATES
+        steps:(int) number of steps run
+        sim_time:(float) SimSec of the current step
+        phase_times:(dict) phase -> total wall time [s]
+        last_times:(dict) phase -> wall time of the last step [s]
+    """
+
+    def __init__(self, _Vissim, modules=('car', 'uav', 'network'), rates=None):
+        """Create a driver.
+
+        Args:
+            _Vissim:(COM) the Vissim COM object associated with your simulation
+            modules:(list) names of the modules to drive, from 'car', 'uav' and 'network'
+            rates:(dict) overrides of RATES, e.g. {'models': 2, 'cameras': 5}
+        """
+        self.Vissim = _Vissim
+        self.modules = list(modules)
+        self.rates = dict(RATES)
+        if rates != None:
+            for subsystem in rates:
+                if subsystem not in self.rates:
+                    raise ValueError("Unknown subsystem '" + str(subsystem) + "', options are " + str(sorted(RATES)))
+                self.rates[subsystem] = int(rates[subsystem])
+        self.steps = 0
+        self.sim_time = None
+        self.phase_times = dict((phase, 0.0) for phase in PHASES)
+        self.last_times = dict((phase, 0.0) for phase in PHASES)
+        self._callbacks = [] # (function, rate)
+        self._writers = [] # (writer, rate)
+
+        self.car = self.uav = self.network = None
+        if 'car' in self.modules:
+            from ptv_veh import car
+            self.car = car
+        if 'uav' in self.modules:
+            from ptv_veh import uav
+            self.uav = uav
+        if 'network' in self.modules:
+            from ptv_comm import network
+            self.network = network
+
+    def addCallback(self, function, rate=None):
+        """Register a user callback function(sim_time, cars, uavs) that runs after the UAV dynamics.
+
+        Args:
+            function:(function) called with the SimSec and the dicts returned by car.getCars() and uav.getUAVs() (None if not driven)
+            rate:(int) run every rate-th step, defaults to the 'callbacks' rate
+        """
+        self._callbacks.append((function, rate or self.rates['callbacks']))
+
+    def addWriter(self, writer, rate=None):
+        """Register a result writer, writer.update(sim_time) is called at the end of the step.
+
+        Args:
+            writer:(object) anything with an update(sim_time) method
+            rate:(int) run every rate-th step, defaults to the 'writers' rate
+        """
+        self._writers.append((writer, rate or self.rates['writers']))
+
+    def step(self):
+        """Run one step, call right after Vissim.Simulation.RunSingleStep() (or from runSingleStep())."""
+        for phase in PHASES:
+            self.last_times[phase] = 0.0
+        started = self._start()
+        self.sim_time = float(self.Vissim.Simulation.AttValue('SimSec'))
+        instrument.tick(self.sim_time)
+        if self.network:
+            self.network.setTime(self.sim_time)
+        self._stop('clock', started)
+
+        if self.car and self._due('car'):
+            started = self._start()
+            self.car.update(self.sim_time)
+            self._stop('snapshot', started)
+
+        if self.uav and self._due('uav'):
+            started = self._start()
+            self.uav.update(sim_time=self.sim_time, sync=False)
+            self._stop('uav', started)
+
+        callbacks = [function for function, rate in self._callbacks if self.steps % rate == 0]
+        if callbacks:
+            started = self._start()
+            cars = self.car.getCars() if self.car else None
+            uavs = self.uav.getUAVs() if self.uav else None
+            for function in callbacks:
+                function(self.sim_time, cars, uavs)
+            self._stop('callbacks', started)
+
+        if self.uav:
+            started = self._start()
+            self.uav.syncPoses(self.rates['models'], self.rates['cameras'])
+            self._stop('flush', started)
+
+        if self.network and self._due('network'):
+            started = self._start()
+            self.network.update()
+            self._stop('network', started)
+
+        writers = [writer for writer, rate in self._writers if self.steps % rate == 0]
+        if writers:
+            started = self._start()
+            for writer in writers:
+                writer.update(self.sim_time)
+            self._stop('writers', started)
+
+        self.steps += 1
+        return self.sim_time
+
+    def run(self, num_steps):
+        """Run Vissim.Simulation.RunSingleStep() and step() num_steps times."""
+        for i in range(num_steps):
+            self.Vissim.Simulation.RunSingleStep()
+            self.step()
+
+    def report(self):
+        """Returns the mean wall time per step of every phase as a printable table."""
+        lines = ["%-10s %10s %10s" % ('phase', 'mean ms', 'last ms')]
+        for phase in PHASES:
+            mean = self.phase_times[phase] * 1000 / max(self.steps, 1)
+            lines.append("%-10s %10.3f %10.3f" % (phase, mean, self.last_times[phase] * 1000))
+        return "\n".join(lines)
+
+    def _due(self, subsystem):
+        return self.steps % self.rates[subsystem] == 0
+
+    def _start(self):
+        return (timer(), instrument.start())
+
+    def _stop(self, phase, started):
+        elapsed = timer() - started[0]
+        self.phase_times[phase] += elapsed
+        self.last_times[phase] = elapsed
+        instrument.stop('step.' + phase, started[1])
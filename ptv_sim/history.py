@@ -0,0 +1,291 @@
+import os
+import bisect
+import logging
+import tempfile
+import threading
+
+from ptv_sim import lazy
+
+np = lazy.module('numpy')
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""Trajectory history with a bounded memory footprint, for long simulations of large networks.
+
+Cars and UAVs keep every sample of time, x, y (and z) in lists, which does not fit in RAM for
+    24 hour simulations of large networks. After setup() the agents get a Series for each of them
+    instead. A Series behaves like the list it replaces (append, len, indexing, slicing, iteration),
+    but keeps only the most recent samples in memory. Older samples are spilled in chunks to one
+    append-only file that is read back memory mapped.
+Two limits apply:
+    window: samples of one series kept in memory, the older half is spilled when it is reached
+    max_memory: bytes of samples of all series kept in memory. Above it, whole series are spilled,
+        the ones that were appended to longest ago first (usually the agents that left the network)
+Reading: chunks() returns the pieces of a range of a series, memory mapped views of the spill file
+    (nothing is copied) and a slice of the samples in memory (at most window samples). The module
+    level chunks() does the same for plain lists, saveResults() (through table()) and ptv_sim.store
+    read the histories that way. array() joins a range into one array, which is a copy unless it lies in one spilled
+    chunk. Indexing single samples of the spilled part is slower than of a list.
+chunks() may be called from another thread (e.g. ptv_sim.writer) while the step appends and spills.
+Without setup() series() returns plain lists, so nothing changes.
+
+Example:
+    history.setup(window=1024, max_memory=512 * 2**20, spill_dir="D:/spill/")
+    vcar.setup(Vissim, RESULTS_DIR, [111])
+    ...
+    car.x.array() # all x of a car, a copy
+    for chunk in history.chunks(car.x, 100, 5000): # views
+        ...
+    vcar.saveResults()
+    history.close() # removes the spill file
+"""
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DEFAULT = {
+    'window': 4096, # samples of one series in memory
+    'max_memory': 256 * 2**20, # bytes of samples of all series in memory
+    'spill_dir': None, # defaults to the temporary directory
+}
+POOL = None # the Pool of the series, None if histories are plain lists
+
+
+def setup(window=None, max_memory=None, spill_dir=None):
+    """Give agents created from now on spilling histories.
+
+    Args:
+        window:(int) samples of one series kept in memory
+        max_memory:(int) bytes of samples of all series kept in memory
+        spill_dir:(string) directory of the spill file, defaults to the temporary directory
+
+    Returns the Pool.
+    """
+    global POOL
+    if POOL != None:
+        logger.warning("History is already set up, the series created so far keep their spill file")
+    POOL = Pool(window if window != None else HISTORY_DEFAULT['window'],
+                max_memory if max_memory != None else HISTORY_DEFAULT['max_memory'],
+                spill_dir if spill_dir != None else HISTORY_DEFAULT['spill_dir'])
+    return POOL
+
+
+def series(values=()):
+    """Returns a new history: a Series after setup(), otherwise a list."""
+    if POOL == None:
+        return list(values)
+    return Series(values, POOL)
+
+
+def chunks(values, start=0, stop=None):
+    """Returns the pieces of values[start:stop] for a Series (views, see Series.chunks()) or a list (a slice)."""
+    if isinstance(values, Series):
+        return values.chunks(start, stop)
+    return [values[start:stop]]
+
+
+def table(agents, id_column, names):
+    """Returns {column: array} of the histories of all agents, e.g. for a DataFrame in saveResults().
+
+    Args:
+        agents:(list) the agents, e.g. Car.all_cars
+        id_column:(string) name of the column of the agent ids
+        names:(list) names of the history attributes, e.g. ['time', 'x', 'y']
+
+    The histories are read through chunks(), the only copy is the one into the columns.
+    """
+    counts = [min([len(getattr(agent, name)) for name in names]) for agent in agents]
+    columns = {id_column: np.repeat(np.asarray([agent.id for agent in agents], dtype=np.int64), counts)}
+    for name in names:
+        parts = [np.asarray(chunk, dtype='<f8') for agent, count in zip(agents, counts)
+                 for chunk in chunks(getattr(agent, name), 0, count)]
+        columns[name] = np.concatenate(parts) if parts else np.zeros(0)
+    return columns
+
+
+def close():
+    """Close the pool and remove its spill file, the series of the pool cannot be read afterwards."""
+    global POOL
+    if POOL != None:
+        POOL.close()
+    POOL = None
+
+
+class Pool(object):
+    """The spill file and memory accounting shared by the series.
+
+    Attributes:
+        window:(int) samples of one series kept in memory
+        max_memory:(int) bytes of samples of all series kept in memory
+        filepath:(string) the spill file, float64 samples
+        resident:(int) samples of all series in memory
+        spilled:(int) samples in the spill file
+    """
+
+    def __init__(self, window, max_memory, spill_dir=None):
+        if window < 2:
+            raise ValueError("History window has to be at least 2 samples, not " + str(window))
+        self.window = window
+        self.max_memory = max_memory
+        self.ceiling = max_memory // 8
+        self.spill_dir = spill_dir
+        self.resident = 0
+        self.spilled = 0
+        fd, self.filepath = tempfile.mkstemp(prefix="ptv_history_", suffix=".f8", dir=spill_dir)
+        self._file = os.fdopen(fd, 'wb')
+        self._map = None
+        self._queue = [] # series with samples in memory, least recently queued first
+        self._head = 0 # _queue[:_head] were already evicted
+        self._lock = threading.Lock() # spill() against chunks()/read() of other threads
+        logger.info("Spilling history to "+self.filepath+" (window "+str(window)+" samples, "
+                    +str(max_memory // 2**20)+" MB in memory)")
+
+    def __reduce__(self):
+        # a checkpoint (see ptv_sim.checkpoint) gets a new, empty spill file, the series carry their samples
+        return (Pool, (self.window, self.max_memory, self.spill_dir))
+
+    def trim(self, series):
+        """Spill the older half of a series that reached the window, and whole series above the ceiling."""
+        if len(series._recent) >= self.window:
+            self.spill(series, len(series._recent) - self.window // 2)
+        if self.resident > self.ceiling:
+            low = self.ceiling * 3 // 4
+            while self.resident > low and self._head < len(self._queue):
+                oldest = self._queue[self._head]
+                self._head += 1
+                oldest._queued = False
+                self.spill(oldest, len(oldest._recent))
+            if self._head > len(self._queue) // 2:
+                del self._queue[:self._head]
+                self._head = 0
+
+    def spill(self, series, count):
+        """Move the oldest count samples of a series from memory to the spill file."""
+        if count <= 0:
+            return
+        with self._lock:
+            self._file.write(np.asarray(series._recent[:count], dtype='<f8').tobytes())
+            series._offsets.append(series._spilled)
+            series._extents.append((self.spilled, count))
+            series._spilled += count
+            del series._recent[:count]
+            self.spilled += count
+        self.resident -= count
+
+    def read(self, offset, count):
+        """Returns a memory mapped view of count samples from offset."""
+        with self._lock:
+            return self._read(offset, count)
+
+    def _read(self, offset, count):
+        if self._map is None or len(self._map) < offset + count:
+            self._file.flush()
+            self._map = np.memmap(self.filepath, dtype='<f8', mode='r')
+        return self._map[offset:offset + count]
+
+    def close(self):
+        logger.info("Closing history spill file "+self.filepath+" ("+str(self.spilled * 8 // 2**20)+" MB)")
+        self._map = None
+        self._file.close()
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+
+
+class Series(object):
+    """A list of float samples of which only the most recent ones are kept in memory.
+
+    Supports append(), len(), indexing and slicing (both return plain values/lists, slices are copies)
+    and iteration. chunks() gives views of a range instead.
+    """
+
+    def __init__(self, values=(), pool=None):
+        self._pool = pool if pool != None else POOL
+        self._recent = list(values)
+        self._extents = [] # (offset in the spill file, count), oldest first
+        self._offsets = [] # index of the first sample of each extent
+        self._spilled = 0
+        self._queued = False
+        self._pool.resident += len(self._recent)
+        if self._recent:
+            self._queue()
+            self._pool.trim(self)
+
+    def __reduce__(self):
+        # pickled with its samples (see ptv_sim.checkpoint), restored into memory and spilled again if needed
+        return (Series, (list(self), self._pool))
+
+    def append(self, value):
+        self._recent.append(value)
+        pool = self._pool
+        pool.resident += 1
+        if not self._queued:
+            self._queue()
+        if len(self._recent) >= pool.window or pool.resident > pool.ceiling:
+            pool.trim(self)
+
+    def __len__(self):
+        return self._spilled + len(self._recent)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return list(self)[index]
+            if start >= self._spilled:
+                return self._recent[start - self._spilled:stop - self._spilled]
+            return self.array(start, stop).tolist()
+        if index < 0:
+            index += len(self)
+        if index >= self._spilled:
+            return self._recent[index - self._spilled]
+        if index < 0:
+            raise IndexError("Series index out of range")
+        extent = bisect.bisect_right(self._offsets, index) - 1
+        offset, count = self._extents[extent]
+        return float(self._pool.read(offset + index - self._offsets[extent], 1)[0])
+
+    def __iter__(self):
+        for chunk in self.chunks():
+            for value in (chunk.tolist() if hasattr(chunk, 'tolist') else chunk):
+                yield value
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "Series(" + str(len(self)) + " samples, " + str(len(self._recent)) + " in memory)"
+
+    def chunks(self, start=0, stop=None):
+        """Returns the pieces of the samples [start:stop], oldest first: memory mapped arrays of the
+        spilled samples (views, nothing is copied), then a list of the samples in memory (a slice)."""
+        pool = self._pool
+        with pool._lock: # a consistent picture, another thread may spill this series meanwhile
+            length = self._spilled + len(self._recent)
+            start, stop = max(start, 0), (length if stop == None else min(stop, length))
+            pieces = []
+            for position, (offset, count) in zip(self._offsets, self._extents):
+                if position + count > start and position < stop:
+                    first = max(start - position, 0)
+                    pieces.append(pool._read(offset + first, min(stop - position, count) - first))
+            if stop > self._spilled:
+                pieces.append(self._recent[max(start - self._spilled, 0):stop - self._spilled])
+        return pieces
+
+    def array(self, start=0, stop=None):
+        """Returns the samples [start:stop] as a float64 array, a view if they are all in one spilled
+        chunk, otherwise a copy (use chunks() to avoid it)."""
+        parts = [np.asarray(chunk, dtype='<f8') for chunk in self.chunks(start, stop)]
+        if len(parts) == 1:
+            return parts[0]
+        if not parts:
+            return np.zeros(0)
+        return np.concatenate(parts)
+
+    def _queue(self):
+        self._queued = True
+        self._pool._queue.append(self)
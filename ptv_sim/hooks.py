@@ -0,0 +1,30 @@
+import types
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""Helpers of the hook tables of the car, uav and network modules (see their addHook()).
+
+Vissim keeps the python interpreter alive between simulation runs and runs the project script again at
+    every start, so the script registers its hooks again while the library modules keep the hooks of the
+    last run. same() tells whether a hook is already registered, also when the script defined the
+    function again.
+"""
+
+
+def same(registered, function):
+    """Returns whether function is the registered hook: the same function (or bound method), or a module
+    level function of the same module and name, e.g. defined again by a script that Vissim ran again.
+    Lambdas and closures only match themselves."""
+    if registered == function:
+        return True
+    return (_plain(registered) and _plain(function) and registered.__name__ == function.__name__
+            and registered.__module__ == function.__module__)
+
+
+def _plain(function):
+    # a named function without closure, a module level function (python 3 also tells nested functions by __qualname__)
+    return (isinstance(function, types.FunctionType) and function.__name__ != '<lambda>'
+            and function.__closure__ is None and '<locals>' not in getattr(function, '__qualname__', ''))
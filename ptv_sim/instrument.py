@@ -0,0 +1,214 @@
+import logging
+from collections import deque
+from timeit import default_timer as timer
+
+from ptv_sim.proxy import ComProxy
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""Opt-in per step instrumentation of the library hot paths.
+
+The car, uav and network modules mark the phases of their update functions with start()/stop().
+When instrumentation is enabled every phase records its wall time, the number of COM calls made
+    while it ran and the number of objects it handled, accumulated per simulation step.
+Finished steps are kept in a ring buffer of frames that can be read with frames() or summarized
+    with summary()/report().
+When instrumentation is disabled start() returns None and stop() returns immediately.
+
+COM calls are only counted if the Vissim object given to the setup functions is wrapped with
+    wrap() (or any other wrapper that calls count_com()).
+
+Example:
+    Vissim = instrument.wrap(Vissim)
+    vcar.setup(Vissim, ...)
+    instrument.enable(capacity=3600)
+    ...
+    with instrument.timed('user.handlers'):
+        handle_cars()
+    ...
+    print(instrument.report())
+"""
+
+logger = logging.getLogger(__name__)
+
+ENABLED = False
+COM_CALLS = 0 # running count of COM calls, see count_com()
+
+# fields of a phase record
+WALL = 0
+COM = 1
+OBJECTS = 2
+CALLS = 3
+
+_frames = deque(maxlen=1000)
+_frame = None
+
+
+def enable(capacity=1000):
+    """Start recording.
+
+    Args:
+        capacity:(int) number of steps kept in the ring buffer, older steps are dropped
+    """
+    global ENABLED
+    global _frames
+    _frames = deque(_frames, maxlen=capacity)
+    ENABLED = True
+
+
+def disable():
+    """Stop recording. Recorded frames are kept until reset() is called."""
+    global ENABLED
+    ENABLED = False
+
+
+def reset():
+    """Drop all recorded frames."""
+    global _frame
+    _frames.clear()
+    _frame = None
+
+
+def tick(sim_sec):
+    """Mark the simulation second the following phases belong to.
+
+    The first call with a new simulation second starts a new frame. The modules call this
+    at the start of their update functions, so there is no need to call it directly.
+    """
+    if ENABLED and (_frame is None or _frame['time'] != sim_sec):
+        _new_frame(sim_sec)
+
+
+def start():
+    """Returns a token to hand to stop(), None if instrumentation is disabled."""
+    if ENABLED:
+        return (timer(), COM_CALLS)
+    return None
+
+
+def stop(phase, started, objects=0):
+    """Record a phase that was started with start().
+
+    Args:
+        phase:(string) name of the phase e.g. 'car.fetch'
+        started:(tuple) the token returned by start()
+        objects:(int) number of objects (vehicles, messages, ...) handled in the phase
+
+    Phases with the same name are accumulated within a step.
+    """
+    if started is None:
+        return
+    wall = timer() - started[0]
+    if _frame is None:
+        _new_frame(None)
+    record = _frame['phases'].get(phase)
+    if record is None:
+        _frame['phases'][phase] = [wall, COM_CALLS - started[1], objects, 1]
+    else:
+        record[WALL] += wall
+        record[COM] += COM_CALLS - started[1]
+        record[OBJECTS] += objects
+        record[CALLS] += 1
+
+
+def count_com(calls=1):
+    """Count COM calls. Called by COM wrappers for every call they forward."""
+    global COM_CALLS
+    COM_CALLS += calls
+
+
+class timed(object):
+    """Context manager to instrument a block of user code as its own phase.
+
+    Example:
+        with instrument.timed('user.new_cars'):
+            for car in cars['new']:
+                ...
+    """
+
+    def __init__(self, phase, objects=0):
+        self.phase = phase
+        self.objects = objects
+        self.started = None
+
+    def __enter__(self):
+        self.started = start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        stop(self.phase, self.started, self.objects)
+        return False
+
+
+def wrap(_Vissim):
+    """Wrap the Vissim COM object so that every COM call is counted.
+
+    Args:
+        _Vissim:(COM) the Vissim COM object associated with your simulation
+
+    Returns the wrapped object, hand it to the setup functions instead of Vissim.
+    """
+    return ComProxy(_Vissim, _counting_hook)
+
+
+def frames():
+    """Returns the recorded frames, oldest first.
+
+    Every frame is a dict with the keys 'step', 'time' (SimSec) and 'phases'.
+    'phases' maps a phase name to [wall time [s], COM calls, objects, calls].
+    """
+    return list(_frames)
+
+
+def summary():
+    """Summarize the recorded frames per phase.
+
+    Returns a dict mapping phase name to a dict with the number of steps the phase ran in,
+    the mean/p50/p95/max wall time per step [ms] and the mean COM calls and objects per step.
+    """
+    per_phase = dict()
+    for frame in _frames:
+        for phase, record in frame['phases'].items():
+            per_phase.setdefault(phase, []).append(record)
+
+    result = dict()
+    for phase, records in per_phase.items():
+        walls = sorted([record[WALL] * 1000 for record in records])
+        n = len(records)
+        result[phase] = {
+            'steps': n,
+            'mean_ms': sum(walls) / n,
+            'p50_ms': walls[int(round(0.50 * (n - 1)))],
+            'p95_ms': walls[int(round(0.95 * (n - 1)))],
+            'max_ms': walls[-1],
+            'com_calls': sum([record[COM] for record in records]) / float(n),
+            'objects': sum([record[OBJECTS] for record in records]) / float(n),
+        }
+    return result
+
+
+def report():
+    """Returns the summary as a printable table, slowest phases first."""
+    stats = summary()
+    lines = ["%-20s %6s %9s %9s %9s %9s %10s %9s" % ('phase', 'steps', 'mean ms', 'p50 ms', 'p95 ms', 'max ms', 'COM calls', 'objects')]
+    for phase in sorted(stats, key=lambda phase: -stats[phase]['mean_ms']):
+        s = stats[phase]
+        lines.append("%-20s %6d %9.3f %9.3f %9.3f %9.3f %10.1f %9.1f" % (
+            phase, s['steps'], s['mean_ms'], s['p50_ms'], s['p95_ms'], s['max_ms'], s['com_calls'], s['objects']))
+    return "\n".join(lines)
+
+
+def _new_frame(sim_sec):
+    global _frame
+    step = _frame['step'] + 1 if _frame is not None else 0
+    _frame = {'step': step, 'time': sim_sec, 'phases': dict()}
+    _frames.append(_frame)
+
+
+def _counting_hook(path, name, args, func):
+    global COM_CALLS
+    COM_CALLS += 1
+    return func(*args)
@@ -0,0 +1,67 @@
+import sys
+import logging
+import importlib
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""Deferred imports of heavy dependencies.
+
+Vissim's script engine imports the scripts again at every simulation start. numpy and pandas make up
+    most of the import time of this package, but are only needed for the vectorized UAV dynamics and
+    for saveResults(). Modules that need them bind a LazyModule instead, which imports the real
+    module at the first attribute access. After that every attribute is cached on the LazyModule,
+    so hot loops pay no extra cost.
+
+Example:
+    from ptv_sim import lazy
+    np = lazy.module('numpy') # nothing is imported yet
+    ...
+    np.zeros(3) # numpy is imported here
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class LazyModule(object):
+    """Stands in for a module until one of its attributes is used.
+
+    Attributes:
+        name:(string) name of the module
+        loaded:(bool) whether the module was imported
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._module = None
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def load(self):
+        """Import the module now and return it."""
+        if self._module is None:
+            logger.debug("Importing "+self.name)
+            self._module = importlib.import_module(self.name)
+        return self._module
+
+    def __getattr__(self, attr):
+        # only called for attributes that are not cached yet
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        value = getattr(self.load(), attr)
+        setattr(self, attr, value)
+        return value
+
+    def __repr__(self):
+        return "<lazy module '" + self.name + "'" + (" (loaded)>" if self.loaded else ">")
+
+
+def module(name):
+    """Returns a LazyModule for name, or the module itself if it was already imported."""
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
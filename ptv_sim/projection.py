@@ -0,0 +1,156 @@
+import re
+import math
+import logging
+
+from ptv_sim import lazy
+
+np = lazy.module('numpy')
+
+try:
+    string_types = basestring # python 2, column names may be unicode
+except NameError:
+    string_types = str
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""Conversion of Vissim network coordinates to Web Mercator and latitude/longitude.
+
+Vissim places the network on the background map with two reference points (network settings):
+    RefPointNet in network coordinates and RefPointMap, the same point in Web Mercator (EPSG:3857).
+    setup() reads both once from Vissim.Net.NetPara, or takes them as arguments.
+A Projection converts whole columns of x/y at once with NumPy (100M points take a few seconds).
+    z (UAV altitude) is left as it is. After setup() car.saveResults(), uav.saveResults() and
+    network.saveResults() add lat/lon (or Web Mercator) columns for the positions and message
+    locations. On demand, toLatLon(), toMercator() and addColumns() work on any arrays or DataFrames,
+    e.g. the results of ptv_sim.store.
+
+Network coordinates drawn on Vissim's background map are in Web Mercator meters (scale 1). If the
+    network was built in true meters, set true_scale=True to stretch it by 1/cos(latitude).
+
+Example:
+    projection.setup(Vissim)
+    lat, lon = projection.PROJECTION.toLatLon(df['x'], df['y'])
+    projection.PROJECTION.addColumns(store.query("SELECT * FROM uavs"), 'x', 'y')
+"""
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS = 6378137.0 # [m] of the Web Mercator sphere
+COLUMNS = ('latlon', 'mercator', 'both')
+PROJECTION = None # set by setup(), used by the saveResults() functions
+
+
+def setup(_Vissim=None, ref_map=None, ref_net=None, true_scale=False, columns='latlon'):
+    """Configure the projection used by saveResults().
+
+    Args:
+        _Vissim:(COM) the Vissim COM object, the reference points are read from Net.NetPara
+        ref_map:(list) [X,Y] of the reference point in Web Mercator, instead of RefPointMap
+        ref_net:(list) [X,Y] of the reference point in network coordinates, instead of RefPointNet
+        true_scale:(bool) the network is in true meters instead of Web Mercator meters
+        columns:(string) columns that saveResults() adds, 'latlon', 'mercator' or 'both'
+
+    Returns the Projection, None if neither _Vissim nor ref_map is given.
+    """
+    global PROJECTION
+    if _Vissim == None and ref_map == None:
+        logger.error("Projection needs the Vissim COM object or ref_map, results are saved without projected columns")
+        return None
+    if ref_map == None:
+        ref_map = _point(_Vissim.Net.NetPara.AttValue('RefPointMap'))
+    if ref_net == None:
+        ref_net = _point(_Vissim.Net.NetPara.AttValue('RefPointNet')) if _Vissim != None else (0.0, 0.0)
+    PROJECTION = Projection(ref_map, ref_net, true_scale, columns)
+    logger.info("Projecting results around lat "+str(round(PROJECTION.ref_lat, 6))+", lon "+str(round(PROJECTION.ref_lon, 6)))
+    return PROJECTION
+
+
+class Projection(object):
+    """Network coordinates to Web Mercator and latitude/longitude around a reference point.
+
+    Attributes:
+        ref_map:(tuple) (X, Y) of the reference point in Web Mercator
+        ref_net:(tuple) (X, Y) of the reference point in network coordinates
+        ref_lat:(float) latitude of the reference point [deg]
+        ref_lon:(float) longitude of the reference point [deg]
+        scale:(float) Web Mercator meters per network unit
+        columns:(string) columns that addColumns() adds, 'latlon', 'mercator' or 'both'
+    """
+
+    def __init__(self, ref_map, ref_net=(0.0, 0.0), true_scale=False, columns='latlon'):
+        if columns not in COLUMNS:
+            raise ValueError("Unknown projection columns '" + str(columns) + "', options are " + str(COLUMNS))
+        self.ref_map = (float(ref_map[0]), float(ref_map[1]))
+        self.ref_net = (float(ref_net[0]), float(ref_net[1]))
+        self.ref_lon = math.degrees(self.ref_map[0] / EARTH_RADIUS)
+        self.ref_lat = math.degrees(2 * math.atan(math.exp(self.ref_map[1] / EARTH_RADIUS)) - math.pi / 2)
+        self.scale = 1 / math.cos(math.radians(self.ref_lat)) if true_scale else 1.0
+        self.columns = columns
+
+    def toMercator(self, x, y):
+        """Returns Web Mercator X, Y arrays of network coordinates (arrays, lists or scalars, a scalar gives
+        an array of one point)."""
+        # scalars become arrays of one point, toLatLon() works in place on the result
+        mx = np.atleast_1d(np.asarray(x, dtype=np.float64)) - self.ref_net[0]
+        my = np.atleast_1d(np.asarray(y, dtype=np.float64)) - self.ref_net[1]
+        if self.scale != 1.0:
+            mx *= self.scale
+            my *= self.scale
+        mx += self.ref_map[0]
+        my += self.ref_map[1]
+        return mx, my
+
+    def toLatLon(self, x, y):
+        """Returns latitude, longitude arrays [deg] of network coordinates (arrays, lists or scalars, a scalar
+        gives an array of one point)."""
+        mx, my = self.toMercator(x, y)
+        # in place, a column of 100M points needs no more than two temporary arrays
+        lon = np.multiply(mx, 180 / (math.pi * EARTH_RADIUS), out=mx)
+        lat = np.divide(my, EARTH_RADIUS, out=my)
+        np.exp(lat, out=lat)
+        np.arctan(lat, out=lat)
+        lat *= 360 / math.pi
+        lat -= 90
+        return lat, lon
+
+    def fromLatLon(self, lat, lon):
+        """Returns network x, y arrays of latitudes and longitudes [deg]."""
+        mx = np.radians(np.asarray(lon, dtype=np.float64)) * EARTH_RADIUS
+        my = np.log(np.tan(math.pi / 4 + np.radians(np.asarray(lat, dtype=np.float64)) / 2)) * EARTH_RADIUS
+        x = (mx - self.ref_map[0]) / self.scale + self.ref_net[0]
+        y = (my - self.ref_map[1]) / self.scale + self.ref_net[1]
+        return x, y
+
+    def addColumns(self, df, x='x', y='y', prefix=''):
+        """Add lat/lon and/or mercator_x/mercator_y columns to a pandas DataFrame, returns df.
+
+        Args:
+            df:(DataFrame) the table
+            x:(string or array) name of the x column, or the values
+            y:(string or array) name of the y column, or the values
+            prefix:(string) prefix of the new column names, e.g. 'sender_'
+        """
+        x = df[x].values if isinstance(x, string_types) else x
+        y = df[y].values if isinstance(y, string_types) else y
+        if self.columns in ('mercator', 'both'):
+            mx, my = self.toMercator(x, y)
+            df[prefix + 'mercator_x'] = mx
+            df[prefix + 'mercator_y'] = my
+        if self.columns in ('latlon', 'both'):
+            lat, lon = self.toLatLon(x, y)
+            df[prefix + 'lat'] = lat
+            df[prefix + 'lon'] = lon
+        return df
+
+
+def _point(value):
+    # a point attribute of Vissim, as (X, Y[, Z]) or as a string of numbers, e.g. "-9240000.5 4865000.25"
+    if isinstance(value, (list, tuple)):
+        return (float(value[0]), float(value[1]))
+    numbers = re.findall(r"[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?", str(value))
+    if len(numbers) < 2:
+        raise ValueError("Cannot read a point from " + repr(value))
+    return (float(numbers[0]), float(numbers[1]))
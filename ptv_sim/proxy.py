@@ -0,0 +1,115 @@
+import types
+import logging
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""Transparent proxies around the Vissim COM object.
+
+A proxy forwards every attribute access and method call to the wrapped COM object,
+    giving a hook function the chance to observe each call on the way through.
+Objects returned by the COM interface (Net, Vehicles, a single vehicle, ...) are wrapped
+    again so that the whole object tree below the proxy is observed.
+Plain values (numbers, strings, tuples from GetMultipleAttributes) are returned untouched.
+"""
+
+logger = logging.getLogger(__name__)
+
+_METHOD_TYPES = (types.MethodType, types.BuiltinMethodType, types.FunctionType)
+try:
+    _PRIMITIVES = (type(None), bool, int, long, float, str, unicode, tuple, list, dict)
+except NameError: # python 3
+    _PRIMITIVES = (type(None), bool, int, float, str, bytes, tuple, list, dict)
+
+
+def passthrough(path, name, args, func):
+    """Default hook, simply calls the COM method.
+
+    Args:
+        path:(tuple) names leading to the object the method belongs to, e.g. ('Net','Vehicles')
+        name:(string) name of the method being called, e.g. 'GetMultipleAttributes'
+        args:(tuple) arguments given to the method (already unwrapped)
+        func:(callable) the real COM method
+    """
+    return func(*args)
+
+
+def wrap(value, hook, path=()):
+    """Wrap a COM object in a ComProxy. Plain values are returned as they are."""
+    if isinstance(value, _PRIMITIVES) or isinstance(value, ComProxy):
+        return value
+    return ComProxy(value, hook, path)
+
+
+def unwrap(value):
+    """Return the real COM object behind a proxy (or the value itself)."""
+    if isinstance(value, ComProxy):
+        return object.__getattribute__(value, '_target')
+    return value
+
+
+def call_key(name, args):
+    """Build a readable key for a method call, e.g. ItemByKey(12) or AttValue(SimSec)."""
+    return name + "(" + ",".join([str(arg) for arg in args]) + ")"
+
+
+def path_key(path):
+    """Build a readable key for an object path, e.g. Net.Vehicles.ItemByKey(12)"""
+    return ".".join(path)
+
+
+class ComProxy(object):
+    """Forwards attribute access and method calls to a COM object through a hook.
+
+    Attributes:
+        _target:(COM) the wrapped object
+        _hook:(function) hook(path, name, args, func) called for every method call
+        _path:(tuple) names leading from the root proxy to this object
+    """
+
+    def __init__(self, target, hook=passthrough, path=()):
+        object.__setattr__(self, '_target', target)
+        object.__setattr__(self, '_hook', hook)
+        object.__setattr__(self, '_path', path)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if isinstance(value, _METHOD_TYPES):
+            return _ComMethod(self._path, name, value, self._hook)
+        return wrap(value, self._hook, self._path + (name,))
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, unwrap(value))
+
+    def __iter__(self):
+        for i, item in enumerate(self._target):
+            yield wrap(item, self._hook, self._path + ("[" + str(i) + "]",))
+
+    def __eq__(self, other):
+        return unwrap(self) == unwrap(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self._target)
+
+    def __repr__(self):
+        return "<ComProxy " + path_key(self._path) + " of " + repr(self._target) + ">"
+
+
+class _ComMethod(object):
+    """A bound COM method that routes its calls through the proxy hook."""
+
+    def __init__(self, path, name, func, hook):
+        self._path = path
+        self._name = name
+        self._func = func
+        self._hook = hook
+
+    def __call__(self, *args):
+        args = tuple([unwrap(arg) for arg in args])
+        result = self._hook(self._path, self._name, args, self._func)
+        return wrap(result, self._hook, self._path + (call_key(self._name, args),))
@@ -0,0 +1,275 @@
+import os
+import json
+import logging
+import numpy as np
+
+from ptv_sim.proxy import ComProxy, call_key, path_key
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""Record the traffic a simulation reads from Vissim and replay it without Vissim.
+
+The Recorder wraps the Vissim COM object that is given to car.setup/uav.setup/network.setup.
+Every GetMultipleAttributes snapshot is written to its own memory-mappable NumPy file and every
+    AttValue read (SimSec, SimRes, RandSeed, vehicle/vehicle type attributes, ...) is stored in
+    a small JSON index, grouped by simulation second.
+The Replay backend reads such a trace back and answers the same COM calls from disk at memory speed,
+    so communication and UAV logic can be iterated over the same traffic without running Vissim.
+
+Example:
+    rec = replay.Recorder(Vissim, "C:\\traces\\run_1")
+    vcar.setup(rec.Vissim, ...)    # use rec.Vissim everywhere instead of Vissim
+    ...
+    rec.close()                    # call when the simulation is finished
+
+    rep = replay.Replay("C:\\traces\\run_1")
+    vcar.setup(rep.Vissim, ...)
+    while rep.advance():           # or rep.Vissim.Simulation.RunSingleStep()
+        runSingleStep()
+"""
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.json"
+SNAPSHOT_DIR = "snapshots"
+
+try:
+    _text = unicode
+    _ints = (int, long)
+except NameError: # python 3
+    _text = str
+    _ints = (int,)
+
+
+class Recorder:
+    """Recording proxy around the Vissim COM object.
+
+    Steps are delimited by reads of Simulation.AttValue('SimSec'). Every COM call made through
+    Recorder.Vissim is attributed to the simulation second that was read last.
+
+    Attributes:
+        Vissim:(ComProxy) the recording Vissim object to hand to the modules
+        trace_dir:(string) directory the trace is written to
+        steps:(list) index entries of all recorded steps
+    """
+
+    def __init__(self, _Vissim, trace_dir):
+        """Start a new recording.
+
+        Args:
+            _Vissim:(COM) the Vissim COM object associated with your simulation
+            trace_dir:(string) an absolute directory, created if it does not exist
+        """
+        self.trace_dir = trace_dir
+        snapshot_dir = os.path.join(trace_dir, SNAPSHOT_DIR)
+        if not os.path.exists(snapshot_dir):
+            logger.info("Creating directory "+snapshot_dir)
+            os.makedirs(snapshot_dir)
+
+        self.steps = []
+        self._new_step(None)
+        self.Vissim = ComProxy(_Vissim, self._observe)
+
+    def close(self):
+        """Write the trace index. Call once after the simulation has finished."""
+        filepath = os.path.join(self.trace_dir, INDEX_FILE)
+        logger.info("Saving trace index with "+str(len(self.steps))+" steps to "+filepath)
+        with open(filepath, 'w') as f:
+            json.dump({'version': 1, 'steps': self.steps}, f)
+
+    def _new_step(self, sim_sec):
+        self.steps.append({'time': sim_sec, 'scalars': {}, 'snapshots': []})
+
+    def _observe(self, path, name, args, func):
+        result = func(*args)
+
+        if name == 'AttValue':
+            if path == ('Simulation',) and args and args[0] == 'SimSec':
+                self._clock(float(result))
+            self.steps[-1]['scalars'][path_key(path + (call_key(name, args),))] = _scalar(result)
+
+        elif name == 'GetMultipleAttributes':
+            self._snapshot(path, list(args[0]), result)
+
+        return result
+
+    def _clock(self, sim_sec):
+        step = self.steps[-1]
+        if step['time'] is None:
+            step['time'] = sim_sec
+        elif step['time'] != sim_sec:
+            self._new_step(sim_sec)
+
+    def _snapshot(self, path, attributes, rows):
+        step_num = len(self.steps) - 1
+        snapshots = self.steps[-1]['snapshots']
+        filename = "%06d_%02d.npy" % (step_num, len(snapshots))
+        table, kinds = _to_table(attributes, rows)
+        np.save(os.path.join(self.trace_dir, SNAPSHOT_DIR, filename), table)
+        snapshots.append({
+            'path': path_key(path),
+            'attributes': attributes,
+            'kinds': kinds,
+            'file': filename,
+        })
+
+
+class Replay:
+    """Replays a recorded trace through a Vissim-like object.
+
+    Reads (AttValue, GetMultipleAttributes) are answered from the trace. Writes and any other
+    method calls are accepted and ignored. AttValue reads that were not recorded in the current
+    step fall back to the last recorded value (e.g. SimRes or vehicle type capacities).
+
+    Attributes:
+        Vissim:(object) the replaying Vissim object to hand to the modules
+        trace_dir:(string) directory the trace is read from
+        steps:(list) index entries of all recorded steps
+        step:(int) index of the current step
+    """
+
+    def __init__(self, trace_dir):
+        """Open a recorded trace, positioned at its first step.
+
+        Args:
+            trace_dir:(string) directory a Recorder wrote to
+        """
+        self.trace_dir = trace_dir
+        with open(os.path.join(trace_dir, INDEX_FILE)) as f:
+            self.steps = json.load(f)['steps']
+        logger.info("Loaded trace with "+str(len(self.steps))+" steps from "+trace_dir)
+        self.Vissim = _ReplayNode(self, ())
+        self.step = -1
+        self._sticky = dict()
+        self.advance()
+
+    def advance(self):
+        """Move to the next recorded step. Returns False at the end of the trace."""
+        if self.step + 1 >= len(self.steps):
+            return False
+        self.step += 1
+        self._sticky.update(self.steps[self.step]['scalars'])
+        return True
+
+    def seek(self, sim_sec):
+        """Move to the first recorded step at or after the given simulation second."""
+        self.step = -1
+        self._sticky = dict()
+        while self.advance():
+            if self.time() is not None and self.time() >= sim_sec:
+                return True
+        return False
+
+    def time(self):
+        """Returns the simulation second of the current step."""
+        return self.steps[self.step]['time']
+
+    def _call(self, path, name, args):
+        if name == 'AttValue':
+            return self._attvalue(path, args)
+        elif name == 'GetMultipleAttributes':
+            return self._snapshot(path, list(args[0]))
+        elif name == 'RunSingleStep':
+            self.advance()
+        return _ReplayNode(self, path + (call_key(name, args),))
+
+    def _attvalue(self, path, args):
+        key = path_key(path + (call_key('AttValue', args),))
+        if key in self._sticky:
+            return self._sticky[key]
+        if path == ('Simulation',) and args and args[0] == 'SimSec':
+            return self.time()
+        # vehicles created through ItemByKey can be looked up in the vehicle snapshot
+        if len(path) == 3 and path[:2] == ('Net', 'Vehicles') and path[2].startswith('ItemByKey('):
+            number = int(path[2][len('ItemByKey('):-1])
+            rows = self._snapshot(('Net', 'Vehicles'), ['No', args[0]])
+            row = next((row for row in rows if row[0] == number), None)
+            if row is not None:
+                return row[1]
+        logger.debug("No recorded value for "+key+" at step "+str(self.step))
+        return None
+
+    def _snapshot(self, path, attributes):
+        key = path_key(path)
+        for snapshot in self.steps[self.step]['snapshots']:
+            recorded = snapshot['attributes']
+            if snapshot['path'] == key and all(attr in recorded for attr in attributes):
+                table = np.load(os.path.join(self.trace_dir, SNAPSHOT_DIR, snapshot['file']), mmap_mode='r')
+                return _from_table(table, [recorded.index(attr) for attr in attributes])
+        logger.error("No recorded snapshot of "+key+" with attributes "+str(attributes)+" at step "+str(self.step))
+        return ()
+
+
+class _ReplayNode(object):
+    """Stands in for any COM object below Replay.Vissim"""
+
+    def __init__(self, replay, path):
+        self._replay = replay
+        self._path = path
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _ReplayNode(self._replay, self._path + (name,))
+
+    def __call__(self, *args):
+        return self._replay._call(self._path[:-1], self._path[-1], args)
+
+
+def _scalar(value):
+    # the index is json, anything exotic is stored as text
+    if value is None or isinstance(value, (bool, float, _text, str) + _ints):
+        return value
+    return _text(value)
+
+
+def _kind(column):
+    values = [value for value in column if value is not None]
+    if not values:
+        return 'float', 'f8'
+    if all(isinstance(value, bool) for value in values):
+        return 'bool', '?'
+    if all(isinstance(value, _ints) and not isinstance(value, bool) for value in values):
+        return 'int', 'i8'
+    if all(isinstance(value, _ints + (float,)) for value in values):
+        return 'float', 'f8'
+    width = max([len(_text(value)) for value in values] + [1])
+    return 'str', 'U' + str(width)
+
+
+def _to_table(attributes, rows):
+    # one structured array per snapshot, a value field and a null mask field per attribute
+    columns = list(zip(*rows)) if rows else [()] * len(attributes)
+    kinds = []
+    dtype = []
+    for i, column in enumerate(columns):
+        kind, code = _kind(column)
+        kinds.append(kind)
+        dtype.append(('v%d' % i, code))
+        dtype.append(('n%d' % i, '?'))
+
+    table = np.zeros(len(rows), dtype=dtype)
+    empty = {'bool': False, 'int': 0, 'float': 0.0, 'str': u''}
+    for i, column in enumerate(columns):
+        kind = kinds[i]
+        if kind == 'str':
+            table['v%d' % i] = [empty[kind] if value is None else _text(value) for value in column]
+        else:
+            table['v%d' % i] = [empty[kind] if value is None else value for value in column]
+        table['n%d' % i] = [value is None for value in column]
+    return table, kinds
+
+
+def _from_table(table, positions):
+    columns = []
+    for i in positions:
+        values = table['v%d' % i].tolist()
+        nulls = table['n%d' % i]
+        if nulls.any():
+            for j in np.flatnonzero(nulls):
+                values[j] = None
+        columns.append(values)
+    return tuple(zip(*columns))
@@ -0,0 +1,226 @@
+import os
+import json
+import random
+import logging
+import itertools
+import traceback
+import multiprocessing
+from timeit import default_timer as timer
+
+from ptv_sim.context import SimulationContext
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""Run many simulations in parallel, e.g. a sweep over seeds, penetration rates and comm ranges.
+
+The modules keep their state in module globals and class level lists (Vissim, RESULTS_DIR, TIME,
+    Car.all_cars, ...). Runner hands every run to a fresh worker process of a multiprocessing pool
+    (maxtasksperchild=1), which imports the modules from scratch, and runs the scenario in its own
+    SimulationContext (see ptv_sim.context).
+Every run gets its own Vissim backend (the stand-in, a recorded trace or a user function), its own
+    run directory with params.json and run.log, and writes its results there. aggregate() merges the
+    files of all runs into one table per file name with the parameters of the run as extra columns.
+
+The scenario is a module level function scenario(Vissim, run_dir, params) that sets up the modules,
+    runs the steps and saves the results into run_dir. On Windows the worker processes import the
+    main script again, so start the runner from within if __name__ == '__main__'.
+
+Example:
+    def scenario(Vissim, run_dir, params):
+        vcar.setup(Vissim, run_dir, [111])
+        vnet.setup(Vissim, run_dir)
+        ...
+        for i in range(600):
+            Vissim.Simulation.RunSingleStep()
+            runSingleStep()
+        vcar.saveResults(os.path.join(run_dir, "cars.csv"))
+
+    if __name__ == '__main__':
+        r = runner.Runner(scenario, RESULTS_DIR, backend='standin', backend_parameters={'num_vehicles': 500})
+        r.run(runner.sweep(seed=range(10), penetration=[0.1, 0.5], comm_range=[300, 500]))
+        r.aggregate()
+"""
+
+logger = logging.getLogger(__name__)
+
+PARAMS_FILE = "params.json"
+LOG_FILE = "run.log"
+AGGREGATE_DIR = "aggregate"
+SUMMARY_FILE = "runs.csv"
+
+
+def sweep(**axes):
+    """Returns the parameters of all combinations of the given values, one dict per run.
+
+    Example:
+        sweep(seed=range(3), comm_range=[300, 500]) # 6 runs
+    """
+    names = sorted(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*[list(axes[name]) for name in names])]
+
+
+class Runner:
+    """Fans runs out over a process pool.
+
+    Attributes:
+        scenario:(function) scenario(Vissim, run_dir, params), see module documentation
+        results_dir:(string) every run writes to results_dir/run_<id>/, merged results go to results_dir/aggregate/
+        backend:(string or function) 'standin', 'replay', or backend(params) returning a Vissim object
+        backend_parameters:(dict) keyword arguments of StandinVissim, or {'trace_dir': ...} for 'replay'
+        processes:(int) number of worker processes, 0 runs everything in this process one after the other (for debugging)
+        runs:(list) a summary dict of every finished run
+    """
+
+    def __init__(self, scenario, results_dir, backend='standin', backend_parameters=None, processes=None):
+        """Create a runner.
+
+        Args:
+            scenario:(function) module level function scenario(Vissim, run_dir, params)
+            results_dir:(string) an absolute directory, created if it does not exist
+            backend:(string or function) 'standin', 'replay', or a module level function backend(params) returning a Vissim object
+            backend_parameters:(dict) keyword arguments of StandinVissim (seed defaults to the seed of the run), or {'trace_dir': ...} for 'replay'
+            processes:(int) number of worker processes, defaults to the number of CPUs
+        """
+        if backend not in ('standin', 'replay') and not callable(backend):
+            raise ValueError("Unknown backend '" + str(backend) + "', options are 'standin', 'replay' or a function")
+        if backend == 'replay' and 'trace_dir' not in (backend_parameters or {}):
+            raise ValueError("The replay backend needs backend_parameters={'trace_dir': ...}")
+        self.scenario = scenario
+        self.results_dir = results_dir
+        self.backend = backend
+        self.backend_parameters = dict(backend_parameters or {})
+        self.processes = multiprocessing.cpu_count() if processes == None else processes
+        self.runs = []
+
+    def run(self, runs):
+        """Run all runs and wait for them to finish.
+
+        Args:
+            runs:(list) the parameters of every run as a dict, e.g. from sweep(). The 'seed' of a run
+                defaults to its index and seeds random and the stand-in
+
+        Returns a list of summary dicts (run_id, status, duration, error and the parameters) in run order.
+        """
+        if not os.path.exists(self.results_dir):
+            logger.info("Creating directory "+self.results_dir)
+            os.makedirs(self.results_dir)
+        tasks = []
+        for run_id, params in enumerate(runs):
+            params = dict(params)
+            params.setdefault('seed', run_id)
+            tasks.append((run_id, params, self.scenario, self.backend, self.backend_parameters, self._runDir(run_id)))
+
+        logger.info("Starting "+str(len(tasks))+" runs on "+str(self.processes)+" processes")
+        started = timer()
+        if self.processes == 0:
+            summaries = [_run(task) for task in tasks]
+        else:
+            pool = multiprocessing.Pool(self.processes, maxtasksperchild=1)
+            try:
+                summaries = pool.map(_run, tasks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        failed = [summary for summary in summaries if summary['status'] != 'ok']
+        logger.info("Finished "+str(len(tasks))+" runs in "+str(round(timer() - started, 1))+" s, "+str(len(failed))+" failed")
+        for summary in failed:
+            logger.error("Run "+str(summary['run_id'])+" failed: "+summary['error'])
+        self.runs = summaries
+        return summaries
+
+    def aggregate(self, filenames=None):
+        """Merge the result files of all runs.
+
+        Every file name that a run wrote to its run directory (or only the given file names) is read
+        from all runs and written to results_dir/aggregate/ as one table, with the run_id and the
+        parameters of the run as extra columns. A summary of all runs is written to runs.csv.
+
+        Args:
+            filenames:(list) names of the files to merge, defaults to all .csv files of the runs
+
+        Returns a dict of file name -> merged pandas DataFrame.
+        """
+        import pandas as pd
+        aggregate_dir = os.path.join(self.results_dir, AGGREGATE_DIR)
+        if not os.path.exists(aggregate_dir):
+            logger.info("Creating directory "+aggregate_dir)
+            os.makedirs(aggregate_dir)
+
+        runs = [summary for summary in self.runs if summary['status'] == 'ok']
+        if filenames == None:
+            filenames = sorted(set(name for summary in runs for name in os.listdir(self._runDir(summary['run_id']))
+                                   if name.endswith('.csv')))
+        merged = dict()
+        for name in filenames:
+            frames = []
+            for summary in runs:
+                filepath = os.path.join(self._runDir(summary['run_id']), name)
+                if not os.path.exists(filepath):
+                    logger.warning("Run "+str(summary['run_id'])+" did not write "+name)
+                    continue
+                df = pd.read_csv(filepath)
+                df.insert(0, 'run_id', summary['run_id'])
+                for param in sorted(summary['params']):
+                    df[param] = summary['params'][param]
+                frames.append(df)
+            if frames:
+                merged[name] = pd.concat(frames, ignore_index=True)
+                logger.info("Saving "+str(len(frames))+" merged runs of "+name+" to "+aggregate_dir)
+                merged[name].to_csv(os.path.join(aggregate_dir, name), encoding='utf-8', index=False)
+
+        rows = []
+        for summary in self.runs:
+            row = dict((key, summary[key]) for key in ('run_id', 'status', 'duration', 'error'))
+            row.update(summary['params'])
+            rows.append(row)
+        pd.DataFrame(rows).to_csv(os.path.join(aggregate_dir, SUMMARY_FILE), encoding='utf-8', index=False)
+        return merged
+
+    def _runDir(self, run_id):
+        return os.path.join(self.results_dir, "run_" + str(run_id)) + os.sep
+
+
+def _run(task):
+    # runs in the worker process, returns the summary of the run
+    run_id, params, scenario, backend, backend_parameters, run_dir = task
+    if not os.path.exists(run_dir):
+        os.makedirs(run_dir)
+    with open(os.path.join(run_dir, PARAMS_FILE), 'w') as f:
+        json.dump(params, f, indent=1, sort_keys=True)
+
+    handler = logging.FileHandler(os.path.join(run_dir, LOG_FILE))
+    handler.setFormatter(logging.Formatter("[%(asctime)s - %(levelname)s] [%(name)s]  %(message)s"))
+    root = logging.getLogger()
+    root.addHandler(handler)
+
+    summary = {'run_id': run_id, 'params': params, 'status': 'ok', 'error': '', 'duration': None}
+    started = timer()
+    try:
+        random.seed(params['seed'])
+        Vissim = _backend(backend, backend_parameters, params)
+        with SimulationContext(Vissim):
+            scenario(Vissim, run_dir, params)
+    except Exception:
+        summary['status'] = 'failed'
+        summary['error'] = traceback.format_exc()
+        logger.critical("Run "+str(run_id)+" failed\n"+summary['error'])
+    finally:
+        summary['duration'] = timer() - started
+        root.removeHandler(handler)
+        handler.close()
+    return summary
+
+
+def _backend(backend, backend_parameters, params):
+    if backend == 'standin':
+        from ptv_sim.standin import StandinVissim
+        parameters = dict(backend_parameters)
+        parameters.setdefault('seed', params['seed'])
+        return StandinVissim(**parameters)
+    if backend == 'replay':
+        from ptv_sim.replay import Replay
+        return Replay(backend_parameters['trace_dir']).Vissim
+    return backend(params)
@@ -0,0 +1,400 @@
+import logging
+import numpy as np
+
+try:
+    import cPickle as pickle
+except ImportError: # python 3
+    import pickle
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""A local stand-in for the Vissim COM object.
+
+Generates synthetic traffic on a set of straight, parallel links so that the modules can be
+    exercised (benchmarks, parallel runs, debugging) without Vissim.
+Only the parts of the COM interface used by this library are implemented. Unknown vehicle
+    attributes read as None, like attributes Vissim does not have a value for.
+
+Example:
+    Vissim = standin.StandinVissim(num_vehicles=1000)
+    vcar.setup(Vissim, RESULTS_DIR, [111])
+    for i in range(600):
+        Vissim.Simulation.RunSingleStep()
+        runSingleStep()
+"""
+
+logger = logging.getLogger(__name__)
+
+_VEHICLE_ARRAYS = ('no', 'veh_type', 'link', 'lane', 'pos', 'des_speed', 'dist')
+_COLLECTIONS = ('VehicleTypes', 'Static3DModels', 'CameraPositions', 'Storyboards', 'Scripts')
+
+LANE_WIDTH = 3.5
+LINK_SPACING = 20.0
+VEHICLE_LENGTH = 4.5
+SIGNAL_CYCLE = 60.0 # [s] of the fixed time signal controllers
+SIGNAL_PLAN = (('GREEN', 27.0), ('AMBER', 3.0), ('RED', 30.0)) # states of a signal group and their durations [s]
+
+
+class StandinVissim(object):
+    """Stands in for the Vissim COM object.
+
+    Vehicles enter at the start of a link, drive along it at their desired speed and leave the
+    network at its end. A new vehicle enters for every vehicle that leaves, so the number of
+    vehicles in the network stays at num_vehicles.
+
+    Attributes:
+        Simulation:(object) implements AttValue, SetAttValue, RunSingleStep, Stop, SaveSnapshot and LoadSnapshot
+        Net:(object) holds the Vehicles, VehicleTypes, Static3DModels, CameraPositions, Storyboards and Scripts collections
+            and NetPara with the reference points of the network (see ptv_sim.projection). With signals, a fixed
+            time signal controller at the end of every link (SignalControllers, SignalHeads, see ptv_comm.spat)
+    """
+
+    def __init__(self, num_vehicles=100, veh_types=(111,), num_links=10, link_length=1000.0,
+                 num_lanes=2, speed_range=(40, 60), sim_res=10, seed=0, signals=False):
+        """Create a stand-in with a network full of vehicles.
+
+        Args:
+            num_vehicles:(int) number of vehicles kept in the network
+            veh_types:(list) vehicle types that are assigned to vehicles in turn
+            num_links:(int) number of links
+            link_length:(float) length of every link [m]
+            num_lanes:(int) number of lanes on every link
+            speed_range:(tuple) desired speeds are drawn uniformly from this range [km/h]
+            sim_res:(int) simulation resolution [time steps per simulation second]
+            seed:(int) random seed
+            signals:(bool) put a signal controller at the end of every link, with a signal group and head for every
+                lane. Vehicles do not stop for them
+        """
+        self.num_vehicles = num_vehicles
+        self.veh_types = list(veh_types)
+        self.num_links = num_links
+        self.link_length = float(link_length)
+        self.num_lanes = num_lanes
+        self.speed_range = speed_range
+        self.signals = signals
+        self.random = np.random.RandomState(seed)
+
+        self.Simulation = _Simulation(self, sim_res, seed)
+        self.Net = _Net(self)
+
+        self._next_no = 1
+        self.no = np.zeros(0, dtype=np.int64)
+        self.veh_type = np.zeros(0, dtype=np.int64)
+        self.link = np.zeros(0, dtype=np.int64)
+        self.lane = np.zeros(0, dtype=np.int64)
+        self.pos = np.zeros(0)
+        self.des_speed = np.zeros(0)
+        self.dist = np.zeros(0)
+        self._spawn(num_vehicles, self.random.uniform(0, self.link_length, num_vehicles))
+
+    def LoadNet(self, *args):
+        pass
+
+    def LoadLayout(self, *args):
+        pass
+
+    def ResumeUpdateGUI(self):
+        pass
+
+    def SuspendUpdateGUI(self):
+        pass
+
+    def _spawn(self, count, pos=None):
+        if count <= 0:
+            return
+        nos = np.arange(self._next_no, self._next_no + count, dtype=np.int64)
+        self._next_no += count
+        self.no = np.concatenate([self.no, nos])
+        self.veh_type = np.concatenate([self.veh_type, np.array([self.veh_types[no % len(self.veh_types)] for no in nos], dtype=np.int64)])
+        self.link = np.concatenate([self.link, self.random.randint(1, self.num_links + 1, count)])
+        self.lane = np.concatenate([self.lane, self.random.randint(1, self.num_lanes + 1, count)])
+        self.pos = np.concatenate([self.pos, np.zeros(count) if pos is None else pos])
+        self.des_speed = np.concatenate([self.des_speed, self.random.uniform(self.speed_range[0], self.speed_range[1], count)])
+        self.dist = np.concatenate([self.dist, np.zeros(count)])
+        return nos
+
+    def _step(self, dt):
+        moved = self.des_speed / 3.6 * dt
+        self.pos = self.pos + moved
+        self.dist = self.dist + moved
+        staying = self.pos <= self.link_length
+        for name in _VEHICLE_ARRAYS:
+            setattr(self, name, getattr(self, name)[staying])
+        self._spawn(self.num_vehicles - len(self.no))
+
+    def _index(self, no):
+        idx = int(np.searchsorted(self.no, no))
+        if idx < len(self.no) and self.no[idx] == no:
+            return idx
+        return None
+
+    def _column(self, attribute, idx=slice(None)):
+        x = self.pos[idx]
+        y = self.link[idx] * LINK_SPACING + self.lane[idx] * LANE_WIDTH
+        if attribute == 'No':
+            return self.no[idx].tolist()
+        elif attribute == 'VehType':
+            return self.veh_type[idx].tolist()
+        elif attribute == 'CoordFront':
+            return ["%.3f %.3f 0.000" % (xi, yi) for xi, yi in zip(x.tolist(), y.tolist())]
+        elif attribute == 'CoordRear':
+            return ["%.3f %.3f 0.000" % (xi, yi) for xi, yi in zip((x - VEHICLE_LENGTH).tolist(), y.tolist())]
+        elif attribute == 'CoordFrontX':
+            return x.tolist()
+        elif attribute == 'CoordFrontY':
+            return y.tolist()
+        elif attribute == 'Lane\\Link\\No':
+            return self.link[idx].tolist()
+        elif attribute in ('Lane\\Index', 'DestLane'):
+            return self.lane[idx].tolist()
+        elif attribute == 'Lane':
+            return ["%d-%d" % (link, lane) for link, lane in zip(self.link[idx].tolist(), self.lane[idx].tolist())]
+        elif attribute == 'Lane\\Link\\NumLanes':
+            return [self.num_lanes] * len(x)
+        elif attribute == 'Length':
+            return [VEHICLE_LENGTH] * len(x)
+        elif attribute in ('DesSpeed', 'Speed'):
+            return self.des_speed[idx].tolist()
+        elif attribute == 'DistTravTot':
+            return self.dist[idx].tolist()
+        elif attribute in ('Acceleration', 'Hdwy'):
+            return [0.0] * len(x)
+        elif attribute == 'LeadTargNo':
+            return [0] * len(x)
+        elif attribute == 'Occup':
+            return [1] * len(x)
+        elif attribute == 'LeadTargType':
+            return [u'NONE'] * len(x)
+        else:
+            return [None] * len(x)
+
+
+class _Simulation(object):
+
+    def __init__(self, standin, sim_res, seed):
+        self._standin = standin
+        self.attributes = {'SimSec': 0.0, 'SimRes': sim_res, 'RandSeed': seed, 'SimPeriod': 3600, 'NumCores': 1}
+        self.stopped = False
+
+    def AttValue(self, attribute):
+        return self.attributes.get(attribute)
+
+    def SetAttValue(self, attribute, value):
+        self.attributes[attribute] = value
+
+    def RunSingleStep(self):
+        dt = 1.0 / self.attributes['SimRes']
+        self.attributes['SimSec'] = round(self.attributes['SimSec'] + dt, 6)
+        self._standin._step(dt)
+
+    def Stop(self):
+        logger.warning("Simulation.Stop() called on the Vissim stand-in at "+str(self.attributes['SimSec']))
+        self.stopped = True
+
+    def SaveSnapshot(self, filename):
+        standin = self._standin
+        net = standin.Net
+        snapshot = {
+            'attributes': self.attributes,
+            'vehicles': dict((name, getattr(standin, name)) for name in _VEHICLE_ARRAYS),
+            'next_no': standin._next_no,
+            'random': standin.random.get_state(),
+            'collections': dict((name, getattr(net, name)) for name in _COLLECTIONS),
+        }
+        with open(filename, 'wb') as f:
+            pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+
+    def LoadSnapshot(self, filename):
+        standin = self._standin
+        with open(filename, 'rb') as f:
+            snapshot = pickle.load(f)
+        self.attributes = snapshot['attributes']
+        for name in _VEHICLE_ARRAYS:
+            setattr(standin, name, snapshot['vehicles'][name])
+        standin._next_no = snapshot['next_no']
+        standin.random.set_state(snapshot['random'])
+        for name in _COLLECTIONS:
+            setattr(standin.Net, name, snapshot['collections'][name])
+
+
+class _Net(object):
+
+    def __init__(self, standin):
+        self.Vehicles = _Vehicles(standin)
+        self.VehicleTypes = _Collection()
+        for veh_type in standin.veh_types:
+            self.VehicleTypes._add(veh_type, {'Capacity': 5})
+        self.Static3DModels = _Collection()
+        self.CameraPositions = _Collection()
+        self.Storyboards = _Collection()
+        self.Scripts = _Collection()
+        # network origin on the map (lat 40.0, lon -83.0), Web Mercator
+        self.NetPara = _Item(None, {'RefPointMap': "-9239517.7358 4865942.2795", 'RefPointNet': "0 0"})
+        self.SignalControllers = _Collection()
+        self.SignalHeads = _SignalHeads(standin)
+        if standin.signals:
+            for link in range(1, standin.num_links + 1):
+                self.SignalControllers._add(link, {'Type': 'FIXEDTIME', 'CycTm': SIGNAL_CYCLE})
+                for lane in range(1, standin.num_lanes + 1):
+                    self.SignalHeads._add(None, {'SG\\SigCtrl\\No': link, 'SG\\No': lane, 'Lane\\Link\\No': link,
+                                                 'Lane\\Index': lane, 'Pos': standin.link_length})
+
+
+class _Vehicles(object):
+
+    def __init__(self, standin):
+        self._standin = standin
+
+    @property
+    def Count(self):
+        return len(self._standin.no)
+
+    def GetMultipleAttributes(self, attributes):
+        columns = [self._standin._column(attribute) for attribute in attributes]
+        return tuple(zip(*columns))
+
+    def ItemByKey(self, no):
+        return _Vehicle(self._standin, int(no))
+
+    def AddVehicleAtLinkPosition(self, veh_type, link, lane, pos, des_speed, interaction=True):
+        standin = self._standin
+        no = standin._spawn(1)[0]
+        idx = len(standin.no) - 1
+        standin.veh_type[idx] = veh_type
+        standin.link[idx] = link
+        standin.lane[idx] = lane
+        standin.pos[idx] = pos
+        standin.des_speed[idx] = des_speed
+        return _Vehicle(standin, int(no))
+
+
+class _Vehicle(object):
+
+    def __init__(self, standin, no):
+        self._standin = standin
+        self.no = no
+
+    def AttValue(self, attribute):
+        idx = self._standin._index(self.no)
+        if idx is None:
+            return None
+        return self._standin._column(attribute, slice(idx, idx + 1))[0]
+
+    def SetAttValue(self, attribute, value):
+        idx = self._standin._index(self.no)
+        if idx is not None and attribute == 'DesSpeed':
+            self._standin.des_speed[idx] = value
+
+    def MoveToLinkPosition(self, link, lane, pos):
+        idx = self._standin._index(self.no)
+        if idx is not None:
+            self._standin.link[idx] = link
+            self._standin.lane[idx] = max(lane, 1)
+            self._standin.pos[idx] = pos
+
+    def AssignPath(self, path):
+        pass
+
+
+class _Item(object):
+    """A network object that simply stores its attribute values."""
+
+    def __init__(self, key, attributes=None):
+        self.attributes = {'No': key}
+        if attributes:
+            self.attributes.update(attributes)
+        self.Keyframes = None
+
+    def AttValue(self, attribute):
+        return self.attributes.get(attribute)
+
+    def SetAttValue(self, attribute, value):
+        self.attributes[attribute] = value
+
+
+class _Collection(object):
+    """A container of network objects, ordered by key like Vissim's collections."""
+
+    def __init__(self):
+        self._items = []
+
+    @property
+    def Count(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    def _add(self, key, attributes=None):
+        if not key:
+            key = max([item.attributes['No'] for item in self._items] + [0]) + 1
+        item = _Item(key, attributes)
+        self._items.append(item)
+        self._items.sort(key=lambda item: item.attributes['No'])
+        return item
+
+    def ItemByKey(self, key):
+        return next((item for item in self._items if item.attributes['No'] == key), None)
+
+    def GetAll(self):
+        return tuple(self._items)
+
+    def GetMultipleAttributes(self, attributes):
+        return tuple(tuple(item.attributes.get(attribute) for attribute in attributes) for item in self._items)
+
+    def SetMultipleAttributes(self, attributes, values):
+        for item, row in zip(self._items, values):
+            for attribute, value in zip(attributes, row):
+                item.attributes[attribute] = value
+
+    def SetAllAttValues(self, attribute, value):
+        for item in self._items:
+            item.attributes[attribute] = value
+
+    def AddStatic3DModel(self, key, filepath, wkt_point):
+        return self._add(key, {'Filename': filepath, 'CoordWktPoint3D': wkt_point})
+
+    def AddCameraPosition(self, key, wkt_point):
+        return self._add(key, {'CoordWktPoint3D': wkt_point})
+
+    def AddStoryboard(self, key):
+        item = self._add(key)
+        item.Keyframes = _Collection()
+        return item
+
+    def AddKeyframe(self, key):
+        return self._add(key)
+
+
+class _SignalHeads(_Collection):
+    """Signal heads whose signal group state follows SIGNAL_PLAN.
+
+    Signal group g of controller c starts its cycle at (7 * c + SIGNAL_CYCLE * (g - 1) / 2) s.
+    """
+
+    def __init__(self, standin):
+        _Collection.__init__(self)
+        self._standin = standin
+
+    def _state(self, item):
+        sim_sec = self._standin.Simulation.AttValue('SimSec')
+        offset = 7.0 * item.attributes['SG\\SigCtrl\\No'] + SIGNAL_CYCLE * (item.attributes['SG\\No'] - 1) / 2
+        t = (sim_sec - offset) % SIGNAL_CYCLE
+        for state, duration in SIGNAL_PLAN:
+            if t < duration:
+                return state, round(t, 6)
+            t -= duration
+        return SIGNAL_PLAN[-1][0], round(t + SIGNAL_PLAN[-1][1], 6)
+
+    def GetMultipleAttributes(self, attributes):
+        rows = []
+        for item in self._items:
+            state, t_state = self._state(item)
+            values = dict(item.attributes)
+            values['SG\\SigState'] = state
+            values['SG\\tSigState'] = t_state
+            rows.append(tuple(values.get(attribute) for attribute in attributes))
+        return tuple(rows)
@@ -0,0 +1,232 @@
+import os
+import sqlite3
+import logging
+from timeit import default_timer as timer
+
+from ptv_sim import history
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""One SQLite results store for the cars, UAVs and messages of a run.
+
+car.saveResults(), uav.saveResults() and network.saveResults() write separate CSV files with their
+    own column names. ResultsStore keeps all three in one database with the same keys: every table
+    has a time column (SimSec) and the id of the agent (car_id, uav_id, sender_id/recipient_id).
+    Joins such as "car positions at the time of each message" become SQL queries.
+Use it as a writer of the step driver. Every update() appends the rows that were added since the
+    last update (only the active agents are looked at) in one transaction with executemany(). The
+    (agent, time) indexes are built by close(), after the bulk inserts. To keep the inserts off the
+    step, give the store to a ptv_sim.writer.WriterService instead.
+
+Tables:
+    cars(car_id, time, x, y)
+    uavs(uav_id, time, x, y, z)
+    messages(net_id, time, sender_id, sender_x, sender_y, sender_z, recipient_id, recipient_x,
+             recipient_y, recipient_z, msg_type, payload, delay, dropped)
+
+Example:
+    store = ResultsStore(RESULTS_DIR + "results.sqlite")
+    driver.addWriter(store, rate=10) # append every 10 steps
+    ...
+    store.close()
+    store = ResultsStore(RESULTS_DIR + "results.sqlite")
+    df = store.query("SELECT m.time, m.recipient_id, c.x, c.y FROM messages m "
+                     "JOIN cars c ON c.car_id = m.recipient_id AND c.time = m.time")
+"""
+
+logger = logging.getLogger(__name__)
+
+TABLES = {
+    'cars': "car_id INTEGER, time REAL, x REAL, y REAL",
+    'uavs': "uav_id INTEGER, time REAL, x REAL, y REAL, z REAL",
+    'messages': "net_id INTEGER, time REAL, sender_id INTEGER, sender_x REAL, sender_y REAL, sender_z REAL, "
+                "recipient_id INTEGER, recipient_x REAL, recipient_y REAL, recipient_z REAL, "
+                "msg_type TEXT, payload TEXT, delay REAL, dropped INTEGER",
+}
+INDEXES = {
+    'cars_agent_time': "cars (car_id, time)",
+    'uavs_agent_time': "uavs (uav_id, time)",
+    'messages_sender_time': "messages (sender_id, time)",
+    'messages_recipient_time': "messages (recipient_id, time)",
+    'messages_time': "messages (time)",
+}
+COLUMNS = {'cars': ('time', 'x', 'y'), 'uavs': ('time', 'x', 'y', 'z')} # history lists of the agents
+
+
+class ResultsStore:
+    """Appends the results of the bound modules to a SQLite database.
+
+    Attributes:
+        filepath:(string) the database file
+        conn:(sqlite3.Connection) connection to the database
+        rows:(dict) table -> number of rows appended by this store
+    """
+
+    def __init__(self, filepath):
+        """Open (or create) a store.
+
+        Args:
+            filepath:(string) an absolute filepath, the directory is created if it does not exist
+        """
+        file_dir = os.path.dirname(filepath)
+        if file_dir and not os.path.exists(file_dir):
+            logger.info("Creating directory "+file_dir)
+            os.makedirs(file_dir)
+        self.filepath = filepath
+        # check_same_thread=False: a ptv_sim.writer.WriterService may write from its own thread
+        self.conn = sqlite3.connect(filepath, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for table in sorted(TABLES):
+            self.conn.execute("CREATE TABLE IF NOT EXISTS " + table + " (" + TABLES[table] + ")")
+        self.conn.commit()
+        self.rows = dict((table, 0) for table in TABLES)
+        self.collector = Collector()
+
+    def update(self, sim_time=None):
+        """Append all rows added since the last update, returns the number of rows."""
+        started = timer()
+        num_rows = 0
+        with self.conn:
+            for table, chunk in self.collector.collect():
+                num_rows += self._insert(table, chunk)
+        logger.debug("Appended "+str(num_rows)+" rows to "+self.filepath+" in "+str(round(1000 * (timer() - started), 1))+" ms")
+        return num_rows
+
+    def write(self, table, chunk):
+        """Append a chunk of Collector.collect() in its own transaction, returns the number of rows."""
+        with self.conn:
+            return self._insert(table, chunk)
+
+    def query(self, sql, params=()):
+        """Returns the result of a SQL query as a pandas DataFrame."""
+        import pandas as pd
+        return pd.read_sql_query(sql, self.conn, params=params)
+
+    def close(self):
+        """Build the (agent, time) indexes and close the database."""
+        logger.info("Indexing results in "+self.filepath+" ("+str(sum(self.rows.values()))+" rows appended)")
+        with self.conn:
+            for name in sorted(INDEXES):
+                self.conn.execute("CREATE INDEX IF NOT EXISTS " + name + " ON " + INDEXES[name])
+        self.conn.close()
+
+    def _insert(self, table, chunk):
+        table_rows = rows(table, chunk)
+        if table_rows:
+            self.conn.executemany("INSERT INTO " + table + " VALUES (" + ",".join("?" * len(table_rows[0])) + ")", table_rows)
+            self.rows[table] += len(table_rows)
+        return len(table_rows)
+
+
+class Refs(list):
+    """A chunk of Collector.collect(): (agent or net, start, stop) references to the new samples of the
+    histories or the new messages of a log, nothing is copied. rows() reads them, e.g. in a
+    background thread, and a pickled Refs (ptv_sim.writer spill files, ChunkFile) holds its rows.
+
+    Attributes:
+        table:(string) the table of the chunk
+    """
+
+    def __init__(self, table, refs=()):
+        list.__init__(self, refs)
+        self.table = table
+
+    def __reduce__(self):
+        return (list, (rows(self.table, self),))
+
+
+class Collector:
+    """Collects what was added to the registries of the bound modules since the last collect().
+
+    collect() is cheap enough for every step: it only notes the ranges of the history lists of the
+    active agents and of the message logs that are new (Refs). rows() reads them into table rows,
+    e.g. in a background thread. The histories and logs are only appended to, so the ranges stay valid.
+    """
+
+    def __init__(self):
+        self._open = {'cars': [], 'uavs': []} # agents that may still get rows
+        self._seen = {'cars': 0, 'uavs': 0} # agents of all_cars/all_uavs looked at so far
+        self._written = dict() # (table, agent id) -> number of rows collected
+        self._messages = dict() # net id -> number of messages collected
+
+    def collect(self):
+        """Returns [(table, Refs)] of the tables that got new rows."""
+        from ptv_veh import car, uav
+        from ptv_comm import network
+        chunks = [('cars', self._agents('cars', car.Car.all_cars)),
+                  ('uavs', self._agents('uavs', uav.UAV.all_uavs)),
+                  ('messages', self._nets(network.Net.all_nets))]
+        return [(table, chunk) for table, chunk in chunks if chunk]
+
+    def _agents(self, table, all_agents):
+        # all_agents is append only, agents that were deactivated and fully collected are dropped from _open
+        self._open[table].extend(all_agents[self._seen[table]:])
+        self._seen[table] = len(all_agents)
+        chunk = Refs(table)
+        still_open = []
+        for agent in self._open[table]:
+            key = (table, agent.id)
+            written = self._written.get(key, 0)
+            num = len(agent.time)
+            if num > written:
+                chunk.append((agent, written, num))
+                self._written[key] = num
+            if agent.active:
+                still_open.append(agent)
+        self._open[table] = still_open
+        return chunk
+
+    def _nets(self, nets):
+        chunk = Refs('messages')
+        for net in nets:
+            written = self._messages.get(net.id, 0)
+            num = len(net.all_messages)
+            if num > written:
+                chunk.append((net, written, num))
+                self._messages[net.id] = num
+        return chunk
+
+
+def rows(table, chunk):
+    """Returns the rows of table in a chunk of Collector.collect() (Refs), or the chunk itself if it
+    already is a list of rows (an unpickled Refs)."""
+    if not isinstance(chunk, Refs):
+        return chunk
+    table_rows = []
+    if table == 'messages':
+        for net, start, stop in chunk:
+            for msg in net.all_messages[start:stop]:
+                table_rows.append((net.id, msg.timestamp, msg.sender_id) + _xyz(msg.sender_loc) + (msg.recipient_id,)
+                                  + _xyz(msg.recipient_loc) + (_text(msg.msg_type), _text(msg.payload), msg.delay, msg.dropped))
+    else:
+        for agent, start, stop in chunk:
+            columns = [_values(getattr(agent, column), start, stop) for column in COLUMNS[table]]
+            table_rows.extend((agent.id,) + tuple(values) for values in zip(*columns))
+    return table_rows
+
+
+def _values(values, start, stop):
+    # samples [start:stop] of a history, read through its chunks (views of a Series, see ptv_sim.history)
+    samples = []
+    for chunk in history.chunks(values, start, stop):
+        samples.extend(chunk.tolist() if hasattr(chunk, 'tolist') else chunk)
+    return samples
+
+
+def _xyz(loc):
+    # [X,Y] or [X,Y,Z], Z is 0 if not given (see network.Net._dist)
+    if not loc:
+        return (None, None, None)
+    if len(loc) == 2:
+        return (float(loc[0]), float(loc[1]), 0.0)
+    return (float(loc[0]), float(loc[1]), float(loc[2]))
+
+
+def _text(value):
+    if value == None:
+        return None
+    return str(value)
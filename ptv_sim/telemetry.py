@@ -0,0 +1,261 @@
+import os
+import mmap
+import logging
+import tempfile
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError: # python < 3.8
+    shared_memory = None
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""Live telemetry of a running simulation for external dashboards.
+
+Telemetry publishes one frame per step (cars, UAVs and message counters) into a ring buffer of fixed
+    size in shared memory. Register it as a writer of the step driver. A separate process opens the
+    ring with TelemetryReader and maps the frames zero-copy as NumPy structured arrays.
+The writer never waits for readers: frame n goes to slot n % num_slots, so a reader that falls
+    behind by more than num_slots frames loses the oldest ones. Every slot is guarded by a sequence
+    number (odd while the slot is written), so readers can detect and skip torn frames.
+The ring lives in multiprocessing.shared_memory if available (python 3.8+), otherwise, or if a path
+    is given, in a memory mapped file. Give the same name (or path) to the reader.
+
+Layout: HEADER_DTYPE, then num_slots slots of the dtype returned by frameDtype(max_cars, max_uavs).
+
+Example:
+    tel = telemetry.Telemetry("ptv_live", max_cars=2000, max_uavs=50)
+    driver.addWriter(tel)
+    ...
+    tel.close()
+
+    # in the dashboard process
+    reader = telemetry.TelemetryReader("ptv_live")
+    frame = reader.latest()
+    frame['cars'][:frame['num_cars']]['x']
+"""
+
+logger = logging.getLogger(__name__)
+
+MAGIC = 0x50545654 # 'PTVT'
+VERSION = 1
+HEADER_DTYPE = np.dtype([('magic', '<u4'), ('version', '<u4'), ('num_slots', '<u4'), ('max_cars', '<u4'),
+                         ('max_uavs', '<u4'), ('slot_size', '<u4'), ('frame', '<i8')]) # frame: last complete frame, -1 if none
+NONE = -1 # link, lane or car of a row that is None in Python (e.g. a car off the links), speed is NaN
+CAR_DTYPE = np.dtype([('id', '<i4'), ('x', '<f4'), ('y', '<f4'), ('speed', '<f4'), ('link', '<i4'), ('lane', '<i4')]) # link/lane NONE if unknown
+UAV_DTYPE = np.dtype([('id', '<i4'), ('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('yaw', '<f4'), ('car', '<i4')])
+
+
+def frameDtype(max_cars, max_uavs):
+    """Returns the dtype of one slot of the ring.
+
+    Fields: seq (odd while written), frame, sim_time, num_cars, num_uavs, messages (created),
+    dropped, pending (scheduled, not delivered yet), cars (CAR_DTYPE x max_cars), uavs (UAV_DTYPE x max_uavs).
+    """
+    return np.dtype([('seq', '<u8'), ('frame', '<i8'), ('sim_time', '<f8'), ('num_cars', '<u4'), ('num_uavs', '<u4'),
+                     ('messages', '<u8'), ('dropped', '<u8'), ('pending', '<u8'),
+                     ('cars', CAR_DTYPE, (max_cars,)), ('uavs', UAV_DTYPE, (max_uavs,))])
+
+
+class Telemetry:
+    """Writes the frames, use it as a writer of ptv_sim.driver.StepDriver.
+
+    Attributes:
+        name:(string) name of the shared memory block, or path of the mapped file
+        num_slots:(int) number of frames kept in the ring
+        max_cars:(int) cars beyond this many are left out of a frame
+        max_uavs:(int) UAVs beyond this many are left out of a frame
+        frame:(int) number of the last written frame, -1 if none
+        header:(array) the header, mapped
+        slots:(array) the slots, mapped
+    """
+
+    def __init__(self, name="ptv_telemetry", num_slots=64, max_cars=2000, max_uavs=100, path=None):
+        """Create the ring.
+
+        Args:
+            name:(string) name of the shared memory block
+            num_slots:(int) number of frames kept in the ring
+            max_cars:(int) maximum number of cars per frame
+            max_uavs:(int) maximum number of UAVs per frame
+            path:(string) use a memory mapped file at this path instead of shared memory
+        """
+        self.num_slots = num_slots
+        self.max_cars = max_cars
+        self.max_uavs = max_uavs
+        self.frame = -1
+        slot_dtype = frameDtype(max_cars, max_uavs)
+        size = HEADER_DTYPE.itemsize + num_slots * slot_dtype.itemsize
+        self.name, self._shm, self._mmap, buf = _open(name, path, size, create=True)
+        self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=buf)
+        self.slots = np.ndarray((num_slots,), dtype=slot_dtype, buffer=buf, offset=HEADER_DTYPE.itemsize)
+        self.slots['seq'] = 0
+        self.slots['frame'] = -1
+        self.header[()] = (MAGIC, VERSION, num_slots, max_cars, max_uavs, slot_dtype.itemsize, -1)
+        self._messages = dict() # net id -> (number of counted messages, number of dropped among them)
+        logger.info("Publishing telemetry to "+self.name+" ("+str(size // 1024)+" kB)")
+
+    def update(self, sim_time=None):
+        """Publish a frame of the current state of the bound modules."""
+        from ptv_veh.car import Car
+        from ptv_veh.uav import UAV
+        from ptv_comm.network import Net
+        cars = [(car.id, car.x[-1], car.y[-1], car.speed, car.link if car.link != None else NONE,
+                 car.lane if car.lane != None else NONE) for car in Car.active_cars[:self.max_cars]]
+        uavs = [(uav.id, uav.x[-1], uav.y[-1], uav.z[-1], uav.heading[2], uav.car.id if uav.car != None else NONE)
+                for uav in UAV.active_uavs[:self.max_uavs]]
+        messages, dropped, pending = self._count(Net.all_nets)
+        self.publish(sim_time, cars, uavs, messages, dropped, pending)
+
+    def publish(self, sim_time, cars, uavs, messages=0, dropped=0, pending=0):
+        """Write one frame.
+
+        Args:
+            sim_time:(float) SimSec of the frame
+            cars:(list) (id, x, y, speed, link, lane) of every car, link and lane NONE (-1) if unknown
+            uavs:(list) (id, x, y, z, yaw, car id) of every UAV, car id NONE (-1) if it has no car
+            messages:(int) number of messages created so far
+            dropped:(int) number of messages dropped so far
+            pending:(int) number of messages scheduled but not delivered yet
+        """
+        self.frame += 1
+        slot = self.slots[self.frame % self.num_slots]
+        num_cars = min(len(cars), self.max_cars)
+        num_uavs = min(len(uavs), self.max_uavs)
+        slot['seq'] += 1 # odd, readers skip the slot
+        slot['frame'] = self.frame
+        slot['sim_time'] = sim_time if sim_time != None else np.nan
+        slot['num_cars'] = num_cars
+        slot['num_uavs'] = num_uavs
+        slot['messages'] = messages
+        slot['dropped'] = dropped
+        slot['pending'] = pending
+        if num_cars:
+            slot['cars'][:num_cars] = np.array(cars[:num_cars], dtype=CAR_DTYPE)
+        if num_uavs:
+            slot['uavs'][:num_uavs] = np.array(uavs[:num_uavs], dtype=UAV_DTYPE)
+        slot['seq'] += 1 # even, complete
+        self.header['frame'] = self.frame
+
+    def close(self, unlink=True):
+        """Release the ring, unlink=True also removes the shared memory block or file."""
+        del self.header, self.slots
+        _close(self._shm, self._mmap, self.name, unlink)
+
+    def _count(self, nets):
+        # messages are only appended to Net.all_messages, so only the new ones are looked at
+        messages = dropped = pending = 0
+        for net in nets:
+            counted, net_dropped = self._messages.get(net.id, (0, 0))
+            new = net.all_messages[counted:]
+            net_dropped += sum(1 for msg in new if msg.dropped)
+            self._messages[net.id] = (counted + len(new), net_dropped)
+            messages += counted + len(new)
+            dropped += net_dropped
+            pending += len(net.s._queue)
+        return messages, dropped, pending
+
+
+class TelemetryReader:
+    """Maps a ring written by Telemetry, possibly from another process.
+
+    Attributes:
+        name:(string) name of the shared memory block, or path of the mapped file
+        num_slots:(int) number of frames kept in the ring
+        header:(array) the header, mapped
+        slots:(array) the slots, mapped (zero-copy, the writer keeps overwriting them)
+        lost:(int) number of frames that were overwritten or torn before frames() could read them
+    """
+
+    def __init__(self, name="ptv_telemetry", path=None):
+        self.name, self._shm, self._mmap, buf = _open(name, path, None, create=False)
+        self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=buf)
+        if self.header['magic'] != MAGIC or self.header['version'] != VERSION:
+            raise ValueError(self.name + " is not a telemetry ring of version " + str(VERSION))
+        self.num_slots = int(self.header['num_slots'])
+        slot_dtype = frameDtype(int(self.header['max_cars']), int(self.header['max_uavs']))
+        self.slots = np.ndarray((self.num_slots,), dtype=slot_dtype, buffer=buf, offset=HEADER_DTYPE.itemsize)
+        self.lost = 0
+        self._next = 0
+
+    def latest(self):
+        """Returns a copy of the newest complete frame, None if there is none yet."""
+        frame = int(self.header['frame'])
+        while frame >= 0:
+            copy = self._read(frame)
+            if copy is not None:
+                return copy
+            frame = int(self.header['frame']) # overwritten while reading, try the newest one again
+        return None
+
+    def frames(self):
+        """Returns copies of the frames written since the last call, oldest first. Frames that were
+        overwritten in the meantime are skipped and counted in lost."""
+        newest = int(self.header['frame'])
+        first = max(self._next, newest - self.num_slots + 1)
+        self.lost += first - self._next
+        found = []
+        for frame in range(first, newest + 1):
+            copy = self._read(frame)
+            if copy is None:
+                self.lost += 1
+            else:
+                found.append(copy)
+        self._next = newest + 1
+        return found
+
+    def close(self):
+        del self.header, self.slots
+        _close(self._shm, self._mmap, self.name, False)
+
+    def _read(self, frame):
+        # seqlock read: copy the slot and check that it was not written to in the meantime
+        slot = self.slots[frame % self.num_slots]
+        seq = int(slot['seq'])
+        if seq % 2 or int(slot['frame']) != frame:
+            return None
+        copy = slot.copy()
+        if int(slot['seq']) != seq or int(copy['frame']) != frame:
+            return None
+        return copy
+
+
+def _open(name, path, size, create):
+    # returns (name, shared memory, mmap, buffer)
+    if path == None and shared_memory != None:
+        if create:
+            try:
+                shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            except FileExistsError:
+                old = shared_memory.SharedMemory(name=name)
+                old.close()
+                old.unlink()
+                shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            shm = shared_memory.SharedMemory(name=name)
+            # the resource tracker of a reader process would unlink the block when the reader exits
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return name, shm, None, shm.buf
+    if path == None:
+        path = os.path.join(tempfile.gettempdir(), name + ".ring")
+    if create:
+        with open(path, 'wb') as f:
+            f.truncate(size)
+    with open(path, 'r+b') as f:
+        mapped = mmap.mmap(f.fileno(), 0)
+    return path, None, mapped, mapped
+
+
+def _close(shm, mapped, name, unlink):
+    if shm != None:
+        shm.close()
+        if unlink:
+            shm.unlink()
+    else:
+        mapped.close()
+        if unlink and os.path.exists(name):
+            os.remove(name)
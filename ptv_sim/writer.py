@@ -0,0 +1,257 @@
+import os
+import zlib
+import struct
+import logging
+import tempfile
+import threading
+from collections import deque
+from timeit import default_timer as timer
+
+from ptv_sim.store import Collector
+
+try:
+    import queue
+except ImportError: # python 2
+    import Queue as queue
+
+try:
+    import cPickle as pickle
+except ImportError: # python 3
+    import pickle
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""Result persistence in a background thread, off the Vissim step.
+
+WriterService takes chunks of records from the step loop and hands them to a sink in its own
+    thread, which does the reading of the records, row building, serialization, compression and disk
+    I/O. submit() only puts a reference to the chunk on a bounded queue, nothing is copied. As a writer
+    of the step driver, update() submits what ptv_sim.store.Collector found since the last update:
+    (agent, start, stop) ranges of the histories of the active agents and of the message logs (Refs),
+    which the thread reads (through views of ptv_sim.history series). Close the service before
+    history.close().
+If the thread falls behind and the queue is full, the policy decides:
+    'block': wait for the thread (no data lost, the step stalls, see stall_time)
+    'drop': drop the chunk and count it in dropped
+    'spill': put the chunk on a backlog, a second thread pickles it to a temporary file. The writer
+        thread writes the backlog after the queue ran empty, from the file or, if it was not pickled
+        yet, from memory. The step does no serialization.
+The thread writes the chunks in the order they were submitted.
+
+A sink has write(table, chunk) and close(). ptv_sim.store.ResultsStore is one, ChunkFile writes
+    compressed pickles of the chunks, one file per table, which read() gives back (a chunk of
+    store.Collector as its list of rows, see store.Refs).
+
+Example:
+    service = writer.WriterService(store.ResultsStore(RESULTS_DIR + "results.sqlite"), policy='drop')
+    driver.addWriter(service)
+    ...
+    service.close() # waits for the queue, then closes the sink
+"""
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ('block', 'drop', 'spill')
+_STOP = object() # tells the thread to finish
+
+
+class WriterService:
+    """A bounded queue of chunks and the thread that writes them to a sink.
+
+    Attributes:
+        sink:(object) has write(table, chunk) and close()
+        policy:(string) 'block', 'drop' or 'spill', what submit() does if the queue is full
+        submitted:(int) number of chunks given to submit()
+        written:(int) number of chunks written by the sink
+        dropped:(int) number of chunks dropped by the 'drop' policy
+        spilled:(int) number of chunks the 'spill' policy put on the backlog
+        failed:(int) number of chunks the sink raised an exception for
+        stall_time:(float) seconds submit() waited for the thread under the 'block' policy
+    """
+
+    def __init__(self, sink, maxsize=64, policy='block', spill_dir=None):
+        """Start the writer thread.
+
+        Args:
+            sink:(object) has write(table, chunk) and close(), called from the writer thread only
+            maxsize:(int) number of chunks the queue holds
+            policy:(string) 'block', 'drop' or 'spill'
+            spill_dir:(string) directory of the spill files, defaults to the temporary directory
+        """
+        if policy not in POLICIES:
+            raise ValueError("Unknown policy '" + str(policy) + "', options are " + str(POLICIES))
+        self.sink = sink
+        self.policy = policy
+        self.spill_dir = spill_dir if spill_dir != None else tempfile.gettempdir()
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.failed = 0
+        self.stall_time = 0.0
+        self.collector = Collector()
+        self._queue = queue.Queue(maxsize)
+        self._backlog = deque() # chunks that did not fit in the queue, oldest first
+        self._to_spill = queue.Queue() # backlog entries for the spill thread
+        self._lock = threading.Lock() # backlog entries between the writer and spill threads
+        self._thread = threading.Thread(target=self._run, name="ptv_writer")
+        self._thread.daemon = True # do not keep Vissim's interpreter alive
+        self._thread.start()
+        self._spill_thread = None
+        if policy == 'spill':
+            self._spill_thread = threading.Thread(target=self._runSpill, name="ptv_writer_spill")
+            self._spill_thread.daemon = True
+            self._spill_thread.start()
+
+    def update(self, sim_time=None):
+        """Submit everything the bound modules added since the last update."""
+        for table, chunk in self.collector.collect():
+            self.submit(table, chunk)
+
+    def submit(self, table, chunk):
+        """Hand a chunk to the writer thread, returns False if it was dropped.
+
+        Args:
+            table:(string) name of the table, passed on to sink.write()
+            chunk:(*) the records, e.g. a NumPy array or a chunk of store.Collector. It must not be
+                changed afterwards, the thread reads it later
+        """
+        self.submitted += 1
+        if not self._backlog: # once spilling started, the newer chunks go after the spilled ones
+            try:
+                self._queue.put_nowait((table, chunk))
+                return True
+            except queue.Full:
+                pass
+        if self.policy == 'block':
+            started = timer()
+            self._queue.put((table, chunk))
+            self.stall_time += timer() - started
+            return True
+        if self.policy == 'drop':
+            self.dropped += 1
+            return False
+        entry = {'table': table, 'chunk': chunk, 'filepath': None, 'taken': False}
+        self._backlog.append(entry)
+        self._to_spill.put(entry) # pickled by the spill thread, not here
+        self.spilled += 1
+        return True
+
+    def pending(self):
+        """Returns the number of chunks not written yet (approximate, the thread is running)."""
+        return self._queue.qsize() + len(self._backlog)
+
+    def close(self):
+        """Wait until all chunks are written, stop the thread and close the sink."""
+        logger.info("Closing writer service, "+str(self.pending())+" chunks pending")
+        self._queue.put(_STOP)
+        self._thread.join()
+        if self._spill_thread != None:
+            self._to_spill.put(_STOP)
+            self._spill_thread.join()
+        self.sink.close()
+        logger.info("Writer service wrote "+str(self.written)+" of "+str(self.submitted)+" chunks ("+str(self.dropped)
+                    +" dropped, "+str(self.spilled)+" spilled, "+str(self.failed)+" failed), the step waited "
+                    +str(round(self.stall_time, 3))+" s")
+
+    def _run(self):
+        stopping = False
+        while True:
+            if self._backlog and self._queue.empty():
+                self._write(*self._takeBacklog())
+                continue
+            if stopping:
+                return
+            try:
+                item = self._queue.get(timeout=0.1) # wakes up now and then to look at the spill files
+            except queue.Empty:
+                continue
+            if item is _STOP:
+                stopping = True # write the spilled chunks, then stop
+                continue
+            self._write(*item)
+
+    def _write(self, table, chunk):
+        try:
+            self.sink.write(table, chunk)
+            self.written += 1
+        except Exception:
+            self.failed += 1
+            logger.exception("Writer service failed to write a chunk of "+str(table))
+
+    def _takeBacklog(self):
+        with self._lock:
+            entry = self._backlog[0]
+            entry['taken'] = True
+            table, chunk, filepath = entry['table'], entry['chunk'], entry['filepath']
+        if filepath != None:
+            with open(filepath, 'rb') as f:
+                table, chunk = pickle.load(f)
+            os.remove(filepath)
+        self._backlog.popleft() # only now, so that submit() keeps adding to the backlog until the entry was read
+        return table, chunk
+
+    def _runSpill(self):
+        while True:
+            entry = self._to_spill.get()
+            if entry is _STOP:
+                return
+            with self._lock:
+                if entry['taken']:
+                    continue
+                item = (entry['table'], entry['chunk'])
+            fd, filepath = tempfile.mkstemp(prefix="ptv_spill_", suffix=".pkl", dir=self.spill_dir)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(item, f, pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                logger.exception("Writer service failed to spill a chunk of "+str(item[0])+", it stays in memory")
+                os.remove(filepath)
+                continue
+            with self._lock:
+                if entry['taken']: # the writer thread was faster
+                    os.remove(filepath)
+                else:
+                    entry['chunk'] = None # the memory of the chunk is released
+                    entry['filepath'] = filepath
+
+
+class ChunkFile:
+    """A sink that appends compressed pickles of the chunks to one file per table.
+
+    Attributes:
+        directory:(string) the files are directory/<table>.chunks
+        level:(int) zlib compression level
+    """
+
+    def __init__(self, directory, level=6):
+        if not os.path.exists(directory):
+            logger.info("Creating directory "+directory)
+            os.makedirs(directory)
+        self.directory = directory
+        self.level = level
+        self._files = dict()
+
+    def write(self, table, chunk):
+        if table not in self._files:
+            self._files[table] = open(os.path.join(self.directory, table + ".chunks"), 'ab')
+        data = zlib.compress(pickle.dumps(chunk, pickle.HIGHEST_PROTOCOL), self.level)
+        self._files[table].write(struct.pack('<I', len(data)) + data)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = dict()
+
+
+def read(filepath):
+    """Yields the chunks of a file written by ChunkFile."""
+    with open(filepath, 'rb') as f:
+        while True:
+            size = f.read(4)
+            if len(size) < 4:
+                return
+            yield pickle.loads(zlib.decompress(f.read(struct.unpack('<I', size)[0])))
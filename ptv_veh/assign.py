@@ -0,0 +1,229 @@
+import logging
+import numpy as np
+
+from ptv_veh.spatial import Grid
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""Assign UAVs to cars.
+
+Assigner solves a min cost assignment of the active UAVs to candidate cars and applies the result with
+    UAV.setCar(). The cost of a pair is the horizontal distance between UAV and car divided by the
+    priority weight of the car. A car is only a candidate for a UAV if the UAV can reach it within
+    horizon seconds at its max_speed. Candidates are found with a grid spatial index, so a UAV only
+    looks at the cars near it.
+The assignment is only recomputed when cars appear or vanish (or UAVs are added or removed). Then only
+    the UAVs without a car are matched to the cars without a UAV. Every full_every-th recompute, and
+    when forced, all UAVs are matched to all cars again.
+The problem is solved with scipy.optimize.linear_sum_assignment if scipy is installed, otherwise with
+    the NumPy implementation of the Hungarian algorithm in this module.
+
+Example:
+    assigner = assign.Assigner(horizon=60)
+    for i in range(sim_steps):
+        Vissim.Simulation.RunSingleStep()
+        vcar.update()
+        assigner.update(uav.UAV.active_uavs, vcar.Car.active_cars) # before uav.update()
+        uav.update()
+"""
+
+logger = logging.getLogger(__name__)
+
+UNREACHABLE = 1e12 # cost of pairs that are not candidates
+
+
+class Assigner:
+    """Min cost assignment of UAVs to cars.
+
+    Attributes:
+        horizon:(float) a car is a candidate if the UAV can reach it within this time [s]
+        priority:(function) car -> weight, the cost of a pair is distance / weight. Cars with weight <= 0 are never assigned
+        max_candidates:(int) only this many of the closest reachable cars are considered per UAV
+        full_every:(int) every full_every-th recompute matches all UAVs to all cars
+        altitude:(float) altitude the UAVs follow their car at [m]
+        solves:(int) number of times the assignment problem was solved
+    """
+
+    def __init__(self, horizon=60, priority=None, max_candidates=20, full_every=20, altitude=40, cell_size=None):
+        """Create an assigner.
+
+        Args:
+            horizon:(float) a car is a candidate if the UAV can reach it within this time [s]
+            priority:(function) car -> weight, None to weigh all cars equally
+            max_candidates:(int) only this many of the closest reachable cars are considered per UAV
+            full_every:(int) every full_every-th recompute matches all UAVs to all cars
+            altitude:(float) altitude the UAVs follow their car at [m]
+            cell_size:(float) cell size of the spatial index [m], defaults to half the largest reach
+        """
+        self.horizon = horizon
+        self.priority = priority
+        self.max_candidates = max_candidates
+        self.full_every = full_every
+        self.altitude = altitude
+        self.cell_size = cell_size
+        self.solves = 0
+        self._car_ids = set()
+        self._uav_ids = set()
+        self._recomputes = 0
+
+    def update(self, uavs, cars, force=False):
+        """Update the assignment and apply the changes with UAV.setCar().
+
+        Call this before uav.update(), so that UAVs whose car left the network get a new car
+        instead of being deactivated.
+
+        Args:
+            uavs:(list) UAVs to assign, e.g. UAV.active_uavs
+            cars:(list) candidate cars, e.g. Car.active_cars
+            force:(bool) match all UAVs to all cars even if nothing changed
+
+        Returns a dict of uav id -> car (None if the UAV has no car anymore) for the UAVs whose car changed.
+        """
+        cars = [car for car in cars if car.active]
+        uavs = [uav for uav in uavs if uav.active]
+        car_ids = set(car.id for car in cars)
+        uav_ids = set(uav.id for uav in uavs)
+        changed = car_ids != self._car_ids or uav_ids != self._uav_ids
+        self._car_ids = car_ids
+        self._uav_ids = uav_ids
+        if not changed and not force:
+            return dict()
+
+        self._recomputes += 1
+        if force or self._recomputes % self.full_every == 0:
+            return self._solve(uavs, cars)
+
+        # only match the UAVs without a car to the cars without a UAV
+        taken = set()
+        free_uavs = []
+        for uav in uavs:
+            if uav.car != None and uav.car.id in car_ids:
+                taken.add(uav.car.id)
+            else:
+                free_uavs.append(uav)
+        if not free_uavs:
+            return dict()
+        return self._solve(free_uavs, [car for car in cars if car.id not in taken])
+
+    def _solve(self, uavs, cars):
+        rows, cols = self._candidates(uavs, cars)
+        pairs = []
+        if len(cols):
+            cost = np.full((len(uavs), len(cols)), UNREACHABLE)
+            for i, candidates in enumerate(rows):
+                for j, value in candidates:
+                    cost[i, j] = value
+            pairs = [(i, j) for i, j in solve(cost) if cost[i, j] < UNREACHABLE]
+        self.solves += 1
+
+        changes = dict()
+        assigned = set()
+        for i, j in pairs:
+            uav = uavs[i]
+            car = cars[cols[j]]
+            assigned.add(i)
+            if uav.car is not car:
+                uav.setCar(car, self.altitude)
+                changes[uav.id] = car
+        for i, uav in enumerate(uavs):
+            if i not in assigned and uav.car != None:
+                uav.setCar(None)
+                changes[uav.id] = None
+        logger.debug("Assigned "+str(len(pairs))+" of "+str(len(uavs))+" UAVs to "+str(len(cars))+" cars, "+str(len(changes))+" changes")
+        return changes
+
+    def _candidates(self, uavs, cars):
+        # returns the candidates of every UAV as [(column, cost), ...] and the car index of every column
+        reaches = [uav.max_speed * self.horizon for uav in uavs]
+        if not cars or not uavs or max(reaches) <= 0:
+            return [[] for uav in uavs], []
+        weights = np.array([self.priority(car) for car in cars] if self.priority else [1.0] * len(cars), dtype=float)
+        xy = np.array([car.position()[:2] for car in cars], dtype=float).reshape(-1, 2)
+        grid = Grid(self.cell_size or max(reaches) / 2.0)
+        grid.build((idx, xy[idx]) for idx in np.nonzero(weights > 0)[0].tolist())
+
+        columns = dict() # car index -> column
+        rows = []
+        for uav, reach in zip(uavs, reaches):
+            position = uav.position()[:2]
+            near = np.array(grid.near(position, reach), dtype=int)
+            dist = np.sqrt(((xy[near] - position) ** 2).sum(axis=1))
+            near = near[dist <= reach]
+            dist = dist[dist <= reach]
+            if len(near) > self.max_candidates:
+                closest = np.argpartition(dist, self.max_candidates)[:self.max_candidates]
+                near = near[closest]
+                dist = dist[closest]
+            candidates = []
+            for idx, value in zip(near.tolist(), (dist / weights[near]).tolist()):
+                if idx not in columns:
+                    columns[idx] = len(columns)
+                candidates.append((columns[idx], value))
+            rows.append(candidates)
+        cols = sorted(columns, key=lambda idx: columns[idx])
+        return rows, cols
+
+
+def solve(cost):
+    """Solve the rectangular linear assignment problem.
+
+    Args:
+        cost:(array) cost matrix, one row per worker and one column per task
+
+    Returns a list of (row, column) pairs with minimal total cost. Every row (or every column if
+    there are fewer columns) is assigned exactly once.
+    """
+    cost = np.asarray(cost, dtype=float)
+    if cost.size == 0:
+        return []
+    if linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(cost)
+        return list(zip(rows.tolist(), cols.tolist()))
+    if cost.shape[0] > cost.shape[1]:
+        return [(i, j) for j, i in _hungarian(cost.T)]
+    return _hungarian(cost)
+
+
+def _hungarian(cost):
+    # Hungarian algorithm with potentials for n rows <= m columns, O(n^2 m)
+    # the scan over the columns is vectorized, arrays are 1-indexed with column 0 as a sentinel
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=int) # row assigned to each column
+    way = np.zeros(m + 1, dtype=int)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used
+            free[0] = False
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = free[1:] & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = j0
+            j1 = int(np.argmin(np.where(free, minv, np.inf)))
+            delta = minv[j1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    return [(p[j] - 1, j - 1) for j in range(1, m + 1) if p[j]]
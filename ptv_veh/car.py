@@ -2,7 +2,10 @@ import os
 import datetime as dt
 import logging
 from collections import namedtuple
-import pandas as pd
+from ptv_sim import instrument
+from ptv_sim import hooks
+from ptv_sim import history
+from ptv_sim import projection
 
 __author__ = "Garrett Dowd"
 __copyright__ = "Copyright (C) 2019 Garrett Dowd"
@@ -40,6 +43,18 @@ CAR_DEFAULT = {
     'lane': 1,
     'desired_speed': 0
 }
+
+"""Lifecycle hooks, register with addHook().
+on_car_created     - function(car) when a car is created, after its default comms/skill/handler are set
+on_car_deactivated - function(car) when a car is deactivated
+With batch=True the function is called once per car.update() with the list of all cars created
+    (Car.new_cars) or deactivated (Car.null_cars) during that update, and only if the list is not empty.
+
+"""
+HOOKS = {
+    'on_car_created': [], # (function, batch)
+    'on_car_deactivated': [],
+}
 ######################
 # DEFAULTS
 ######################
@@ -81,15 +96,22 @@ def setup(_Vissim, _RESULTS_DIR, _tracked_veh_type_list, car_default=None, vissi
     TIME = float(Vissim.Simulation.AttValue('SimSec'))
 
 
-def update(): # call at beginning of every loop
+def update(sim_time=None): # call at beginning of every loop
+    # sim_time: the current SimSec if it was already read this step (see ptv_sim.driver), saves a COM call
     Car.null_cars = []
     Car.new_cars = []
     Car.all_vissim_cars = []
 
     global TIME
-    TIME = float(Vissim.Simulation.AttValue('SimSec'))
+    started = instrument.start()
+    if sim_time == None:
+        sim_time = Vissim.Simulation.AttValue('SimSec')
+    TIME = float(sim_time)
     all_vissim_cars = Vissim.Net.Vehicles.GetMultipleAttributes(ATTRIBUTES)
-    
+    instrument.tick(TIME)
+    instrument.stop('car.fetch', started, len(all_vissim_cars))
+
+    started = instrument.start()
     # Convert to dictionary and parse any strings (make this robust to changes in attributes)
     for car in all_vissim_cars:
         Car.all_vissim_cars.append({key:car[i] for i,key in enumerate(ATTRIBUTES)})
@@ -97,23 +119,60 @@ def update(): # call at beginning of every loop
             Car.all_vissim_cars[-1]['CoordFront'] = _parse_coord(Car.all_vissim_cars[-1]['CoordFront'])
         if 'CoordRear' in ATTRIBUTES:
             Car.all_vissim_cars[-1]['CoordRear'] = _parse_coord(Car.all_vissim_cars[-1]['CoordRear'])
+    instrument.stop('car.parse', started, len(all_vissim_cars))
 
+    started = instrument.start()
     # deactivate all out of scope vehicles
+    Car.vissim_index = dict((veh['No'], veh) for veh in Car.all_vissim_cars)
+    tracked = set(TRACKED_VEH_TYPES)
+    present = set(int(veh['No']) for veh in Car.all_vissim_cars if int(veh['VehType']) in tracked)
+    for car in [car for car in Car.active_cars if car.type in tracked and car.id not in present]:
+        car.deactivate()
+    known = set(car.id for car in Car.active_cars)
     for veh_type in TRACKED_VEH_TYPES:
-        new_car_nums = [int(veh['No']) for veh in Car.all_vissim_cars if int(veh['VehType'])==veh_type]
-        old_car_nums = [car.id for car in Car.active_cars if car.type==veh_type]
-        for num in old_car_nums:
-            if num in new_car_nums:
-                new_car_nums.remove(num)
-            else:
-                car = next((car for car in Car.active_cars if car.id==num), None)
-                if car != None:
-                    car.deactivate()
-        for num in new_car_nums:
-            Car(num) # create new instance with default parameters for all new vehicles
+        for veh in Car.all_vissim_cars:
+            if int(veh['VehType']) == veh_type and int(veh['No']) not in known:
+                Car(int(veh['No'])) # create new instance with default parameters for all new vehicles
+    instrument.stop('car.reconcile', started, len(Car.new_cars) + len(Car.null_cars))
 
-    for car in Car.all_cars:
+    started = instrument.start()
+    for car in Car.active_cars:
         car.update('master')
+    instrument.stop('car.retrieve', started, len(Car.active_cars))
+
+    _fireBatch('on_car_deactivated', Car.null_cars)
+    _fireBatch('on_car_created', Car.new_cars)
+
+def addHook(event, function, batch=False):
+    """Register a lifecycle hook, see HOOKS.
+
+    Args:
+        event:(string) 'on_car_created' or 'on_car_deactivated'
+        function:(function) called with the car, or with the list of cars if batch
+        batch:(bool) call once per car.update() with all cars of the update
+
+    A function that is already registered for the event is replaced, see ptv_sim.hooks.same().
+    """
+    if event not in HOOKS:
+        raise ValueError("Unknown hook '" + str(event) + "', options are " + str(sorted(HOOKS)))
+    # registered again (e.g. by the project script at the next simulation start): replace, do not call twice
+    HOOKS[event][:] = [hook for hook in HOOKS[event] if not hooks.same(hook[0], function)]
+    HOOKS[event].append((function, batch))
+
+def removeHook(event, function):
+    """Unregister a lifecycle hook that was registered with addHook()."""
+    HOOKS[event][:] = [hook for hook in HOOKS[event] if hook[0] != function]
+
+def _fire(event, car):
+    for function, batch in HOOKS[event]:
+        if not batch:
+            function(car)
+
+def _fireBatch(event, cars):
+    if cars:
+        for function, batch in HOOKS[event]:
+            if batch:
+                function(cars)
 
 def getCars():
     cars = dict()
@@ -124,6 +183,7 @@ def getCars():
     return cars
 
 def saveResults(filepath=None):
+    import pandas as pd
     if filepath == None:
         filepath = RESULTS_DIR
     # make sure that the necessary folder structure exists
@@ -135,19 +195,10 @@ def saveResults(filepath=None):
     logger.info("Saving Car Results to "+filepath)
     column_cars = ['carID', 'time', 'x', 'y']
 
-    df = []
-    for car in Car.all_cars:
-        for t in range(len(car.time)):
-            df_d = {
-                'carID': car.id,
-                'time': car.time[t],
-                'x': car.x[t],
-                'y': car.y[t]
-            }
-            df.append(df_d)
-
-    df = pd.DataFrame(df)
+    df = pd.DataFrame(history.table(Car.all_cars, 'carID', ['time', 'x', 'y']))
     df = df.reindex(columns=column_cars)  # ensure columns are in correct order
+    if projection.PROJECTION != None: # global coordinates
+        projection.PROJECTION.addColumns(df, 'x', 'y')
     # df = df.iloc[::-1] # reverse order of rows
     df.to_csv(filepath, encoding='utf-8', index=False)
 
@@ -163,6 +214,7 @@ class Car:
     new_cars = []
     null_cars = []
     all_vissim_cars = []
+    vissim_index = dict() # No -> entry of all_vissim_cars
 
     def __eq__(self, other):
         if other:
@@ -202,22 +254,36 @@ class Car:
         Car.active_cars.append(self)
         Car.new_cars.append(self)
 
-        # initialize all lists
-        self.time = []
-        self.x = []
-        self.y = []
+        # initialize all lists, see ptv_sim.history for long simulations
+        self.time = history.series()
+        self.x = history.series()
+        self.y = history.series()
         
         self.update('master') # get data from Vissim
         self.setComms(car_default['comms'])
         self.setSkill(car_default['skill'])
         self.setMsgHandler(car_default['msg_handler'])
+        _fire('on_car_created', self)
+
 
+    def __getstate__(self):
+        # COM handles cannot be pickled (see ptv_sim.checkpoint), __setstate__ gets them from Vissim again
+        state = self.__dict__.copy()
+        state['vissim'] = None
+        state['vissim_type'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.active:
+            self.vissim = Vissim.Net.Vehicles.ItemByKey(self.id)
+        self.vissim_type = Vissim.Net.VehicleTypes.ItemByKey(self.type)
 
     def update(self, update_type):
         if self.active:
             if update_type == 'master':
                 # get data from VISSIM
-                car = next((car for car in Car.all_vissim_cars if car['No']==self.id), None)
+                car = Car.vissim_index.get(self.id)
                 if car != None:
                     self.attributes = car
                     self.time.append(TIME)
@@ -269,6 +335,7 @@ class Car:
             logger.error("Trying to remove car "+str(self.id)+" from active_cars failed")
             active_ids = [car.id for car in Car.active_cars]
             logger.error("Active IDs are "+str(active_ids))
+        _fire('on_car_deactivated', self)
 
     #######################################################
     """ Communication functions go here
@@ -400,7 +467,7 @@ class Car:
     def get_car_front(self,max_dist=300):
         front_car = None
         if self.lead_object_type == 'VEHICLE':
-            car = next((car for car in Car.all_vissim_cars if car['No']==self.lead_object_num), None)
+            car = Car.vissim_index.get(self.lead_object_num)
             if car != None:
                 front_car = car['No']
             else:
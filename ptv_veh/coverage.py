@@ -0,0 +1,164 @@
+import logging
+import numpy as np
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""Which vehicles each UAV camera sees.
+
+Every step the ground footprint of each active camera is projected from the position and heading of
+    its UAV and the camera parameters (FOV, PitchAngle, RollAngle, ResX/ResY). All vehicle positions of
+    the car snapshot (Car.all_vissim_cars) are then tested against all footprints in one NumPy pass,
+    so no COM calls are made.
+The ground is the plane z = 0. The horizontal FOV is FOV, the vertical FOV follows from ResX/ResY.
+    Corner rays that do not hit the ground within max_range are cut off at max_range.
+Angles follow the uav module: yaw is measured counterclockwise from the x axis, pitch is the angle
+    below the horizon (90 looks straight down).
+
+Example:
+    cov = coverage.Coverage()
+    for i in range(sim_steps):
+        ...
+        vcar.update()
+        uav.update()
+        cov.update()
+        for camera_id, vehicles in cov.visible.items():
+            ...
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class Coverage:
+    """Per step camera coverage of the vehicles.
+
+    Attributes:
+        max_range:(float) footprints are cut off at this horizontal distance from the camera [m]
+        visible:(dict) camera id -> set of the numbers (No) of the vehicles in frame this step
+        covered:(set) numbers of the vehicles in frame of at least one camera this step
+        camera_counts:(dict) camera id -> number of vehicle steps the camera had in frame
+        vehicle_counts:(dict) vehicle number -> number of steps the vehicle was in frame of any camera
+        footprints:(array) ground footprint corners of the cameras of the last step, shape (cameras, 4, 2)
+        steps:(int) number of updates
+    """
+
+    def __init__(self, max_range=1000.0):
+        self.max_range = max_range
+        self.visible = dict()
+        self.covered = set()
+        self.camera_counts = dict()
+        self.vehicle_counts = dict()
+        self.footprints = np.zeros((0, 4, 2))
+        self.steps = 0
+
+    def reset(self):
+        """Forget all counters."""
+        self.visible.clear()
+        self.covered = set()
+        self.camera_counts.clear()
+        self.vehicle_counts.clear()
+        self.steps = 0
+
+    def update(self, cameras=None, vehicles=None):
+        """Compute which vehicles the cameras see this step.
+
+        Args:
+            cameras:(list) Camera objects, defaults to uav.Camera.active_cameras
+            vehicles:(list) vehicle snapshot dicts with 'No' and 'CoordFront', defaults to car.Car.all_vissim_cars
+
+        Returns the visible dict (camera id -> set of vehicle numbers).
+        """
+        if cameras is None:
+            from ptv_veh.uav import Camera
+            cameras = Camera.active_cameras
+        if vehicles is None:
+            from ptv_veh.car import Car
+            vehicles = Car.all_vissim_cars
+        cameras = [camera for camera in cameras if camera.agent != None]
+        vehicles = [veh for veh in vehicles if veh['CoordFront']]
+
+        self.steps += 1
+        self.visible = dict()
+        self.covered = set()
+        if not cameras:
+            self.footprints = np.zeros((0, 4, 2))
+            return self.visible
+
+        params = np.array([[camera.agent.x[-1], camera.agent.y[-1], camera.agent.z[-1], camera.agent.heading[2],
+                            camera.pitch, camera.roll, camera.fov, float(camera.res[1]) / camera.res[0]] for camera in cameras], dtype=float)
+        self.footprints = footprints(params[:, 0:3], params[:, 3], params[:, 4], params[:, 5], params[:, 6], params[:, 7], self.max_range)
+
+        nos = np.array([veh['No'] for veh in vehicles], dtype=int)
+        points = np.array([veh['CoordFront'][:2] for veh in vehicles], dtype=float).reshape(-1, 2)
+        inside = inFootprints(points, self.footprints)
+
+        for camera, row in zip(cameras, inside):
+            seen = set(nos[row].tolist())
+            self.visible[camera.id] = seen
+            self.camera_counts[camera.id] = self.camera_counts.get(camera.id, 0) + len(seen)
+            self.covered.update(seen)
+        for no in self.covered:
+            self.vehicle_counts[no] = self.vehicle_counts.get(no, 0) + 1
+        return self.visible
+
+
+def footprints(positions, yaws, pitches, rolls, fovs, aspects, max_range=1000.0):
+    """Project the ground footprints of cameras.
+
+    Args:
+        positions:(array) camera positions [x,y,z], shape (cameras, 3)
+        yaws:(array) yaw angles [deg], counterclockwise from the x axis
+        pitches:(array) pitch angles below the horizon [deg]
+        rolls:(array) roll angles [deg]
+        fovs:(array) horizontal fields of view [deg]
+        aspects:(array) image height / image width
+        max_range:(float) corners are cut off at this horizontal distance from the camera [m]
+
+    Returns the footprint corners on the ground plane, shape (cameras, 4, 2), in order around the footprint.
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+    yaw = np.radians(yaws)
+    pitch = np.radians(pitches)
+    roll = np.radians(rolls)
+    half_w = np.tan(np.radians(fovs) / 2.0)
+    half_h = half_w * aspects
+
+    forward = np.stack([np.cos(pitch) * np.cos(yaw), np.cos(pitch) * np.sin(yaw), -np.sin(pitch)], axis=-1)
+    right = np.stack([np.sin(yaw), -np.cos(yaw), np.zeros_like(yaw)], axis=-1)
+    up = np.cross(right, forward)
+    right, up = (np.cos(roll)[:, None] * right + np.sin(roll)[:, None] * up,
+                 np.cos(roll)[:, None] * up - np.sin(roll)[:, None] * right)
+
+    corners = []
+    for a, b in ((-1, -1), (1, -1), (1, 1), (-1, 1)):
+        ray = forward + (a * half_w)[:, None] * right + (b * half_h)[:, None] * up
+        horizontal = np.sqrt(ray[:, 0] ** 2 + ray[:, 1] ** 2)
+        descending = ray[:, 2] < 0
+        # distance along the ray to the ground, rays that do not reach it within max_range are cut off
+        t = np.where(descending, positions[:, 2] / np.where(descending, -ray[:, 2], 1), np.inf)
+        t = np.minimum(t, max_range / np.where(horizontal > 0, horizontal, 1e-9))
+        corners.append(positions[:, 0:2] + t[:, None] * ray[:, 0:2])
+    return np.stack(corners, axis=1)
+
+
+def inFootprints(points, quads):
+    """Test points against convex quadrilaterals.
+
+    Args:
+        points:(array) [x,y] points, shape (points, 2)
+        quads:(array) corners in order around each quad, shape (quads, 4, 2)
+
+    Returns a boolean array of shape (quads, points), True where the point lies inside (or on the edge of) the quad.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    quads = np.asarray(quads, dtype=float).reshape(-1, 4, 2)
+    start = quads[:, :, None, :] # (quads, 4, 1, 2)
+    edge = np.roll(quads, -1, axis=1)[:, :, None, :] - start
+    rel = points[None, None, :, :] - start # (quads, 4, points, 2)
+    cross = edge[..., 0] * rel[..., 1] - edge[..., 1] * rel[..., 0]
+    # the corners can run either way around, normalize with the sign of the quad's area
+    area = (quads[:, :, 0] * np.roll(quads[:, :, 1], -1, axis=1) - np.roll(quads[:, :, 0], -1, axis=1) * quads[:, :, 1]).sum(axis=1)
+    cross *= np.where(area < 0, -1.0, 1.0)[:, None, None]
+    return (cross >= 0).all(axis=1) & (area != 0)[:, None]
@@ -0,0 +1,139 @@
+import logging
+import numpy as np
+
+from ptv_veh.spatial import Grid
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""UAV separation monitoring.
+
+Monitor keeps the positions of the active UAVs in a 3D grid spatial index that is updated in place
+    every step (a UAV only changes cells when it crosses a cell border). Every step it finds the pairs
+    of UAVs that are closer than the separation threshold. The start and end of each loss of
+    separation is logged and recorded in a compact event table.
+The same index answers comm range neighborhood queries.
+With a cell size of about the separation threshold a step costs about the number of UAVs, as long
+    as the UAVs do not all crowd into a few cells.
+
+Example:
+    monitor = separation.Monitor(separation=20)
+    uav.setup(Vissim, RESULTS_DIR, separation_monitor=monitor) # updated by uav.update()
+    ...
+    neighbors = monitor.neighborhoods(uav.UAV.active_uavs)
+    monitor.saveResults(RESULTS_DIR + "separation.csv")
+"""
+
+logger = logging.getLogger(__name__)
+
+# event table
+EVENT_DTYPE = np.dtype([('time', 'f8'), ('uav_a', 'i4'), ('uav_b', 'i4'), ('distance', 'f4'), ('kind', 'i1')])
+START = 1 # loss of separation started
+END = 0 # separation restored
+
+
+class Monitor:
+    """Loss of separation and comm neighborhoods of the active UAVs.
+
+    Attributes:
+        separation:(float) UAVs closer than this are in conflict [m]
+        grid:(Grid) 3D spatial index of the UAV positions, keyed by UAV id
+        conflicts:(dict) (uav id, uav id) -> distance of the pairs currently in conflict, smaller id first
+        num_events:(int) number of recorded events
+    """
+
+    def __init__(self, separation=10.0, cell_size=None, capacity=1024):
+        """Create a monitor.
+
+        Args:
+            separation:(float) UAVs closer than this are in conflict [m]
+            cell_size:(float) cell size of the spatial index [m], defaults to the separation
+            capacity:(int) initial size of the event table, it grows as needed
+        """
+        self.separation = float(separation)
+        self.grid = Grid(cell_size or self.separation, dims=3)
+        self.conflicts = dict()
+        self.num_events = 0
+        self._events = np.zeros(capacity, dtype=EVENT_DTYPE)
+
+    def update(self, uavs, time=None):
+        """Move the UAVs in the index and detect conflicts.
+
+        Args:
+            uavs:(list) the active UAVs, UAVs missing from the list are removed from the index
+            time:(float) simulation second the events are recorded at
+
+        Returns the pairs whose loss of separation started this step.
+        """
+        ids = set()
+        for uav in uavs:
+            self.grid.move(uav.id, uav.position())
+            ids.add(uav.id)
+        for key in [key for key in self.grid.points if key not in ids]:
+            self.grid.remove(key)
+
+        conflicts = dict()
+        for key in ids:
+            for dist, other in self.grid.query(self.grid.points[key], self.separation, exclude=key):
+                if key < other:
+                    conflicts[(key, other)] = dist
+
+        started = [pair for pair in conflicts if pair not in self.conflicts]
+        for pair in started:
+            self._record(time, pair, conflicts[pair], START)
+            logger.warning("Loss of separation between UAV # "+str(pair[0])+" and UAV # "+str(pair[1])+
+                           " at "+str(time)+": "+str(round(conflicts[pair], 2))+" m")
+        for pair in self.conflicts:
+            if pair not in conflicts:
+                self._record(time, pair, self._distance(pair), END)
+                logger.info("Separation between UAV # "+str(pair[0])+" and UAV # "+str(pair[1])+" restored at "+str(time))
+        self.conflicts = conflicts
+        return started
+
+    def pairs(self, distance):
+        """Returns [(uav id, uav id, distance), ...] of all pairs closer than distance, smaller id first."""
+        found = []
+        for key, point in self.grid.points.items():
+            for dist, other in self.grid.query(point, distance, exclude=key):
+                if key < other:
+                    found.append((key, other, dist))
+        return found
+
+    def neighbors(self, uav, radius=None):
+        """Returns the ids of the UAVs within radius of a UAV, closest first.
+
+        Args:
+            uav:(UAV) the UAV, it has to be in the index
+            radius:(float) search radius [m], defaults to the comm_range of the UAV
+        """
+        if radius is None:
+            radius = uav.comm_range
+        return [other for dist, other in self.grid.query(self.grid.points[uav.id], radius, exclude=uav.id)]
+
+    def neighborhoods(self, uavs):
+        """Returns a dict of uav id -> ids of the UAVs within the comm_range of that UAV."""
+        return dict((uav.id, self.neighbors(uav)) for uav in uavs if uav.id in self.grid)
+
+    def events(self):
+        """Returns the recorded events as a structured array with the fields time, uav_a, uav_b, distance and kind (START/END)."""
+        return self._events[:self.num_events]
+
+    def saveResults(self, filepath):
+        import pandas as pd
+        logger.info("Saving separation events to "+filepath)
+        pd.DataFrame(self.events()).to_csv(filepath, encoding='utf-8', index=False)
+
+    def _record(self, time, pair, distance, kind):
+        if self.num_events == len(self._events):
+            self._events = np.concatenate([self._events, np.zeros(max(len(self._events), 1), dtype=EVENT_DTYPE)])
+        self._events[self.num_events] = (time if time is not None else np.nan, pair[0], pair[1], distance, kind)
+        self.num_events += 1
+
+    def _distance(self, pair):
+        if pair[0] not in self.grid or pair[1] not in self.grid:
+            return np.nan
+        a = self.grid.points[pair[0]]
+        b = self.grid.points[pair[1]]
+        return sum((a[i] - b[i]) ** 2 for i in range(3)) ** 0.5
@@ -0,0 +1,133 @@
+import math
+import logging
+from itertools import product
+
+__author__ = "Garrett Dowd"
+__copyright__ = "Copyright (C) 2019 Garrett Dowd"
+__license__ = "MPL-2.0"
+__version__ = "0.0.1"
+
+"""Uniform grid spatial index for agents.
+
+Points are hashed into square (2D) or cubic (3D) cells. A radius query only looks at the
+    cells that overlap the query circle/sphere, so it costs about the number of nearby points
+    instead of the number of all points.
+Points can be inserted, moved and removed one at a time, or the whole grid can be rebuilt with build().
+
+Example:
+    grid = spatial.Grid(cell_size=200)
+    grid.build([(car.id, car.position()) for car in cars])
+    close = grid.query(uav.position()[:2], 500) # [(distance, car id), ...] closest first
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class Grid:
+    """Uniform grid hash of points with radius queries.
+
+    Attributes:
+        cell_size:(float) edge length of a cell [m]
+        dims:(int) 2 for [x,y] points, 3 for [x,y,z] points
+        points:(dict) key -> point of every point in the grid
+        cells:(dict) cell -> set of the keys of the points in the cell
+    """
+
+    def __init__(self, cell_size=100.0, dims=2):
+        """Create an empty grid.
+
+        Args:
+            cell_size:(float) edge length of a cell [m], about the typical query radius works well
+            dims:(int) 2 for [x,y] points, 3 for [x,y,z] points
+        """
+        if cell_size <= 0:
+            raise ValueError("cell_size must be positive, got " + str(cell_size))
+        self.cell_size = float(cell_size)
+        self.dims = dims
+        self.points = dict()
+        self.cells = dict()
+        self._cell_of = dict() # key -> cell
+
+    def __len__(self):
+        return len(self.points)
+
+    def __contains__(self, key):
+        return key in self.points
+
+    def cell(self, point):
+        """Returns the cell a point falls into."""
+        return tuple(int(math.floor(point[i] / self.cell_size)) for i in range(self.dims))
+
+    def clear(self):
+        self.points.clear()
+        self.cells.clear()
+        self._cell_of.clear()
+
+    def build(self, items):
+        """Replace the contents of the grid with (key, point) items."""
+        self.clear()
+        for key, point in items:
+            self.insert(key, point)
+
+    def insert(self, key, point):
+        """Add a point, or move it if the key is already in the grid."""
+        point = tuple(point[:self.dims])
+        cell = self.cell(point)
+        old = self._cell_of.get(key)
+        if old is not None and old != cell:
+            self._discard(key, old)
+        if old != cell:
+            self.cells.setdefault(cell, set()).add(key)
+            self._cell_of[key] = cell
+        self.points[key] = point
+
+    move = insert
+
+    def remove(self, key):
+        """Remove a point, unknown keys are ignored."""
+        cell = self._cell_of.pop(key, None)
+        if cell is not None:
+            self._discard(key, cell)
+            del self.points[key]
+
+    def _discard(self, key, cell):
+        members = self.cells[cell]
+        members.discard(key)
+        if not members:
+            del self.cells[cell]
+
+    def near(self, point, radius):
+        """Returns the keys in all cells that overlap the box around point, without checking distances."""
+        reach = int(math.ceil(radius / self.cell_size))
+        center = self.cell(point)
+        keys = []
+        if (2 * reach + 1) ** self.dims > len(self.cells):
+            # the box covers more cells than are occupied, walk the occupied cells instead
+            for cell, members in self.cells.items():
+                if all(abs(cell[i] - center[i]) <= reach for i in range(self.dims)):
+                    keys.extend(members)
+            return keys
+        for offset in product(range(-reach, reach + 1), repeat=self.dims):
+            members = self.cells.get(tuple(center[i] + offset[i] for i in range(self.dims)))
+            if members:
+                keys.extend(members)
+        return keys
+
+    def query(self, point, radius, exclude=None):
+        """Returns [(distance, key), ...] of the points within radius of point, closest first.
+
+        Args:
+            point:(list) [x,y] or [x,y,z], extra coordinates are ignored
+            radius:(float) search radius [m]
+            exclude:(hashable) key to leave out, e.g. the querying agent itself
+        """
+        found = []
+        for key in self.near(point, radius):
+            if key == exclude:
+                continue
+            other = self.points[key]
+            dist = math.sqrt(sum((other[i] - point[i]) ** 2 for i in range(self.dims)))
+            if dist <= radius:
+                found.append((dist, key))
+        found.sort(key=lambda item: item[0])
+        return found
@@ -2,9 +2,12 @@ import os
 import math
 import datetime as dt
 import logging
-from collections import namedtuple
-import pandas as pd
-import numpy as np
+from collections import namedtuple, deque
+from ptv_sim import instrument
+from ptv_sim import hooks
+from ptv_sim import lazy
+from ptv_sim import history
+from ptv_sim import projection
 
 __author__ = "Garrett Dowd"
 __copyright__ = "Copyright (C) 2019 Garrett Dowd"
@@ -12,6 +15,7 @@ __license__ = "MPL-2.0"
 __version__ = "0.0.2"
 
 logger = logging.getLogger(__name__)
+np = lazy.module('numpy') # imported when the first Fleet or PID step needs it
 
 class Skill(namedtuple('Skill', 'id, min_speed, max_speed, max_acc, max_ascent, max_descent, comm_range')):
     """One liner.
@@ -40,8 +44,16 @@ UAV_DEFAULT = {
     'camera_flag': False,
     'skill': 0,
     'position': [0,0,0],
-    'sim_type': "ZO",
+    'sim_type': "ZO", # "ZO", "FO" or "PID"
     'sim_mult': 2,
+    'fo_gain': 1.5, # FO model
+    'fo_tau': 2,
+    'pid_gains': (0.25, 0.01, 0.3), # PID model (Kp, Ki, Kd)
+    'integ_len': 300, # number of substeps the PID integral covers
+    'waypoint_capacity': 100, # max number of queued waypoints
+    'waypoint_tol': 2, # distance at which a waypoint counts as reached [m]
+    'dest_history': 0, # number of past destinations kept in dest_history, 0 to keep none
+    'dest_decimation': 10, # keep every n-th destination in dest_history
 }
 
 """One liner.
@@ -61,7 +73,44 @@ CAMERA_DEFAULT = {
 }
 
 
-def setup(_Vissim, _RESULTS_DIR, uav_skills=None, uav_default=None, camera_default=None):
+"""Integrate UAVs that share a sim_type together in one vectorized pass (see Fleet).
+Groups smaller than FLEET_MIN_SIZE are integrated one UAV at a time, which is faster for a few UAVs.
+
+"""
+VECTORIZE = True
+FLEET_MIN_SIZE = 8
+
+"""Settings of the pose sync stage that moves the 3D models and cameras with their UAVs.
+A pose is only sent to Vissim if the UAV moved more than pos_tol [m] or turned more than yaw_tol [deg]
+    since the last pose that was sent.
+With stagger, objects that share an update rate are spread evenly over the steps instead of all
+    being updated in the same step.
+With batch, the changed poses are sent with one SetMultipleAttributes call per collection. This is only
+    possible if every object in the collection belongs to this module.
+
+"""
+POSE_SYNC = {
+    'pos_tol': 0.05,
+    'yaw_tol': 0.5,
+    'stagger': True,
+    'batch': True,
+}
+_SYNC_STEP = 0
+
+SEPARATION_MONITOR = None # separation.Monitor updated every step, see setup()
+
+"""Lifecycle hooks, register with addHook().
+on_uav_deactivated - function(uav) when a UAV is deactivated, e.g. because its car left the network
+With batch=True the function is called once per uav.update() with the list of all UAVs deactivated
+    during that update (UAV.null_uavs), and only if the list is not empty.
+
+"""
+HOOKS = {
+    'on_uav_deactivated': [], # (function, batch)
+}
+
+
+def setup(_Vissim, _RESULTS_DIR, uav_skills=None, uav_default=None, camera_default=None, vectorize=None, pose_sync=None, separation_monitor=None):
     """One liner.
 
     """
@@ -71,10 +120,18 @@ def setup(_Vissim, _RESULTS_DIR, uav_skills=None, uav_default=None, camera_defau
     global UAV_DEFAULT
     global CAMERA_DEFAULT
     global TIME
+    global VECTORIZE
+    global SEPARATION_MONITOR
 
     Vissim = _Vissim
     RESULTS_DIR = _RESULTS_DIR
 
+    if vectorize != None:
+        VECTORIZE = vectorize
+
+    if separation_monitor != None:
+        SEPARATION_MONITOR = separation_monitor
+
     if uav_skills != None:
         for new_skill in uav_skills:
             if new_skill in SKILLS:
@@ -91,29 +148,132 @@ def setup(_Vissim, _RESULTS_DIR, uav_skills=None, uav_default=None, camera_defau
         for param in camera_default:
             CAMERA_DEFAULT[param] = camera_default[param]
 
+    if pose_sync != None:
+        for param in pose_sync:
+            POSE_SYNC[param] = pose_sync[param]
+
     TIME = float(Vissim.Simulation.AttValue('SimSec'))
     
 
-def update(model_update_rate=1, camera_update_rate=1): # call at beginning of every loop
+def update(model_update_rate=1, camera_update_rate=1, sim_time=None, sync=True): # call at beginning of every loop
+    # sim_time: the current SimSec if it was already read this step (see ptv_sim.driver), saves a COM call
+    # sync: also send the model/camera poses to Vissim, otherwise call syncPoses() later in the step
     global TIME
-    TIME = float(Vissim.Simulation.AttValue('SimSec'))
+    started = instrument.start()
+    if sim_time == None:
+        sim_time = Vissim.Simulation.AttValue('SimSec')
+    TIME = float(sim_time)
+    instrument.tick(TIME)
+    instrument.stop('uav.clock', started)
+
+    started = instrument.start()
+    UAV.null_uavs = []
+    uavs = list(UAV.active_uavs) # uav.update() can deactivate the uav
+    if VECTORIZE:
+        for uav in uavs:
+            uav._updateMission()
+        # a uav the mission deactivated already released its ring row, integrating it would take a new one
+        FLEET.update([uav for uav in uavs if uav.active])
+    else:
+        for uav in uavs:
+            uav.update()
+    instrument.stop('uav.dynamics', started, len(uavs))
+
+    if SEPARATION_MONITOR != None:
+        started = instrument.start()
+        SEPARATION_MONITOR.update(UAV.active_uavs, TIME)
+        instrument.stop('uav.separation', started, len(UAV.active_uavs))
+
+    if UAV.null_uavs:
+        for function, batch in HOOKS['on_uav_deactivated']:
+            if batch:
+                function(UAV.null_uavs)
+
+    if sync:
+        syncPoses(model_update_rate, camera_update_rate)
+
+
+def addHook(event, function, batch=False):
+    """Register a lifecycle hook, see HOOKS.
+
+    Args:
+        event:(string) 'on_uav_deactivated'
+        function:(function) called with the UAV, or with the list of UAVs if batch
+        batch:(bool) call once per uav.update() with all UAVs of the update
+
+    A function that is already registered for the event is replaced, see ptv_sim.hooks.same().
+    """
+    if event not in HOOKS:
+        raise ValueError("Unknown hook '" + str(event) + "', options are " + str(sorted(HOOKS)))
+    # registered again (e.g. by the project script at the next simulation start): replace, do not call twice
+    HOOKS[event][:] = [hook for hook in HOOKS[event] if not hooks.same(hook[0], function)]
+    HOOKS[event].append((function, batch))
 
-    for uav in UAV.active_uavs:
-        uav.update()
 
-    for model in Model.active_models:
-        model.update(model_update_rate)
+def removeHook(event, function):
+    """Unregister a lifecycle hook that was registered with addHook()."""
+    HOOKS[event][:] = [hook for hook in HOOKS[event] if hook[0] != function]
 
-    for camera in Camera.active_cameras:
-        camera.update(camera_update_rate)
+
+def syncPoses(model_update_rate=1, camera_update_rate=1):
+    """Send the poses of the 3D models and cameras to Vissim, see POSE_SYNC.
+
+    Called by update() unless update(sync=False) is used.
+    """
+    global _SYNC_STEP
+    _SYNC_STEP += 1
+    _syncPoses(Model.active_models, Model.all_models, Vissim.Net.Static3DModels, model_update_rate, 'model.update')
+    _syncPoses(Camera.active_cameras, Camera.all_cameras, Vissim.Net.CameraPositions, camera_update_rate, 'camera.update')
+
+
+def _syncPoses(active, pool, collection, update_rate, phase):
+    # send the poses of the models/cameras that are due this step and moved past the deadband
+    started = instrument.start()
+    changed = []
+    for obj in active:
+        if POSE_SYNC['stagger']:
+            due = (_SYNC_STEP + obj.id) % update_rate == 0
+        else:
+            due = _SYNC_STEP % update_rate == 0
+        if due:
+            pose = obj._pose()
+            if _poseChanged(obj.pose, pose):
+                changed.append((obj, pose))
+
+    if len(changed) > 1 and POSE_SYNC['batch'] and collection.Count == len(pool):
+        for obj, pose in changed:
+            obj.pose = pose
+        rows = [(_wkt(obj.pose), obj.pose[3]) for obj in sorted(pool, key=lambda obj: obj.no)]
+        collection.SetMultipleAttributes(('CoordWktPoint3D', 'YawAngle'), rows)
+    else:
+        for obj, pose in changed:
+            obj._write(pose)
+    instrument.stop(phase, started, len(changed))
+
+
+def _poseChanged(last, pose):
+    # pose is (x, y, z, yaw)
+    if last is None:
+        return True
+    yaw = abs(pose[3] - last[3]) % 360
+    if min(yaw, 360 - yaw) > POSE_SYNC['yaw_tol']:
+        return True
+    moved = (pose[0] - last[0])**2 + (pose[1] - last[1])**2 + (pose[2] - last[2])**2
+    return moved > POSE_SYNC['pos_tol']**2
+
+
+def _wkt(pose):
+    return "Point(" + str(pose[0]) + ", " + str(pose[1]) + ", " + str(pose[2]) + ")"
 
 def getUAVs():
     uavs = dict()
     uavs['all'] = UAV.all_uavs
     uavs['active'] = UAV.active_uavs
+    uavs['null'] = UAV.null_uavs
     return uavs
 
 def saveResults(filepath=None):
+    import pandas as pd
     # make sure that the necessary folder structure exists
     if filepath == None:
         filepath = RESULTS_DIR
@@ -126,20 +286,10 @@ def saveResults(filepath=None):
     logger.info("Saving UAV Results to "+filepath)
     column_uav = ['uavID', 'time', 'x', 'y', 'z']
 
-    df = []
-    for uav in UAV.all_uavs:
-        for t in range(len(uav.time)):
-            df_d = {
-                'uavID': uav.id,
-                'time': uav.time[t],
-                'x': uav.x[t],
-                'y': uav.y[t],
-                'z': uav.z[t]
-            }
-            df.append(df_d)
-
-    df = pd.DataFrame(df)
+    df = pd.DataFrame(history.table(UAV.all_uavs, 'uavID', ['time', 'x', 'y', 'z']))
     df = df.reindex(columns=column_uav)  # ensure columns are in correct order
+    if projection.PROJECTION != None: # global coordinates
+        projection.PROJECTION.addColumns(df, 'x', 'y')
     # df = df.iloc[::-1] # reverse order of rows
     df.to_csv(filepath, encoding='utf-8', index=False)
 
@@ -151,6 +301,7 @@ def saveResults(filepath=None):
 class UAV:
     all_uavs = []
     active_uavs = []
+    null_uavs = [] # deactivated during the last update()
 
     def __eq__(self, other):
         if other:
@@ -174,14 +325,20 @@ class UAV:
         if len(uav_default['position']) != 3:
             logger.critical("UAV instantiation, invalid position: "+ str(uav_default['position']))
             Vissim.Simulation.Stop()
-        self.time = [TIME]
-        self.x = [uav_default['position'][0]]
-        self.y = [uav_default['position'][1]]
-        self.z = [uav_default['position'][2]]
-        self.heading = 0 # [pitch(-90,90), roll(0,360), yaw(0,360)]
+        self.time = history.series([TIME]) # see ptv_sim.history for long simulations
+        self.x = history.series([uav_default['position'][0]])
+        self.y = history.series([uav_default['position'][1]])
+        self.z = history.series([uav_default['position'][2]])
+        self.heading = [0,0,0] # [pitch(-90,90), roll(0,360), yaw(0,360)]
         
 
-        self.dest = [[self.x[-1],self.y[-1],self.z[-1]]] # destination. where uav should be flying to
+        self.dest = deque([[self.x[-1],self.y[-1],self.z[-1]]], maxlen=1) # destination. where uav should be flying to
+        self.waypoints = deque() # queued destinations, see setRoute()
+        self.waypoint_capacity = uav_default['waypoint_capacity']
+        self.waypoint_tol = uav_default['waypoint_tol']
+        self.dest_history = deque(maxlen=uav_default['dest_history']) # every dest_decimation-th destination
+        self.dest_decimation = uav_default['dest_decimation']
+        self._dest_count = 0
         self.car = None
         self.default_altitude = 50
         self.mission = 0 # defines what the uav should be doing e.g. car following = 1, stationary point = 0.
@@ -205,8 +362,16 @@ class UAV:
         self.sim = dict()
         self.sim['type'] = uav_default['sim_type']
         self.sim['mult'] = uav_default['sim_mult']
+        self.sim['fo'] = (uav_default['fo_gain'], uav_default['fo_tau'])
+        self.sim['pid'] = tuple(uav_default['pid_gains'])
+        self.sim['integ_len'] = uav_default['integ_len']
 
     def update(self):
+        self._updateMission()
+        if self.active: # deactivate() released the ring row, do not integrate
+            self._simXYZ()
+
+    def _updateMission(self):
         if self.mission == 'car_follow':
             if self.car.active != 0:
                 xy = self.car.position()
@@ -215,8 +380,10 @@ class UAV:
             else:
                 self.setCar(None)
                 self.deactivate()
-
-        self._simXYZ()
+        elif self.waypoints:
+            if self._dist(self.position(), self.dest[-1]) <= self.waypoint_tol:
+                logger.debug('UAV with ID# '+str(self.id)+' reached waypoint ' + str(self.dest[-1]))
+                self.setDest(self.waypoints.popleft())
 
     def position(self):
         pos = [self.x[-1],self.y[-1],self.z[-1]] # current position
@@ -230,12 +397,18 @@ class UAV:
             logger.error("Trying to remove UAV "+str(self.id)+" from active_uavs failed")
             active_ids = [uav.id for uav in UAV.active_uavs]
             logger.error("Active IDs are "+str(active_ids))
+        UAV.null_uavs.append(self)
         self._remove3D()
         self._removeCamera()
+        self._releaseRing()
+        for function, batch in HOOKS['on_uav_deactivated']:
+            if not batch:
+                function(self)
 
     def setDest(self, xyz):
         if xyz == None:
             logger.error('Invalid Input - Input is None type')
+            return
         elif len(xyz) == 2:
             xyz.append(self.default_altitude)
         elif len(xyz) == 3:
@@ -246,6 +419,29 @@ class UAV:
         
         if self.dest[-1] != xyz:
             self.dest.append(xyz)
+            if self.dest_history.maxlen:
+                if self._dest_count % self.dest_decimation == 0:
+                    self.dest_history.append(xyz)
+                self._dest_count += 1
+
+    def addWaypoint(self, xyz):
+        """Queue a destination, the UAV flies to it once the destinations before it are reached."""
+        if len(self.waypoints) >= self.waypoint_capacity:
+            logger.error("Waypoint queue of UAV # "+str(self.id)+" is full, dropping waypoint "+str(xyz))
+            return 0
+        if len(xyz) == 2:
+            xyz = list(xyz) + [self.default_altitude]
+        self.waypoints.append(xyz)
+        return 1
+
+    def setRoute(self, waypoints):
+        """Replace the current destination and queued waypoints with a route of [x,y(,z)] points."""
+        self.waypoints.clear()
+        if not waypoints:
+            return
+        self.setDest(list(waypoints[0]))
+        for xyz in waypoints[1:]:
+            self.addWaypoint(xyz)
 
 
     def setCar(self, car, default_altitude=40):
@@ -253,7 +449,7 @@ class UAV:
             self.car = car
             if self.car == None:
                 logger.info('Cancelling car following for UAV with ID# '+str(self.id))
-                self.mission == 'hold'
+                self.mission = 'hold'
             else:
                 logger.info('Setting UAV with ID# '+str(self.id)+' to follow car with ID# ' + str(car.id))
                 self.mission = 'car_follow' # actively track vehicle, possibly fly ahead to scout
@@ -338,22 +534,14 @@ class UAV:
             sim_mult = self.sim['mult']
 
         dt = (TIME - self.time[-1])
+        if dt <= 0:
+            logger.debug("UAV # "+str(self.id)+" already simulated up to "+str(self.time[-1]))
+            return
         time_steps = int(sim_mult)
         sim_freq = sim_mult/dt
 
-        if len(self.x)<2:
-            self.sim['time'] = [0]
-            self.sim['x'] = self.x
-            self.sim['xd'] = [0]
-            self.sim['y'] = self.y
-            self.sim['yd'] = [0]
-            self.sim['z'] = self.z
-            self.sim['zd'] = [0]
-            self.sim['xyzd'] = [0]
-            self.sim['xyzdd'] = [0]
-
-            self.sim['err_mag'] = []
-            self.sim['err_dir'] = []
+        if 'xyzd' not in self.sim:
+            self._initSim()
 
         for i in range(time_steps):
             # self.sim['time'].append(self.sim['time'][-1] + 1/sim_freq)
@@ -369,15 +557,8 @@ class UAV:
             self.sim['err_dir'] = [error_direction]
             pitch = 90 * error_direction[2]
             roll = 0
-            if error_direction[0] == 0:
-                yaw = 0
-            elif error_direction[1] == 0:
-                yaw = 90
-            else:
-                yaw = np.degrees(np.arctan(error_direction[1]/error_direction[0]))
-                if yaw < 0:
-                    yaw += 360
-            
+            yaw = math.degrees(math.atan2(error_direction[1], error_direction[0])) % 360
+
             self.heading = [pitch, roll, yaw]
             # self.sim['err_mag'].append(error_magnitude)
             # self.sim['err_dir'].append(error_direction)
@@ -430,81 +611,14 @@ class UAV:
 
 
             elif sim_type == "FO":
-                ## Use simple position based first order model with proportional control for uav. No saturation on velocity or acceleration
-                K=1.5
-                tau = 2
-                
-                newPosX = K*(1-math.exp(-dt/tau))*self._dist_errx[-1] + self.x[-1]
-                newPosY = K*(1-math.exp(-dt/tau))*self._dist_erry[-1] + self.y[-1]
-                newPosZ = K*(1-math.exp(-dt/tau))*self._dist_errz[-1] + self.z[-1]
-
-
+                ## position based first order model with proportional control. The velocity is saturated on its magnitude
+                K, tau = self.sim['fo']
+                gain = K*(1-math.exp(-1/(sim_freq*tau)))*sim_freq
+                vel, saturated = _saturate([gain*err_x, gain*err_y, gain*err_z], self.max_speed)
+                self._move(vel, sim_freq)
 
             elif sim_type == "PID":
-                ## calculate PID controller output (saturation causes integration to turn off to prevent windup)
-                integ_len = 300
-                if self.sat_flagx == 1:
-                    desired_vel_x = self._PID(self._dist_errx,1,dt)
-                else:
-                    desired_vel_x = self._PID(self._dist_errx,integ_len,dt)
-
-                if self.sat_flagy == 1:
-                    desired_vel_y = self._PID(self._dist_erry,1,dt)
-                else:
-                    desired_vel_y = self._PID(self._dist_erry,integ_len,dt)
-
-                if self.sat_flagz == 1:
-                    desired_vel_z = self._PID(self._dist_errz,1,dt)
-                else:
-                    desired_vel_z = self._PID(self._dist_errz,integ_len,dt)
-
-                # desired_vel_x = self._PID(self._dist_errx,self.sat_idx_x,dt)
-                # desired_vel_y = self._PID(self._dist_erry,self.sat_idx_y,dt)
-                # desired_vel_z = self._PID(self._dist_errz,self.sat_idx_z,dt)
-
-                ### Impose saturation on state variables
-                self.sat_flagx = 0
-                self.sat_flagy = 0
-                self.sat_flagz = 0
-
-                # simplified second order model
-                # this is not correct, max acceleration is for resulting (x,y,z) vector e.g. sqrt(x^2+y^2+z^2)
-                if abs((desired_vel_x-speedx)/dt) > self.max_acc:
-                    desired_vel_x = math.copysign(1,desired_vel_x)*(self.max_acc * dt) + speedx
-                    self.sat_flagx = 1
-                    self.sat_idx_x = len(self._dist_errx)
-                if abs((desired_vel_y-speedy)/dt) > self.max_acc:
-                    desired_vel_y = math.copysign(1,desired_vel_y)*(self.max_acc * dt) + speedy
-                    self.sat_flagy = 1
-                    self.sat_idx_y = len(self._dist_erry)
-                if abs((desired_vel_z-speedz)/dt) > self.max_acc:
-                    desired_vel_z = math.copysign(1,desired_vel_z)*(self.max_acc * dt) + speedz
-                    self.sat_flagz = 1
-                    self.sat_idx_z = len(self._dist_errz)
-
-                # this is not correct, max speed is for resulting (x,y) vector e.g. sqrt(x^2+y^2)
-                if abs(desired_vel_x) > self.max_speed:
-                    desired_vel_x = math.copysign(1,desired_vel_x)*self.max_speed
-                    self.sat_flagx = 1
-                    self.sat_idx_x = len(self._dist_errx)
-                if abs(desired_vel_y) > self.max_speed:
-                    desired_vel_y = math.copysign(1,desired_vel_y)*self.max_speed
-                    self.sat_flagy = 1
-                    self.sat_idx_y = len(self._dist_erry)
-                if desired_vel_z > self.max_ascent:
-                    desired_vel_z = self.max_ascent
-                    self.sat_flagz = 1
-                    self.sat_idx_z = len(self._dist_errz)
-                elif desired_vel_z < -1*self.max_descent:
-                    desired_vel_z = -1*self.max_descent
-                    self.sat_flagz = 1
-                    self.sat_idx_z = len(self._dist_errz)
-
-                newPosX = desired_vel_x * dt + self.x[-1]
-                newPosY = desired_vel_y * dt + self.y[-1]
-                newPosZ = desired_vel_z * dt + self.z[-1]
-
-
+                self._move(self._PID([err_x, err_y, err_z], sim_freq), sim_freq)
 
         self.x.append(self.sim['x'][-1])
         self.y.append(self.sim['y'][-1])
@@ -513,45 +627,73 @@ class UAV:
 
 
 
-    def _integrate(self,err_list,integ_len):
-        result = 0
-
-        if len(err_list) < integ_len:
-            for val in err_list:
-                result = result + val
+    def _initSim(self):
+        self.sim['time'] = [0]
+        self.sim['x'] = self.x
+        self.sim['xd'] = [0]
+        self.sim['y'] = self.y
+        self.sim['yd'] = [0]
+        self.sim['z'] = self.z
+        self.sim['zd'] = [0]
+        self.sim['xyzd'] = [0]
+        self.sim['xyzdd'] = [0]
+
+        self.sim['err_mag'] = []
+        self.sim['err_dir'] = []
+        self.sim['err_prev'] = None
+
+    def _move(self, vel, sim_freq):
+        self.sim['xd'] = [vel[0]]
+        self.sim['x'] = [vel[0]/sim_freq + self.sim['x'][-1]]
+        self.sim['yd'] = [vel[1]]
+        self.sim['y'] = [vel[1]/sim_freq + self.sim['y'][-1]]
+        self.sim['zd'] = [vel[2]]
+        self.sim['z'] = [vel[2]/sim_freq + self.sim['z'][-1]]
+        self.sim['xyzd'][-1] = (vel[0]**2 + vel[1]**2 + vel[2]**2)**0.5
+
+    def _PID(self, err, sim_freq):
+        ## PID controller on the distance error vector, the output is the desired velocity vector.
+        ## The integral covers the last integ_len substeps (ring buffer with a running sum).
+        ## Saturation applies to the magnitude of the acceleration and velocity vectors. While the output
+        ## is saturated the error is not integrated (anti-windup)
+        Kp, Ki, Kd = self.sim['pid']
+        block, row = self._ring()
+        integral = block.sums[row]
+        prev = self.sim['err_prev'] or err
+        vel = [Kp*err[i] + Ki*integral[i] + Kd*(err[i]-prev[i])*sim_freq for i in range(3)]
+
+        speed = [self.sim['xd'][-1], self.sim['yd'][-1], self.sim['zd'][-1]]
+        acc, sat_acc = _saturate([(vel[i]-speed[i])*sim_freq for i in range(3)], self.max_acc)
+        vel = [speed[i] + acc[i]/sim_freq for i in range(3)]
+        sat_z = True
+        if vel[2] > self.max_ascent:
+            vel[2] = self.max_ascent
+        elif vel[2] < -1*self.max_descent:
+            vel[2] = -1*self.max_descent
         else:
-            for val in err_list[-integ_len:-1]:
-                result = result + val
-
-        return result
-
-    def _PID(self,err_list,integ_len,dt):
-        ## PID controller gain values
-        Kp = .11
-        Ki = 0
-        Kd = 0
-
-        result = Kp*err_list[-1] + Ki*(self._integrate(err_list,integ_len)) + Kd*(err_list[-1]-err_list[-2])/dt
-
-        return result
+            sat_z = False
+        vel, sat_vel = _saturate(vel, self.max_speed)
 
-    # def _PID(self,err_list,integ_idx,dt):
-    #     ## PID controller gain values
-    #     Kp = .115
-    #     Ki = .8
-    #     Kd = 0
-
-    #     result = Kp*err_list[-1] + Ki*(self._integrate(err_list,integ_idx)) + Kd*(err_list[-1]-err_list[-2])/dt
-
-    #     return result
-
-    # def _integrate(self,err_list,integ_idx):
-    #     result = 0
-
-    #     for val in err_list[integ_idx:-1]:
-    #         result = result + val
-
-    #     return result
+        if sat_acc or sat_z or sat_vel:
+            block.push(np.array([row]), np.zeros((1, 3)))
+        else:
+            block.push(np.array([row]), np.array([err])/sim_freq)
+        self.sim['err_prev'] = err
+        return vel
+
+    def _ring(self):
+        # integrator state of the PID model, allocated on first use
+        if 'ring' not in self.sim:
+            block = _RINGS.get(self.sim['integ_len'])
+            if block is None:
+                block = _RINGS[self.sim['integ_len']] = _RingBlock(self.sim['integ_len'])
+            self.sim['ring'] = (block, block.allocate())
+        return self.sim['ring']
+
+    def _releaseRing(self):
+        if 'ring' in self.sim:
+            block, row = self.sim.pop('ring')
+            block.release(row)
 
     def _dist(self, loc1, loc2):
         # Calculate Euclidian Distance
@@ -572,7 +714,7 @@ class UAV:
 
     def _add3D(self):
         if not self.model3D:
-            model = next((model for model in Model.all_models if model.agent == None), None)
+            model = Model.pool.acquire()
             if model:
                 model.assign(self)
                 self.model3D = model
@@ -592,7 +734,7 @@ class UAV:
     
     def _addCamera(self):
         if not self.camera:
-            cam = next((camera for camera in Camera.all_cameras if camera.agent == None), None)
+            cam = Camera.pool.acquire()
             if cam:
                 cam.assign(self)
                 self.camera = cam
@@ -606,42 +748,356 @@ class UAV:
             self.camera = None
 
 
+class Fleet:
+    """Integrates the dynamics of all active UAVs together.
+
+    The states of the UAVs (position, velocity, destination and the limits from their Skill) are
+    gathered into NumPy arrays, all substeps of the sim_type model are advanced for every UAV
+    at once and the results are scattered back to the UAV objects. The arrays of the last
+    step are kept as attributes.
+
+    Attributes:
+        ids:(array) ids of the integrated UAVs, in row order
+        pos:(array) positions [x,y,z] after the last step, one row per UAV
+        vel:(array) velocities [xd,yd,zd] after the last step
+        dest:(array) destinations [x,y,z] used in the last step
+        speed:(array) speed of every UAV
+        max_speed:(array) max speed of every UAV
+        max_acc:(array) max acceleration of every UAV
+        heading:(array) [pitch, roll, yaw] of every UAV
+    """
+    models = ("ZO", "FO", "PID")
+
+    def __init__(self):
+        # empty until the first vectorized step, so that importing this module does not import numpy
+        self.ids = []
+        self.pos = []
+        self.vel = []
+        self.dest = []
+        self.speed = []
+        self.max_speed = []
+        self.max_acc = []
+        self.heading = []
+
+    def update(self, uavs):
+        """Advance the dynamics of the given UAVs to TIME.
+
+        UAVs are grouped by sim_type (and integ_len for PID). UAVs with a sim_type the fleet cannot
+        vectorize, or groups smaller than FLEET_MIN_SIZE, are integrated one at a time with UAV._simXYZ().
+        """
+        groups = dict()
+        for uav in uavs:
+            key = (uav.sim['type'], uav.sim['integ_len'] if uav.sim['type'] == "PID" else None)
+            groups.setdefault(key, []).append(uav)
+        for (sim_type, integ_len), group in groups.items():
+            if sim_type in self.models and len(group) >= FLEET_MIN_SIZE:
+                self._step(group, sim_type)
+            else:
+                for uav in group:
+                    uav._simXYZ()
+
+    def _gather(self, uavs):
+        # one row per UAV: x y z, destination x y z, xd yd zd, speed, max speed, max acceleration,
+        # max ascent, max descent, dt, sim_mult
+        rows = []
+        for uav in uavs:
+            if 'xyzd' not in uav.sim:
+                uav._initSim()
+            sim = uav.sim
+            dest = uav.dest[-1]
+            rows.append([sim['x'][-1], sim['y'][-1], sim['z'][-1], dest[0], dest[1], dest[2],
+                         sim['xd'][-1], sim['yd'][-1], sim['zd'][-1], sim['xyzd'][-1], uav.max_speed, uav.max_acc,
+                         uav.max_ascent, uav.max_descent, TIME - uav.time[-1], int(sim['mult'])])
+        state = np.array(rows, dtype=float).reshape(-1, 16)
+        self.ids = np.array([uav.id for uav in uavs], dtype=int)
+        self.pos = state[:, 0:3].copy()
+        self.dest = state[:, 3:6].copy()
+        self.vel = state[:, 6:9].copy()
+        self.speed = state[:, 9].copy()
+        self.max_speed = state[:, 10].copy()
+        self.max_acc = state[:, 11].copy()
+        self.heading = np.zeros((len(uavs), 3))
+        return state[:, 12:14], state[:, 14].copy(), state[:, 15].astype(int)
+
+    def _step(self, uavs, sim_type):
+        # same models as UAV._simXYZ, for all UAVs at once
+        climb, dt, mult = self._gather(uavs)
+        moving = dt > 0
+        sim_freq = np.where(moving, mult / np.where(moving, dt, 1), 1)
+        err_mag = np.zeros(len(uavs))
+        err_dir = np.zeros_like(self.pos)
+        err_prev = None
+        if sim_type == "FO":
+            fo = np.array([uav.sim['fo'] for uav in uavs], dtype=float).reshape(-1, 2)
+        elif sim_type == "PID":
+            gains = np.array([uav.sim['pid'] for uav in uavs], dtype=float).reshape(-1, 3)
+            rings = [uav._ring() for uav in uavs]
+            block = rings[0][0]
+            ring_rows = np.array([row for ring_block, row in rings], dtype=int)
+            err_prev = np.array([uav.sim['err_prev'] or [np.nan]*3 for uav in uavs], dtype=float).reshape(-1, 3)
+
+        for i in range(mult.max() if len(mult) else 0):
+            substep = moving & (i < mult)
+            err = self.dest - self.pos
+            magnitude = np.sqrt((err ** 2).sum(axis=1))
+            direction = err / np.where(magnitude != 0, magnitude, 1)[:, None]
+
+            if sim_type == "ZO":
+                desired_acc = np.minimum(magnitude * sim_freq ** 2, self.max_acc)
+                speed = np.minimum(desired_acc * sim_freq + self.speed, self.max_speed)
+                vel = speed[:, None] * direction
+            elif sim_type == "FO":
+                gain = fo[:, 0] * (1 - np.exp(-1 / (sim_freq * fo[:, 1]))) * sim_freq
+                vel, saturated = _clipNorm(gain[:, None] * err, self.max_speed)
+                speed = np.sqrt((vel ** 2).sum(axis=1))
+            else:
+                prev = np.where(np.isnan(err_prev), err, err_prev)
+                vel = gains[:, 0:1] * err + gains[:, 1:2] * block.sums[ring_rows] + gains[:, 2:3] * (err - prev) * sim_freq[:, None]
+                acc, sat_acc = _clipNorm((vel - self.vel) * sim_freq[:, None], self.max_acc)
+                vel = self.vel + acc / sim_freq[:, None]
+                vel_z = np.clip(vel[:, 2], -climb[:, 1], climb[:, 0])
+                sat_z = vel_z != vel[:, 2]
+                vel[:, 2] = vel_z
+                vel, sat_vel = _clipNorm(vel, self.max_speed)
+                speed = np.sqrt((vel ** 2).sum(axis=1))
+                integrate = np.where((sat_acc | sat_z | sat_vel)[:, None], 0, err / sim_freq[:, None])
+                block.push(ring_rows[substep], integrate[substep])
+                err_prev = np.where(substep[:, None], err, err_prev)
+
+            rows = substep[:, None]
+            self.pos = np.where(rows, vel / sim_freq[:, None] + self.pos, self.pos)
+            self.vel = np.where(rows, vel, self.vel)
+            self.speed = np.where(substep, speed, self.speed)
+            err_mag = np.where(substep, magnitude, err_mag)
+            err_dir = np.where(rows, direction, err_dir)
+            yaw = np.degrees(np.arctan2(direction[:, 1], direction[:, 0])) % 360
+            self.heading = np.where(rows, np.column_stack([90 * direction[:, 2], np.zeros(len(uavs)), yaw]), self.heading)
+
+        self._scatter(uavs, moving, err_mag, err_dir, err_prev)
+
+    def _scatter(self, uavs, moving, err_mag, err_dir, err_prev=None):
+        # one row per UAV: x y z, xd yd zd, speed, error magnitude, error direction, pitch roll yaw
+        rows = np.column_stack([self.pos, self.vel, self.speed, err_mag, err_dir, self.heading]).tolist()
+        if err_prev is not None:
+            err_prev = err_prev.tolist()
+        for i, (uav, row, move) in enumerate(zip(uavs, rows, moving.tolist())):
+            if not move:
+                logger.debug("UAV # "+str(uav.id)+" already simulated up to "+str(uav.time[-1]))
+                continue
+            sim = uav.sim
+            sim['x'] = [row[0]]
+            sim['y'] = [row[1]]
+            sim['z'] = [row[2]]
+            sim['xd'] = [row[3]]
+            sim['yd'] = [row[4]]
+            sim['zd'] = [row[5]]
+            sim['xyzd'][-1] = row[6]
+            sim['err_mag'] = [row[7]]
+            sim['err_dir'] = [row[8:11]]
+            if err_prev is not None:
+                sim['err_prev'] = err_prev[i]
+            uav.heading = row[11:14]
+            uav.x.append(row[0])
+            uav.y.append(row[1])
+            uav.z.append(row[2])
+            uav.time.append(TIME)
+
+
+class _RingBlock:
+    """Ring buffers of [x,y,z] vectors with running sums, one row per buffer.
+
+    All buffers of the same size share one block so that the fleet can push to many of them at once.
+    Pushing and reading a sum are O(1). The sum of a buffer is recomputed whenever the buffer wraps
+    around so that rounding errors do not accumulate.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.data = np.zeros((0, size, 3))
+        self.sums = np.zeros((0, 3))
+        self.idx = np.zeros(0, dtype=int)
+        self._free = []
+
+    def allocate(self):
+        if not self._free:
+            n = len(self.idx)
+            grow = max(n, 8)
+            self.data = np.concatenate([self.data, np.zeros((grow, self.size, 3))])
+            self.sums = np.concatenate([self.sums, np.zeros((grow, 3))])
+            self.idx = np.concatenate([self.idx, np.zeros(grow, dtype=int)])
+            self._free = list(range(n + grow - 1, n - 1, -1))
+        return self._free.pop()
+
+    def release(self, row):
+        self.data[row] = 0
+        self.sums[row] = 0
+        self.idx[row] = 0
+        self._free.append(row)
+
+    def push(self, rows, values):
+        """Push one vector to each of the given rows, the oldest vector of a full buffer is dropped."""
+        idx = self.idx[rows]
+        self.sums[rows] += values - self.data[rows, idx]
+        self.data[rows, idx] = values
+        idx = (idx + 1) % self.size
+        self.idx[rows] = idx
+        wrapped = rows[idx == 0]
+        if len(wrapped):
+            self.sums[wrapped] = self.data[wrapped].sum(axis=1)
+
+
+_RINGS = dict() # integ_len -> _RingBlock
+
+
+def _saturate(vector, limit):
+    # limit the magnitude of a vector, returns the vector and whether it was limited
+    magnitude = (vector[0]**2 + vector[1]**2 + vector[2]**2)**0.5
+    if magnitude > limit:
+        return [v*limit/magnitude for v in vector], True
+    return vector, False
+
+
+def _clipNorm(vectors, limits):
+    # _saturate() for one vector per row
+    magnitude = np.sqrt((vectors ** 2).sum(axis=1))
+    saturated = magnitude > limits
+    scale = np.where(saturated, limits / np.where(saturated, magnitude, 1), 1)
+    return vectors * scale[:, None], saturated
+
+
+FLEET = Fleet()
+
+
+class _Pool:
+    """Hands out the unassigned objects of a pool of Models or Cameras in O(1).
+
+    Unassigned objects wait in a queue, released objects go to its end. The active list is the class
+    registry itself (e.g. Model.active_models), an object is removed from it by moving the last
+    object into its place.
+    """
+
+    def __init__(self, active):
+        self.active = active
+        self.free = deque()
+        self.next_id = 0
+        self._index = dict() # id -> position in active
+
+    def newId(self):
+        self.next_id += 1
+        return self.next_id - 1
+
+    def add(self, obj):
+        self.free.append(obj)
+
+    def acquire(self):
+        while self.free:
+            obj = self.free.popleft()
+            if obj.agent == None: # objects assigned with assign() directly are still queued
+                return obj
+        return None
+
+    def activate(self, obj):
+        self._index[obj.id] = len(self.active)
+        self.active.append(obj)
+
+    def release(self, obj):
+        idx = self._index.pop(obj.id)
+        last = self.active.pop()
+        if last is not obj:
+            self.active[idx] = last
+            self._index[last.id] = idx
+        self.free.append(obj)
+
+
+def _setAttributes(collection, items):
+    # items are (COM object, [(attribute, value), ...]) in key order. If they are all the objects
+    # of the collection the attributes are set with one SetMultipleAttributes call
+    if not items:
+        return
+    if len(items) > 1 and collection.Count == len(items):
+        attributes = [attribute for attribute, value in items[0][1]]
+        collection.SetMultipleAttributes(attributes, [[value for attribute, value in values] for obj, values in items])
+    else:
+        for obj, values in items:
+            for attribute, value in values:
+                obj.SetAttValue(attribute, value)
+
+
+def prewarm(num_models=0, num_cameras=0, filepath=None, model_scale=1, camera_parameters=None):
+    """Create pools of 3D models and cameras before the simulation starts.
+
+    UAVs take their model/camera from these pools, so creating them up front keeps the cost out of the
+    simulation loop. If the network holds no other static 3D models, camera positions or storyboards
+    the attributes of the whole pool are set with one SetMultipleAttributes call per collection.
+
+    Args:
+        num_models:(int) number of 3D models to create
+        num_cameras:(int) number of cameras (with storyboard and keyframe) to create
+        filepath:(string) path to the 3D model file
+        model_scale:(float) scale of the 3D models
+        camera_parameters:(dict) overrides of CAMERA_DEFAULT for the cameras
+    """
+    models = [Model(filepath, model_scale, batch=True) for i in range(num_models)]
+    _setAttributes(Vissim.Net.Static3DModels, [(model.model, model._attributes) for model in models])
+    cameras = [Camera(parameters=camera_parameters, batch=True) for i in range(num_cameras)]
+    _setAttributes(Vissim.Net.CameraPositions, [(camera.camera, camera._attributes) for camera in cameras])
+    _setAttributes(Vissim.Net.Storyboards, [(camera.storyboard, camera._storyboard_attributes) for camera in cameras])
+    logger.info("Created "+str(num_models)+" models and "+str(num_cameras)+" cameras")
+    return models, cameras
+
+
 class Model:
     all_models = []
     active_models = []
+    pool = _Pool(active_models)
 
     def __eq__(self, other):
         return self.id == other.id
 
-    def __init__(self, filepath, model_scale=1, pos=[0,0,-100], yaw_offset=0):
+    def __init__(self, filepath, model_scale=1, pos=[0,0,-100], yaw_offset=0, batch=False):
+        # batch=True leaves setting the attributes to the caller, see prewarm()
         model = Vissim.Net.Static3DModels.AddStatic3DModel(0, filepath, 'Point(0, 0, 0)')
-        model.SetAttValue('CoordX', pos[0])
-        model.SetAttValue('CoordY', pos[1])
-        model.SetAttValue('CoordZOffset', pos[2])
-        model.SetAttValue('Scale', model_scale)
+        self._attributes = [
+            ('CoordX', pos[0]),
+            ('CoordY', pos[1]),
+            ('CoordZOffset', pos[2]),
+            ('Scale', model_scale),
+            ('YawAngle', yaw_offset%360),
+        ]
+        if not batch:
+            _setAttributes(Vissim.Net.Static3DModels, [(model, self._attributes)])
         self.model = model
+        self.no = model.AttValue('No') # key in Static3DModels
+        self.pose = (pos[0], pos[1], pos[2], yaw_offset%360) # last pose sent to Vissim
         self.agent = None
         self.update_rate = 1
         self.update_counter = 1
         self.yaw_offset = yaw_offset
-        if not self.all_models:
-            self.id = 0
-        else:
-            max_id = max([model.id for model in self.all_models])
-            self.id = max_id + 1
+        self.id = Model.pool.newId()
         Model.all_models.append(self)
+        Model.pool.add(self)
+
+    def __getstate__(self):
+        # COM handles cannot be pickled (see ptv_sim.checkpoint), __setstate__ gets them from Vissim again
+        state = self.__dict__.copy()
+        state['model'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.model = Vissim.Net.Static3DModels.ItemByKey(self.no)
 
     def assign(self,agent):
         if self.agent == None:
             self.agent = agent
-            Model.active_models.append(self)
+            Model.pool.activate(self)
         else:
             logger.error("Model already assigned to agent with ID #"+str(agent.id))
 
     def unassign(self):
         if self.agent != None:
             self.agent = None
-            Model.active_models.remove(self)
+            Model.pool.release(self)
         else:
             logger.error("Model not assigned to agent with ID #"+str(agent.id))
 
@@ -653,82 +1109,115 @@ class Model:
 
         if self.agent != None:
             if self.update_counter/self.update_rate >= 1:
-                point = "Point(" + str(self.agent.x[-1]) + ", " + str(self.agent.y[-1]) + ", " + str(self.agent.z[-1]) + ")"
-                self.model.SetAttValue('CoordWktPoint3D', point)
-                # self.model.SetAttValue('CoordX',self.agent.x[-1])
-                # self.model.SetAttValue('CoordY',self.agent.y[-1])
-                # self.model.SetAttValue('CoordZOffset',self.agent.z[-1])
-
-                # self.model.SetAttValue('PitchAngle', )
-                # self.model.SetAttValue('RollAngle', )
-                self.model.SetAttValue('YawAngle', (self.agent.heading[2]+self.yaw_offset)%360)
+                started = instrument.start()
+                pose = self._pose()
+                if _poseChanged(self.pose, pose):
+                    self._write(pose)
                 self.update_counter = 1
+                instrument.stop('model.update', started, 1)
             else:
                 self.update_counter += 1
         else:
             logger.error("Model not assigned to agent with ID #"+str(agent.id))
 
+    def _pose(self):
+        return (self.agent.x[-1], self.agent.y[-1], self.agent.z[-1], (self.agent.heading[2]+self.yaw_offset)%360)
+
+    def _write(self, pose):
+        self.model.SetAttValue('CoordWktPoint3D', _wkt(pose))
+        # self.model.SetAttValue('PitchAngle', )
+        # self.model.SetAttValue('RollAngle', )
+        self.model.SetAttValue('YawAngle', pose[3])
+        self.pose = pose
+
 
 
 class Camera:
     all_cameras = []
     active_cameras = []
+    pool = _Pool(active_cameras)
 
     def __eq__(self, other):
         return self.id == other.id
 
-    def __init__(self, num_cameras=1, parameters=None):
+    def __init__(self, num_cameras=1, parameters=None, batch=False):
         # may need to delete all existing cameras and storyboards
+        # batch=True leaves setting the camera and storyboard attributes to the caller, see prewarm()
         camera_default = CAMERA_DEFAULT
         if parameters != None:
             for param in parameters:
                 camera_default[param] = parameters[param]
 
         camera = Vissim.Net.CameraPositions.AddCameraPosition(0, 'Point(0, 0, 0)') 
-        camera.SetAttValue('CoordX', camera_default['Pos'][0])
-        camera.SetAttValue('CoordY', camera_default['Pos'][1])
-        camera.SetAttValue('CoordZ', camera_default['Pos'][2])
-        camera.SetAttValue('FOV', camera_default['FOV'])
-        camera.SetAttValue('PitchAngle', camera_default['PitchAngle'])
-        camera.SetAttValue('RollAngle', camera_default['RollAngle'])
-        camera.SetAttValue('YawAngle', camera_default['YawAngle'])
+        self._attributes = [
+            ('CoordX', camera_default['Pos'][0]),
+            ('CoordY', camera_default['Pos'][1]),
+            ('CoordZ', camera_default['Pos'][2]),
+            ('FOV', camera_default['FOV']),
+            ('PitchAngle', camera_default['PitchAngle']),
+            ('RollAngle', camera_default['RollAngle']),
+            ('YawAngle', camera_default['YawAngle']),
+        ]
+        if not batch:
+            _setAttributes(Vissim.Net.CameraPositions, [(camera, self._attributes)])
         self.camera = camera
+        self.no = camera.AttValue('No') # key in CameraPositions
+        self.fov = camera_default['FOV'] # kept for the coverage module
+        self.pitch = camera_default['PitchAngle']
+        self.roll = camera_default['RollAngle']
+        self.res = (camera_default['ResX'], camera_default['ResY'])
+        self.pose = tuple(camera_default['Pos']) + (camera_default['YawAngle'],) # last pose sent to Vissim
         self.agent = None
         self.update_rate = 1
         self.update_counter = 1
         # define a unique id
-        if not self.all_cameras:
-            self.id = 0
-        else:
-            max_id = max([camera.id for camera in self.all_cameras])
-            self.id = max_id + 1
+        self.id = Camera.pool.newId()
         Camera.all_cameras.append(self)
+        Camera.pool.add(self)
 
         storyboard = Vissim.Net.Storyboards.AddStoryboard(0)
-        storyboard.SetAttValue('Filename', RESULTS_DIR+"Camera "+str(self.id)+".avi")
-        storyboard.SetAttValue('RecAVI', camera_default['RecAVI']) # create AVI file
-        storyboard.SetAttValue('ShowPrev', camera_default['ShowPrev']) # show preview of camera during sim
-        storyboard.SetAttValue('Resolution', 1) # specify user defined resolution. Must do this to specify x,y res
-        storyboard.SetAttValue('ResX', camera_default['ResX'])
-        storyboard.SetAttValue('ResY', camera_default['ResY'])
-        storyboard.SetAttValue('Framerate', camera_default['Framerate'])
+        self._storyboard_attributes = [
+            ('Filename', RESULTS_DIR+"Camera "+str(self.id)+".avi"),
+            ('RecAVI', camera_default['RecAVI']), # create AVI file
+            ('ShowPrev', camera_default['ShowPrev']), # show preview of camera during sim
+            ('Resolution', 1), # specify user defined resolution. Must do this to specify x,y res
+            ('ResX', camera_default['ResX']),
+            ('ResY', camera_default['ResY']),
+            ('Framerate', camera_default['Framerate']),
+        ]
+        if not batch:
+            _setAttributes(Vissim.Net.Storyboards, [(storyboard, self._storyboard_attributes)])
+        self.storyboard = storyboard
+        self.storyboard_no = storyboard.AttValue('No') # key in Storyboards
 
         keyframe = storyboard.Keyframes.AddKeyframe(0)
         keyframe.SetAttValue('CamPos', camera)
         keyframe.SetAttValue('StartTime', 1) # StartTime == 0 means that recording must be manually started from presentation tab
         keyframe.SetAttValue('DwellTime', 600)
 
+    def __getstate__(self):
+        # COM handles cannot be pickled (see ptv_sim.checkpoint), __setstate__ gets them from Vissim again
+        state = self.__dict__.copy()
+        state['camera'] = None
+        state['storyboard'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.camera = Vissim.Net.CameraPositions.ItemByKey(self.no)
+        self.storyboard = Vissim.Net.Storyboards.ItemByKey(self.storyboard_no)
+
     def assign(self,agent):
         if self.agent == None:
             self.agent = agent
-            Camera.active_cameras.append(self)
+            Camera.pool.activate(self)
         else:
             logger.error("Camera already assigned to agent with ID #"+str(agent.id))
 
     def unassign(self):
         if self.agent != None:
             self.agent = None
-            Camera.active_cameras.remove(self)
+            Camera.pool.release(self)
         else:
             logger.error("Camera not assigned to agent with ID #"+str(agent.id))
 
@@ -740,18 +1229,23 @@ class Camera:
 
         if self.agent != None:
             if self.update_counter/self.update_rate >= 1:
-                point = "Point(" + str(self.agent.x[-1]) + ", " + str(self.agent.y[-1]) + ", " + str(self.agent.z[-1]) + ")"
-                self.camera.SetAttValue('CoordWktPoint3D', point)
-                # self.camera.SetAttValue('CoordX',self.agent.x[-1])
-                # self.camera.SetAttValue('CoordY',self.agent.y[-1])
-                # self.camera.SetAttValue('CoordZ',self.agent.z[-1])
-
-                # self.model.SetAttValue('PitchAngle', )
-                # self.model.SetAttValue('RollAngle', )
-                self.camera.SetAttValue('YawAngle', self.agent.heading[2])
-
+                started = instrument.start()
+                pose = self._pose()
+                if _poseChanged(self.pose, pose):
+                    self._write(pose)
                 self.update_counter = 1
+                instrument.stop('camera.update', started, 1)
             else:
                 self.update_counter += 1
         else:
-            logger.error("Camera not assigned to agent with ID #"+str(agent.id))
\ No newline at end of file
+            logger.error("Camera not assigned to agent with ID #"+str(agent.id))
+
+    def _pose(self):
+        return (self.agent.x[-1], self.agent.y[-1], self.agent.z[-1], self.agent.heading[2])
+
+    def _write(self, pose):
+        self.camera.SetAttValue('CoordWktPoint3D', _wkt(pose))
+        # self.camera.SetAttValue('PitchAngle', )
+        # self.camera.SetAttValue('RollAngle', )
+        self.camera.SetAttValue('YawAngle', pose[3])
+        self.pose = pose
@@ -15,8 +15,10 @@ setup(name='py_ptv',
       packages=[
           'ptv_veh',
           'ptv_comm',
+          'ptv_sim',
       ],
       install_requires=[
           'pandas',
+          'numpy',
       ],
       zip_safe=False)